@@ -1,28 +1,133 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template, g
 import numpy as np
-from sklearn.ensemble import RandomForestRegressor
-import joblib
+import functools
 import os
 
+from serving import codecs
+from serving.batching import MicroBatcher, Overloaded
+from serving.cache import MemoryBackend, PredictionCache, RedisBackend
+from serving.forest import compile_forest
+from serving.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, NULL_TIMER, ServiceMetrics
+from serving.registry import DEFAULT_MODEL_PATH, open_registry
+
 app = Flask(__name__)
 
-# Initialize a dummy model (in production, you would load your trained model)
-model = RandomForestRegressor(n_estimators=100, random_state=42)
-X_dummy = np.random.rand(100, 4)
-y_dummy = np.random.rand(100)
-model.fit(X_dummy, y_dummy)
+# 'sklearn' predicts with the estimator itself; 'compiled' flattens forests for faster small batches
+PREDICT_ENGINE = os.environ.get('PREDICT_ENGINE', 'sklearn')
+if PREDICT_ENGINE not in ('sklearn', 'compiled'):
+    raise ValueError(f"Unknown PREDICT_ENGINE {PREDICT_ENGINE!r}")
+prepare_model = compile_forest if PREDICT_ENGINE == 'compiled' else None
+
+# Load the published model artifact; new versions are picked up without a restart
+MODEL_PATH = os.environ.get('MODEL_PATH', DEFAULT_MODEL_PATH)
+registry = open_registry(
+    MODEL_PATH,
+    check_interval=float(os.environ.get('MODEL_CHECK_INTERVAL', 5)),
+    prepare=prepare_model
+)
+
+
+def predict(features):
+    return registry.current().model.predict(features)
+
+
+# Per-stage latency histograms and error counts on /metrics; nothing is timed when disabled
+metrics = ServiceMetrics() if os.environ.get('PREDICT_METRICS', 'False') == 'True' else None
+
+# Coalesce concurrent single predictions into one model call per batch
+batcher = None
+if os.environ.get('PREDICT_BATCHING', 'False') == 'True':
+    batcher = MicroBatcher(
+        predict,
+        registry.current().model.n_features_in_,
+        max_batch_size=int(os.environ.get('PREDICT_BATCH_MAX_SIZE', 64)),
+        max_wait=float(os.environ.get('PREDICT_BATCH_MAX_WAIT_MS', 2)) / 1000,
+        max_queue=int(os.environ.get('PREDICT_BATCH_MAX_QUEUE', 10000)),
+        on_batch=metrics.observe_micro_batch if metrics is not None else None
+    )
+
+# Reuse predictions for repeated feature vectors: '' (off), 'memory' (per worker) or 'redis' (shared)
+PREDICT_CACHE = os.environ.get('PREDICT_CACHE', '')
+cache = None
+if PREDICT_CACHE:
+    ttl = float(os.environ.get('PREDICT_CACHE_TTL', 300))
+    if PREDICT_CACHE == 'memory':
+        backend = MemoryBackend(max_entries=int(os.environ.get('PREDICT_CACHE_SIZE', 100000)), ttl=ttl)
+    elif PREDICT_CACHE == 'redis':
+        backend = RedisBackend(os.environ.get('PREDICT_CACHE_URL', 'redis://localhost:6379/0'), ttl=ttl)
+    else:
+        raise ValueError(f"Unknown PREDICT_CACHE {PREDICT_CACHE!r}")
+    cache = PredictionCache(backend, decimals=int(os.environ.get('PREDICT_CACHE_DECIMALS', 6)))
+    registry.on_swap(cache.invalidate)
+    if metrics is not None:
+        metrics.add_collector(lambda: [
+            ('prediction_cache_hits_total', 'counter', 'Prediction cache hits.', cache.hits),
+            ('prediction_cache_misses_total', 'counter', 'Prediction cache misses.', cache.misses),
+            ('prediction_cache_errors_total', 'counter', 'Failed prediction cache operations.', cache.errors),
+        ])
+
+# Rows decoded and predicted at a time for binary and NDJSON batches
+STREAM_CHUNK_ROWS = int(os.environ.get('PREDICT_STREAM_CHUNK_ROWS', 8192))
+
+def instrumented(endpoint):
+    """Time a view's stages and record its status while metrics are enabled."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if metrics is None:
+                return view(*args, **kwargs)
+            g.stage_timer = timer = metrics.timer(endpoint)
+            response = app.make_response(view(*args, **kwargs))
+            metrics.finish(endpoint, timer, response.status_code)
+            return response
+        return wrapper
+    return decorator
+
+def stage_timer():
+    # The current request's StageTimer, or one that records nothing
+    return NULL_TIMER if metrics is None else g.get('stage_timer', NULL_TIMER)
+
+def observe_batch_rows(rows, batch_format):
+    if metrics is not None:
+        metrics.batch_rows.observe(rows, batch_format)
 
 # API endpoints for ML model serving
 @app.route('/api/predict/single', methods=['POST'])
+@instrumented('single')
 def predict_single():
+    timer = stage_timer()
     try:
         data = request.get_json()
-        features = np.array([data['features']])
-        prediction = model.predict(features)
-        return jsonify({
+        timer.mark('parse')
+        prediction = key = None
+        if cache is not None:
+            loaded = registry.current()
+            # Checked before the lookup, so a malformed row is refused even when its values are cached
+            key = cache.key(data['features'], loaded.version, loaded.model.n_features_in_)
+            prediction = cache.get(key)
+            timer.mark('cache')
+        if prediction is None:
+            if batcher is not None:
+                prediction = batcher.predict(data['features'])
+            else:
+                features = np.array([data['features']])
+                timer.mark('convert')
+                prediction = predict(features)[0]
+            timer.mark('predict')
+            if key is not None:
+                cache.set(key, prediction)
+                timer.mark('cache')
+        response = jsonify({
             'status': 'success',
-            'prediction': float(prediction[0])
+            'prediction': float(prediction)
         })
+        timer.mark('serialize')
+        return response
+    except Overloaded as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 503
     except Exception as e:
         return jsonify({
             'status': 'error',
@@ -30,21 +135,103 @@ def predict_single():
         }), 400
 
 @app.route('/api/predict/batch', methods=['POST'])
+@instrumented('batch')
 def predict_batch():
+    if request.mimetype == codecs.BINARY:
+        return predict_batch_binary()
+    if request.mimetype == codecs.NDJSON:
+        return predict_batch_ndjson()
+    timer = stage_timer()
     try:
         data = request.get_json()
+        timer.mark('parse')
         features = np.array(data['features'])
-        predictions = model.predict(features)
-        return jsonify({
+        timer.mark('convert')
+        observe_batch_rows(len(features), 'json')
+        predictions = predict(features)
+        timer.mark('predict')
+        response = jsonify({
             'status': 'success',
             'predictions': predictions.tolist()
         })
+        timer.mark('serialize')
+        return response
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
+def predict_batch_binary():
+    # Raw little-endian arrays in and out, predicted a chunk at a time
+    timer = stage_timer()
+    n_features = registry.current().model.n_features_in_
+    try:
+        rows, cols, dtype = codecs.parse_binary_headers(
+            request.headers.get(codecs.SHAPE_HEADER),
+            request.headers.get(codecs.DTYPE_HEADER),
+            request.content_length,
+            n_features
+        )
+        timer.mark('parse')
+        predictions = codecs.predict_binary(
+            request.stream, rows, cols, dtype, STREAM_CHUNK_ROWS, timer.timed(predict, 'predict')
+        )
+        timer.mark('decode')
     except Exception as e:
         return jsonify({
             'status': 'error',
             'message': str(e)
         }), 400
 
+    observe_batch_rows(rows, 'binary')
+    response = Response(codecs.encode_binary(predictions), mimetype=codecs.BINARY)
+    response.headers[codecs.SHAPE_HEADER] = str(rows)
+    response.headers[codecs.DTYPE_HEADER] = codecs.RESPONSE_DTYPE
+    timer.mark('serialize')
+    return response
+
+def predict_batch_ndjson():
+    # One feature list per line in, one prediction per line out
+    timer = stage_timer()
+    n_features = registry.current().model.n_features_in_
+    try:
+        predictions = codecs.predict_ndjson(
+            request.stream, n_features, STREAM_CHUNK_ROWS, timer.timed(predict, 'predict')
+        )
+        timer.mark('decode')
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
+    observe_batch_rows(len(predictions), 'ndjson')
+    # Lines are encoded as they are sent, after the request's stages are recorded
+    return Response(codecs.iter_ndjson(predictions, STREAM_CHUNK_ROWS), mimetype=codecs.NDJSON)
+
+@app.route('/api/model', methods=['GET'])
+def model_info():
+    # Version, load time and memory of the model in this worker
+    return jsonify(registry.describe())
+
+@app.route('/api/cache', methods=['GET'])
+def cache_info():
+    # Prediction cache hit rate in this worker
+    if cache is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, 'pid': os.getpid(), **cache.stats()})
+
+@app.route('/metrics', methods=['GET'])
+def metrics_export():
+    # Prometheus text format for this worker (enable with PREDICT_METRICS=True)
+    if metrics is None:
+        return jsonify({
+            'status': 'error',
+            'message': 'Metrics are disabled'
+        }), 404
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
 # Web page routes
 @app.route('/')
 def index():
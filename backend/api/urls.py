@@ -11,7 +11,8 @@ from documents.views import (
     DocumentViewSet, 
     CommentViewSet, 
     SharedDocumentViewSet,
-    DocumentVersionViewSet
+    DocumentVersionViewSet,
+    UploadSessionViewSet
 )
 
 # Create a router and register our viewsets
@@ -21,6 +22,7 @@ router.register(r'documents', DocumentViewSet)
 router.register(r'comments', CommentViewSet)
 router.register(r'shares', SharedDocumentViewSet)
 router.register(r'versions', DocumentVersionViewSet)
+router.register(r'uploads', UploadSessionViewSet)
 
 urlpatterns = [
     # JWT Authentication
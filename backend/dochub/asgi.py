@@ -1,5 +1,10 @@
 """
 ASGI config for dochub project.
+
+Serves the Django application, plus the document activity stream at
+``/api/events/`` over server-sent events or WebSocket::
+
+    uvicorn dochub.asgi:application
 """
 
 import os
@@ -8,4 +13,18 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dochub.settings')
 
-application = get_asgi_application()
\ No newline at end of file
+django_application = get_asgi_application()
+
+# Imported once Django is set up, as it loads models
+from documents.push import EVENTS_PATH, EventStreamApp  # noqa: E402
+
+events_application = EventStreamApp()
+
+
+async def application(scope, receive, send):
+    if scope['type'] in ('http', 'websocket') and scope['path'] == EVENTS_PATH:
+        await events_application(scope, receive, send)
+    elif scope['type'] == 'websocket':
+        await send({'type': 'websocket.close'})
+    else:
+        await django_application(scope, receive, send)
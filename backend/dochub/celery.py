@@ -0,0 +1,13 @@
+"""
+Celery application for dochub project.
+"""
+
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dochub.settings')
+
+app = Celery('dochub')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
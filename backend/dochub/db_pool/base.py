@@ -0,0 +1,125 @@
+"""
+PostgreSQL backend that keeps connections in a per-process pool.
+
+Django's persistent connections (``CONN_MAX_AGE``) belong to the thread
+that opened them. Under ASGI, sync views run in short-lived threads, so
+persistent connections are never reused and pile up until the server
+refuses new ones. With this backend, closing a connection returns it to a
+pool shared by every thread of the process, and the next request on any
+thread takes it from there. At most ``POOL['MAX_SIZE']`` connections are
+open at once; a request waits up to ``POOL['TIMEOUT']`` seconds for one.
+
+Use it with ``CONN_MAX_AGE = 0``, so connections go back to the pool at
+the end of every request.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+from django.db import OperationalError
+from django.db.backends.postgresql import base
+
+if base.is_psycopg3:
+    from psycopg.pq import TransactionStatus
+
+    TRANSACTION_IDLE = TransactionStatus.IDLE
+else:
+    from psycopg2.extensions import TRANSACTION_STATUS_IDLE as TRANSACTION_IDLE
+
+# Connections idle for longer than this are checked before reuse when CONN_HEALTH_CHECKS is on
+HEALTH_CHECK_AFTER = 5.0
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    """Idle connections of one database alias, bounded to ``max_size`` open at a time."""
+
+    def __init__(self, max_size, timeout, health_checks):
+        self.timeout = timeout
+        self.health_checks = health_checks
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+
+    def get(self, connect):
+        """Return an idle connection, or one from ``connect()`` if none is usable."""
+        if not self._slots.acquire(timeout=self.timeout):
+            raise OperationalError(f"No database connection became free within {self.timeout}s")
+        try:
+            while True:
+                with self._lock:
+                    if not self._idle:
+                        break
+                    connection, isolation_level, released = self._idle.pop()
+                if self._usable(connection, released):
+                    return connection, isolation_level
+                connection.close()
+            return connect()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def put(self, connection, isolation_level, discard=False):
+        """Return a connection taken with ``get()``, rolling back anything left open, or close it if ``discard``."""
+        try:
+            if not discard and not connection.closed:
+                if connection.info.transaction_status != TRANSACTION_IDLE:
+                    connection.rollback()
+                with self._lock:
+                    self._idle.append((connection, isolation_level, time.monotonic()))
+                return
+            connection.close()
+        except base.Database.Error:
+            connection.close()
+        finally:
+            self._slots.release()
+
+    def _usable(self, connection, released):
+        if connection.closed:
+            return False
+        if not self.health_checks or time.monotonic() - released < HEALTH_CHECK_AFTER:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            return True
+        except base.Database.Error:
+            return False
+
+
+def get_pool(alias, settings_dict):
+    """Return this process's pool for ``alias``, created on first use."""
+    # Keyed by process too, so forked workers never share their parent's sockets, and by
+    # database, as the test runner points the alias at the test database
+    key = (alias, os.getpid()) + tuple(settings_dict[name] for name in ('HOST', 'PORT', 'NAME', 'USER'))
+    with _pools_lock:
+        if key not in _pools:
+            options = settings_dict.get('POOL', {})
+            _pools[key] = ConnectionPool(
+                max_size=options.get('MAX_SIZE', 20),
+                timeout=options.get('TIMEOUT', 10),
+                health_checks=settings_dict['CONN_HEALTH_CHECKS']
+            )
+        return _pools[key]
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_new_connection(self, conn_params):
+        pool = get_pool(self.alias, self.settings_dict)
+        connection, self.isolation_level = pool.get(lambda: self._connect(conn_params))
+        return connection
+
+    def _connect(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        return connection, self.isolation_level
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                # Closed inside atomic(), the wrapper keeps referring to the connection, so it cannot be reused
+                get_pool(self.alias, self.settings_dict).put(
+                    self.connection, self.isolation_level, discard=self.in_atomic_block
+                )
@@ -82,9 +82,25 @@ DATABASES = {
         'PASSWORD': os.environ.get('DB_PASSWORD', 'postgres'),
         'HOST': os.environ.get('DB_HOST', 'localhost'),
         'PORT': os.environ.get('DB_PORT', '5432'),
+        # Seconds to keep a connection open across requests (0 closes it after each request)
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        # Check a persistent connection still works before reusing it
+        'CONN_HEALTH_CHECKS': os.environ.get('DB_CONN_HEALTH_CHECKS', 'True') == 'True',
     }
 }
 
+# Share connections between a process's threads through a pool, for ASGI servers whose
+# sync views run in short-lived threads that cannot keep persistent connections
+if os.environ.get('DB_POOL', 'False') == 'True':
+    DATABASES['default'].update({
+        'ENGINE': 'dochub.db_pool',
+        'CONN_MAX_AGE': 0,
+        'POOL': {
+            'MAX_SIZE': int(os.environ.get('DB_POOL_MAX_SIZE', 20)),
+            'TIMEOUT': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        },
+    })
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -103,6 +119,29 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+if os.environ.get('REDIS_CACHE_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': os.environ['REDIS_CACHE_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Seconds a resolved document share permission stays cached
+DOCUMENT_PERMISSION_CACHE_TIMEOUT = int(os.environ.get('DOCUMENT_PERMISSION_CACHE_TIMEOUT', 300))
+
+# Seconds a serialized document or user response stays cached (0 disables the response cache)
+DOCUMENT_RESPONSE_CACHE_TIMEOUT = int(os.environ.get('DOCUMENT_RESPONSE_CACHE_TIMEOUT', 300))
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
 
@@ -125,6 +164,40 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Hand document downloads to the front-end server: '', 'x-accel-redirect' (nginx) or 'x-sendfile'
+DOCUMENT_DOWNLOAD_SENDFILE = os.environ.get('DOCUMENT_DOWNLOAD_SENDFILE', '')
+# Internal nginx location that aliases MEDIA_ROOT, used with x-accel-redirect
+DOCUMENT_DOWNLOAD_ACCEL_PREFIX = os.environ.get('DOCUMENT_DOWNLOAD_ACCEL_PREFIX', '/protected-media/')
+
+# Store document versions as binary deltas against periodic full keyframes
+DOCUMENT_VERSION_DELTA_STORAGE = os.environ.get('DOCUMENT_VERSION_DELTA_STORAGE', 'False') == 'True'
+DOCUMENT_VERSION_KEYFRAME_INTERVAL = int(os.environ.get('DOCUMENT_VERSION_KEYFRAME_INTERVAL', 10))
+# Bytes of reconstructed delta versions kept in memory per process
+DOCUMENT_VERSION_CACHE_BYTES = int(os.environ.get('DOCUMENT_VERSION_CACHE_BYTES', 64 * 1024 * 1024))
+
+# Largest chunk accepted by the resumable upload API, in bytes
+UPLOAD_CHUNK_MAX_SIZE = int(os.environ.get('UPLOAD_CHUNK_MAX_SIZE', 64 * 1024 * 1024))
+
+# Most (document, user) pairs one bulk share or unshare request may cover
+DOCUMENT_BULK_SHARE_MAX_PAIRS = int(os.environ.get('DOCUMENT_BULK_SHARE_MAX_PAIRS', 100000))
+# Most comments one bulk create request may post
+DOCUMENT_BULK_COMMENT_LIMIT = int(os.environ.get('DOCUMENT_BULK_COMMENT_LIMIT', 1000))
+
+# Threads hashing and storing files, and rows per insert, for bulk document imports
+DOCUMENT_IMPORT_WORKERS = int(os.environ.get('DOCUMENT_IMPORT_WORKERS', 4))
+DOCUMENT_IMPORT_BATCH_SIZE = int(os.environ.get('DOCUMENT_IMPORT_BATCH_SIZE', 500))
+
+# Push channel for document activity: 'memory' (this process only) or 'redis' (every process)
+DOCUMENT_EVENTS_BROKER = os.environ.get('DOCUMENT_EVENTS_BROKER', 'memory')
+DOCUMENT_EVENTS_REDIS_URL = os.environ.get(
+    'DOCUMENT_EVENTS_REDIS_URL', os.environ.get('REDIS_CACHE_URL', 'redis://localhost:6379/2')
+)
+# Events queued per subscriber before it is told to refetch, seconds between
+# keep-alive comments on idle event streams, and open streams per worker
+DOCUMENT_EVENTS_QUEUE_SIZE = int(os.environ.get('DOCUMENT_EVENTS_QUEUE_SIZE', 100))
+DOCUMENT_EVENTS_HEARTBEAT = float(os.environ.get('DOCUMENT_EVENTS_HEARTBEAT', 15))
+DOCUMENT_EVENTS_MAX_CONNECTIONS = int(os.environ.get('DOCUMENT_EVENTS_MAX_CONNECTIONS', 10000))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -167,4 +240,15 @@ CORS_ALLOWED_ORIGINS = [
     'http://127.0.0.1:3000',
 ]
 
-CORS_ALLOW_CREDENTIALS = True
\ No newline at end of file
+CORS_ALLOW_CREDENTIALS = True
+
+# Celery settings
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
+CELERY_TASK_ALWAYS_EAGER = os.environ.get('CELERY_TASK_ALWAYS_EAGER', 'False') == 'True'
+CELERY_TASK_EAGER_PROPAGATES = True
+CELERY_TASK_ACKS_LATE = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
+# Document text extraction settings
+# Characters of extracted body text fed into a document's search vector
+DOCUMENT_SEARCH_BODY_LIMIT = int(os.environ.get('DOCUMENT_SEARCH_BODY_LIMIT', 500000))
\ No newline at end of file
@@ -0,0 +1,72 @@
+"""
+Resolve a user's effective permission on a document.
+
+The owner and public flag are read from the document row itself; only the
+share lookup needs a query. Its result is memoized on the request, so the
+permission class and the view share one answer, and cached across requests
+under the document's generation, which is bumped whenever one of its shares
+changes.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from .caching import get_generation
+
+# Effective permissions, weakest first
+PERMISSION_LEVELS = ('view', 'comment', 'edit', 'owner')
+
+# Cached in place of None for users the document is not shared with
+NOT_SHARED = ''
+
+
+def document_scope(document_id):
+    return f"document:{document_id}"
+
+
+def shared_permission(user_id, document_id):
+    """Return the permission of the share granting ``user_id`` the document, or None."""
+    from .models import SharedDocument
+
+    key = f"docperm:{get_generation(document_scope(document_id))}:{document_id}:{user_id}"
+    permission = cache.get(key)
+    if permission is None:
+        permission = SharedDocument.objects.filter(
+            document_id=document_id,
+            shared_with_id=user_id
+        ).values_list('permission', flat=True).first() or NOT_SHARED
+        cache.set(key, permission, settings.DOCUMENT_PERMISSION_CACHE_TIMEOUT)
+    return permission or None
+
+
+def effective_permission(user, document, request=None):
+    """
+    Return ``'owner'``, ``'edit'``, ``'comment'``, ``'view'`` or None.
+
+    Pass the request to reuse the answer for the rest of the request.
+    """
+    memo = getattr(request, '_document_permissions', None)
+    if request is not None and memo is None:
+        memo = request._document_permissions = {}
+    if memo is not None and document.pk in memo:
+        return memo[document.pk]
+
+    if not user.is_authenticated:
+        permission = None
+    elif document.owner_id == user.pk:
+        permission = 'owner'
+    else:
+        permission = shared_permission(user.pk, document.pk)
+    if permission is None and document.is_public:
+        permission = 'view'
+
+    if memo is not None:
+        memo[document.pk] = permission
+    return permission
+
+
+def has_document_permission(user, document, required, request=None):
+    """Return whether the user's effective permission is at least ``required``."""
+    permission = effective_permission(user, document, request)
+    if permission is None:
+        return False
+    return PERMISSION_LEVELS.index(permission) >= PERMISSION_LEVELS.index(required)
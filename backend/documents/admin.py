@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import Document, Comment, SharedDocument, DocumentVersion
+from .models import (
+    Document, Comment, SharedDocument, DocumentVersion, ExtractedText, UploadSession, UploadChunk,
+    Blob
+)
 
 
 class CommentInline(admin.TabularInline):
@@ -15,15 +18,21 @@ class SharedDocumentInline(admin.TabularInline):
 class DocumentVersionInline(admin.TabularInline):
     model = DocumentVersion
     extra = 0
-    readonly_fields = ('file_size', 'created_at')
+    readonly_fields = ('file_size', 'storage_mode', 'delta_base', 'created_at')
 
 
 @admin.register(Document)
 class DocumentAdmin(admin.ModelAdmin):
-    list_display = ('title', 'owner', 'file_type', 'file_size', 'created_at', 'updated_at', 'is_public')
+    list_display = (
+        'title', 'owner', 'file_type', 'file_size', 'comment_count', 'version_count', 'share_count',
+        'created_at', 'updated_at', 'is_public'
+    )
     list_filter = ('file_type', 'is_public', 'created_at', 'updated_at')
     search_fields = ('title', 'description', 'owner__email')
-    readonly_fields = ('file_size', 'file_type', 'created_at', 'updated_at', 'slug')
+    readonly_fields = (
+        'file_size', 'file_type', 'created_at', 'updated_at', 'slug',
+        'comment_count', 'version_count', 'share_count', 'latest_version_number'
+    )
     inlines = [CommentInline, SharedDocumentInline, DocumentVersionInline]
 
 
@@ -43,7 +52,36 @@ class SharedDocumentAdmin(admin.ModelAdmin):
 
 @admin.register(DocumentVersion)
 class DocumentVersionAdmin(admin.ModelAdmin):
-    list_display = ('document', 'version_number', 'created_by', 'file_size', 'created_at')
-    list_filter = ('created_at',)
+    list_display = ('document', 'version_number', 'created_by', 'file_size', 'storage_mode', 'created_at')
+    list_filter = ('storage_mode', 'created_at')
     search_fields = ('document__title', 'comment', 'created_by__email')
-    readonly_fields = ('file_size', 'created_at')
\ No newline at end of file
+    readonly_fields = ('file_size', 'storage_mode', 'delta_base', 'created_at')
+
+
+@admin.register(ExtractedText)
+class ExtractedTextAdmin(admin.ModelAdmin):
+    list_display = ('document', 'version', 'page', 'created_at')
+    search_fields = ('document__title', 'content')
+    raw_id_fields = ('document', 'version')
+
+
+class UploadChunkInline(admin.TabularInline):
+    model = UploadChunk
+    extra = 0
+    readonly_fields = ('index', 'size', 'checksum', 'path', 'created_at')
+
+
+@admin.register(UploadSession)
+class UploadSessionAdmin(admin.ModelAdmin):
+    list_display = ('filename', 'owner', 'document', 'status', 'total_size', 'created_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('filename', 'title', 'owner__email')
+    inlines = [UploadChunkInline]
+
+
+@admin.register(Blob)
+class BlobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'size', 'ref_count', 'created_at', 'last_used_at')
+    list_filter = ('created_at',)
+    search_fields = ('name', 'sha256')
+    readonly_fields = ('name', 'sha256', 'size', 'ref_count', 'created_at', 'last_used_at')
\ No newline at end of file
@@ -0,0 +1,173 @@
+"""
+Bulk writes to documents and their comments, versions and shares.
+
+Signals normally adjust a document's counters and invalidate its cached
+responses once per saved or deleted row. Inside ``deferred_document_updates()``
+they only record the document, and each recorded document is refreshed once
+when the block exits. ``bulk_create`` and ``QuerySet.update`` send no
+signals, so callers add the documents they write to the yielded set
+themselves.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from .access import document_scope
+from .caching import bump_document_lists, bump_generation
+from .counters import refresh_counters
+from .events import publish_event
+from .models import Comment, Document, SharedDocument
+
+# Documents touched inside the current deferred_document_updates() block
+_touched_documents = ContextVar('touched_documents', default=None)
+
+
+def defer_document_update(document_id):
+    """Record a touched document for the enclosing bulk block; return False outside one."""
+    touched = _touched_documents.get()
+    if touched is None:
+        return False
+    touched.add(document_id)
+    return True
+
+
+def invalidate_documents(document_ids):
+    """Drop the cached responses and permissions of ``document_ids`` and the lists showing them."""
+    bump_document_lists(document_ids)
+    for document_id in document_ids:
+        bump_generation(document_scope(document_id))
+
+
+@contextmanager
+def deferred_document_updates():
+    """
+    Run the block in one transaction, refreshing each touched document once at the end.
+
+    Yields the set of touched document ids. Counters are recomputed before
+    the transaction commits. Once it has, caches are invalidated and each
+    document's push subscribers get one ``document.changed`` event.
+    """
+    touched = set()
+    token = _touched_documents.set(touched)
+    try:
+        with transaction.atomic():
+            yield touched
+            if touched:
+                refresh_counters(Document.objects.filter(pk__in=touched))
+                transaction.on_commit(lambda: invalidate_documents(touched))
+                for document_id in touched:
+                    publish_event('document.changed', document_id)
+    finally:
+        _touched_documents.reset(token)
+
+
+def _owned_documents(owner, document_ids):
+    return set(Document.objects.filter(pk__in=document_ids, owner=owner).values_list('pk', flat=True))
+
+
+def _result(document_id, user_id, status, detail=None):
+    result = {'document': document_id, 'shared_with': user_id, 'status': status}
+    if detail:
+        result['detail'] = detail
+    return result
+
+
+def _summarize(results, statuses):
+    summary = {status: 0 for status in statuses}
+    for result in results:
+        summary[result['status']] += 1
+    summary['results'] = results
+    return summary
+
+
+def bulk_share(owner, document_ids, user_ids, permission, batch_size=1000):
+    """
+    Share every document in ``document_ids`` with every user in ``user_ids``.
+
+    Existing shares get ``permission``. Documents must exist and belong to
+    ``owner``; pairs that fail are reported and skipped, the rest are
+    upserted in one transaction. Returns per-status counts and a result
+    for every pair.
+    """
+    owned = _owned_documents(owner, document_ids)
+    users = set(get_user_model().objects.filter(pk__in=user_ids, is_active=True).values_list('pk', flat=True))
+
+    with deferred_document_updates() as touched:
+        existing = {
+            (document_id, user_id): current
+            for document_id, user_id, current in SharedDocument.objects.filter(
+                document_id__in=owned, shared_with_id__in=users
+            ).values_list('document_id', 'shared_with_id', 'permission')
+        }
+
+        results = []
+        shares = []
+        for document_id in document_ids:
+            for user_id in user_ids:
+                if document_id not in owned:
+                    results.append(_result(document_id, user_id, 'failed', 'Document not found or not owned by you.'))
+                elif user_id not in users:
+                    results.append(_result(document_id, user_id, 'failed', 'User not found.'))
+                elif user_id == owner.pk:
+                    results.append(_result(document_id, user_id, 'failed', 'Documents cannot be shared with their owner.'))
+                elif existing.get((document_id, user_id)) == permission:
+                    results.append(_result(document_id, user_id, 'unchanged'))
+                else:
+                    status = 'updated' if (document_id, user_id) in existing else 'created'
+                    results.append(_result(document_id, user_id, status))
+                    shares.append(SharedDocument(document_id=document_id, shared_with_id=user_id, permission=permission))
+                    touched.add(document_id)
+
+        # Rows shared concurrently since the lookup above are updated rather than duplicated
+        SharedDocument.objects.bulk_create(
+            shares,
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=['document', 'shared_with'],
+            update_fields=['permission']
+        )
+
+    return _summarize(results, ('created', 'updated', 'unchanged', 'failed'))
+
+
+def bulk_unshare(owner, document_ids, user_ids):
+    """
+    Remove the shares of every document in ``document_ids`` with every user in ``user_ids``.
+
+    Documents must exist and belong to ``owner``. Returns per-status
+    counts and a result for every pair.
+    """
+    owned = _owned_documents(owner, document_ids)
+
+    with deferred_document_updates():
+        shares = SharedDocument.objects.filter(document_id__in=owned, shared_with_id__in=user_ids)
+        existing = set(shares.values_list('document_id', 'shared_with_id'))
+        shares.delete()
+        # The documents leave these users' lists, which the remaining shares no longer reach
+        removed = {user_id for document_id, user_id in existing}
+        transaction.on_commit(lambda: bump_document_lists((), removed))
+
+    results = []
+    for document_id in document_ids:
+        for user_id in user_ids:
+            if document_id not in owned:
+                results.append(_result(document_id, user_id, 'failed', 'Document not found or not owned by you.'))
+            elif (document_id, user_id) in existing:
+                results.append(_result(document_id, user_id, 'deleted'))
+            else:
+                results.append(_result(document_id, user_id, 'not_shared'))
+
+    return _summarize(results, ('deleted', 'not_shared', 'failed'))
+
+
+def bulk_comment(author, comments):
+    """Create ``(document_id, content)`` comments by ``author`` in one transaction; return them in order."""
+    with deferred_document_updates() as touched:
+        created = Comment.objects.bulk_create([
+            Comment(document_id=document_id, author=author, content=content)
+            for document_id, content in comments
+        ])
+        touched.update(document_id for document_id, content in comments)
+    return created
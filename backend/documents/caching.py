@@ -0,0 +1,119 @@
+"""
+Generation counters for invalidating groups of cache entries at once.
+
+Entries are keyed under a scope's current generation; bumping the
+generation makes every older entry unreachable, and they expire on their
+own. A missing counter starts from the current time in milliseconds, so a
+counter evicted from the cache never restarts at a value used before.
+
+``cached_response`` builds on them to cache whole API responses.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from rest_framework.response import Response
+
+GENERATION_PREFIX = 'gen'
+
+# Bumped when a public document changes, as public documents are in everyone's list
+PUBLIC_DOCUMENT_LISTS_SCOPE = 'document-lists:public'
+
+
+def _generation_key(scope):
+    return f"{GENERATION_PREFIX}:{scope}"
+
+
+def get_generation(scope):
+    """Return the current generation of ``scope``."""
+    key = _generation_key(scope)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        generation = cache.get(key)
+    return generation
+
+
+def bump_generation(scope):
+    """Invalidate every entry cached under ``scope``."""
+    key = _generation_key(scope)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Not cached: start a fresh counter, which is newer than any used before
+        cache.add(key, int(time.time() * 1000), timeout=None)
+
+
+def user_scope(user_id):
+    return f"user:{user_id}"
+
+
+def document_lists_scope(user_id):
+    return f"document-lists:{user_id}"
+
+
+def bump_document_lists(document_ids, user_ids=(), public=False):
+    """
+    Invalidate the cached document lists that can show ``document_ids``.
+
+    Those are the lists of each document's owner and of the users it is
+    shared with, plus ``user_ids`` (e.g. users whose share was just
+    removed). If one of the documents is public, or ``public`` is set for a
+    document that just stopped being public, every list is invalidated.
+    """
+    from .models import Document, SharedDocument
+
+    users = set(user_ids)
+    if document_ids:
+        for owner_id, is_public in Document.objects.filter(pk__in=document_ids).values_list('owner_id', 'is_public'):
+            users.add(owner_id)
+            public = public or is_public
+        users.update(
+            SharedDocument.objects.filter(document_id__in=document_ids).values_list('shared_with_id', flat=True)
+        )
+    if public:
+        bump_generation(PUBLIC_DOCUMENT_LISTS_SCOPE)
+    for user_id in users:
+        bump_generation(document_lists_scope(user_id))
+
+
+def response_cache_key(request, scopes):
+    """
+    Return the cache key and ETag of a GET response.
+
+    Both cover the user, the absolute URL (links in the data include the
+    host), the negotiated media type and the current generation of every
+    scope the response depends on, so bumping any of them changes both.
+    """
+    parts = [str(request.user.pk), request.build_absolute_uri(), request.accepted_media_type or '']
+    parts += [f"{scope}={get_generation(scope)}" for scope in scopes]
+    digest = hashlib.sha256('\n'.join(parts).encode()).hexdigest()
+    return f"response:{digest}", f'W/"{digest[:32]}"'
+
+
+def cached_response(request, scopes, build):
+    """
+    Return the response of ``build()``, served from the cache while ``scopes`` are unchanged.
+
+    Clients revalidating with a matching ``If-None-Match`` get ``304 Not
+    Modified`` without the response being built or read from the cache.
+    Only ``200`` responses are cached, as their serialized data; call this
+    after permission checks, which must run on every request.
+    """
+    key, etag = response_cache_key(request, scopes)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        data = cache.get(key)
+        if data is None:
+            response = build()
+            if response.status_code == 200:
+                cache.set(key, response.data, settings.DOCUMENT_RESPONSE_CACHE_TIMEOUT)
+        else:
+            response = Response(data)
+    response['ETag'] = etag
+    # Responses depend on the user, so shared caches must not reuse them
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ('Authorization',))
+    return response
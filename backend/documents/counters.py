@@ -0,0 +1,76 @@
+"""
+Denormalized counts of a document's comments, versions and shares.
+
+Signals adjust a document's counters with ``F()`` updates when a related
+row is created or deleted, inside the transaction that writes the row, so
+concurrent writers never lose an update and a rolled-back row is never
+counted. ``latest_version_number`` tracks the highest version number, the
+base for numbering the next upload.
+
+Writes that skip signals (``bulk_create``, ``QuerySet.update``, raw SQL,
+fixtures) leave the counters stale until ``refresh_counters`` or
+``rebuild_counters`` recomputes them from the related tables.
+"""
+from django.db.models import Count, F, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Comment, Document, DocumentVersion, SharedDocument
+
+COUNTER_FIELDS = {
+    Comment: 'comment_count',
+    DocumentVersion: 'version_count',
+    SharedDocument: 'share_count',
+}
+
+
+def _aggregate(model, aggregate):
+    """The ``aggregate`` over the document's rows of ``model``, as a correlated subquery."""
+    return Coalesce(Subquery(
+        model.objects.filter(document=OuterRef('pk'))
+        .order_by()
+        .values('document')
+        .annotate(value=aggregate)
+        .values('value')
+    ), 0)
+
+
+def actual_counters():
+    """Expressions computing each counter from the related tables."""
+    return {
+        'comment_count': _aggregate(Comment, Count('pk')),
+        'version_count': _aggregate(DocumentVersion, Count('pk')),
+        'share_count': _aggregate(SharedDocument, Count('pk')),
+        'latest_version_number': _aggregate(DocumentVersion, Max('version_number')),
+    }
+
+
+def adjust_counters(instance, delta):
+    """Count a created (``delta=1``) or deleted (``delta=-1``) comment, version or share."""
+    field = COUNTER_FIELDS[type(instance)]
+    updates = {field: F(field) + delta}
+    if isinstance(instance, DocumentVersion):
+        if delta > 0:
+            updates['latest_version_number'] = Greatest(F('latest_version_number'), instance.version_number)
+        else:
+            updates['latest_version_number'] = actual_counters()['latest_version_number']
+    Document.objects.filter(pk=instance.document_id).update(**updates)
+
+
+def stale_documents(queryset):
+    """Return the documents in ``queryset`` whose counters disagree with the related tables."""
+    actual = actual_counters()
+    annotated = queryset.annotate(**{f"actual_{field}": expression for field, expression in actual.items()})
+    return annotated.exclude(**{field: F(f"actual_{field}") for field in actual})
+
+
+def refresh_counters(queryset):
+    """Recompute the counters of every document in ``queryset`` from the related tables."""
+    queryset.order_by().update(**actual_counters())
+
+
+def rebuild_counters(queryset):
+    """Recompute the counters of every document in ``queryset``; return how many were stale."""
+    stale = stale_documents(queryset).count()
+    if stale:
+        refresh_counters(queryset)
+    return stale
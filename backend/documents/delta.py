@@ -0,0 +1,258 @@
+"""
+Binary deltas between two versions of a file.
+
+The base is split into fixed-size blocks indexed by their leading bytes;
+the target is searched for positions whose leading bytes match a base
+block, which become ``COPY(offset, length)`` operations, while everything
+else is emitted as ``INSERT(data)``. The search hashes target
+positions with numpy, a window at a time, so Python only visits candidate
+positions and the stretches a match covers are not hashed at all. The operation stream is zlib-compressed.
+
+``DeltaReader`` rebuilds the target as a stream, reading the base and the
+delta from file objects, so reconstruction takes constant memory.
+"""
+import io
+import struct
+import zlib
+
+import numpy as np
+
+MAGIC = b'DLT1'
+BLOCK_SIZE = 2048
+# Leading bytes of a block used as the lookup key while scanning
+KEY_SIZE = 16
+# Target positions hashed at once while scanning: the window starts small after
+# a match, as the next is likely near, and doubles while nothing matches
+MIN_SCAN_WINDOW = 4 * 1024
+MAX_SCAN_WINDOW = 256 * 1024
+# Bytes read from the base, or decompressed from the delta, at a time
+READ_SIZE = 64 * 1024
+
+_COPY = b'C'
+_INSERT = b'I'
+_COPY_HEADER = struct.Struct('>QI')
+_INSERT_HEADER = struct.Struct('>I')
+# Odd 64-bit multiplier folding the two halves of a key into one word
+_KEY_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+class DeltaError(Exception):
+    """Raised when a delta cannot be applied to the given base."""
+
+
+def _fold(first, second):
+    """Fold the two little-endian words of a KEY_SIZE-byte key into one 64-bit key."""
+    with np.errstate(over='ignore'):
+        return first * _KEY_MULTIPLIER + second
+
+
+def _block_keys(heads):
+    """Keys of rows of KEY_SIZE bytes."""
+    words = np.ascontiguousarray(heads).view('<u8')
+    return _fold(words[:, 0], words[:, 1])
+
+
+def _position_keys(data, start, stop):
+    """Keys of the KEY_SIZE bytes at every position from ``start`` to ``stop``."""
+    count = stop - start
+    # The little-endian word at every position, read as 8 interleaved aligned views
+    words = np.empty(count + 8, dtype='<u8')
+    for shift in range(8):
+        words[shift::8] = np.frombuffer(data, dtype='<u8', count=(count + 15 - shift) // 8, offset=start + shift)
+    return _fold(words[:count], words[8:])
+
+
+def _index_blocks(base, block_size):
+    """Map the key of every whole base block to the offset of its first occurrence."""
+    blocks = len(base) // block_size
+    if not blocks:
+        return {}
+    data = np.frombuffer(base, dtype=np.uint8, count=blocks * block_size)
+    keys = _block_keys(data.reshape(blocks, block_size)[:, :KEY_SIZE]).tolist()
+    index = {}
+    for block, key in enumerate(keys):
+        index.setdefault(key, block * block_size)
+    return index
+
+
+def encode_delta(base, target, block_size=BLOCK_SIZE, max_ratio=0.5):
+    """
+    Return a delta turning ``base`` into ``target``.
+
+    Returns None when the literal bytes that could not be matched exceed
+    ``max_ratio`` of the target, as the delta would not save enough space
+    to be worth the reconstruction cost.
+    """
+    if block_size < KEY_SIZE:
+        raise ValueError(f"block_size must be at least {KEY_SIZE} bytes.")
+    index = _index_blocks(base, block_size)
+    max_literal = len(target) * max_ratio
+    compressor = zlib.compressobj()
+    out = [MAGIC]
+    literal_start = literal_bytes = 0
+
+    def emit(op):
+        out.append(compressor.compress(op))
+
+    if index:
+        # Bitmap of the top bits of every block key: a cheap first filter for candidates
+        bits = min(max(len(index).bit_length() + 8, 16), 26)
+        shift = np.uint64(64 - bits)
+        known = np.zeros(1 << bits, dtype=bool)
+        known[np.fromiter(index, dtype=np.uint64, count=len(index)) >> shift] = True
+        # Positions where a whole block still fits
+        positions = len(target) - block_size + 1
+        start = 0
+        window_size = MIN_SCAN_WINDOW
+        while start < positions:
+            stop = min(start + window_size, positions)
+            keys = _position_keys(target, start, stop)
+            hits = np.flatnonzero(known[keys >> shift])
+
+            i = 0
+            window_size = min(window_size * 2, MAX_SCAN_WINDOW)
+            while i < len(hits):
+                candidate = start + int(hits[i])
+                offset = index.get(int(keys[hits[i]]))
+                if offset is None or target[candidate:candidate + block_size] != base[offset:offset + block_size]:
+                    i += 1
+                    continue
+
+                if candidate > literal_start:
+                    literal_bytes += candidate - literal_start
+                    if literal_bytes > max_literal:
+                        return None
+                    emit(_INSERT + _INSERT_HEADER.pack(candidate - literal_start) + target[literal_start:candidate])
+                length = _extend_match(base, target, offset, candidate, block_size)
+                emit(_COPY + _COPY_HEADER.pack(offset, length))
+                literal_start = candidate + length
+                window_size = MIN_SCAN_WINDOW
+                # Skip the candidates the match covered
+                i = int(np.searchsorted(hits, literal_start - start))
+
+            # Matches only extend forward, so unmatched bytes before the window's end stay literal
+            if literal_bytes + max(stop - literal_start, 0) > max_literal:
+                return None
+            start = max(stop, literal_start)
+
+    if literal_start < len(target):
+        literal_bytes += len(target) - literal_start
+        if literal_bytes > max_literal:
+            return None
+        emit(_INSERT + _INSERT_HEADER.pack(len(target) - literal_start) + target[literal_start:])
+    out.append(compressor.flush())
+    return b''.join(out)
+
+
+def _extend_match(base, target, offset, pos, block_size):
+    """Extend a matched block forward, a block at a time and then byte by byte."""
+    length = block_size
+    while (
+        pos + length + block_size <= len(target) and
+        offset + length + block_size <= len(base) and
+        target[pos + length:pos + length + block_size] == base[offset + length:offset + length + block_size]
+    ):
+        length += block_size
+    limit = min(len(target) - pos, len(base) - offset)
+    while length < limit and target[pos + length] == base[offset + length]:
+        length += 1
+    return length
+
+
+class DeltaReader(io.RawIOBase):
+    """
+    Read the target of a delta made by ``encode_delta`` as a stream.
+
+    ``base`` is a seekable binary file holding the base and ``delta`` a
+    binary file holding the delta; neither is read whole. Raises DeltaError
+    while reading when the delta is corrupt or does not fit the base.
+    """
+
+    def __init__(self, base, delta):
+        super().__init__()
+        self.base = base
+        self.delta = delta
+        self._decompressor = zlib.decompressobj()
+        self._ops = bytearray()
+        self._copy_remaining = 0
+        self._insert_remaining = 0
+        self._started = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._next(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def _next(self, size):
+        """Return up to ``size`` bytes of the target, or b'' at its end."""
+        if not self._started:
+            if self.delta.read(len(MAGIC)) != MAGIC:
+                raise DeltaError('Not a document delta.')
+            self._started = True
+        while size:
+            if self._copy_remaining:
+                data = self.base.read(min(size, self._copy_remaining, READ_SIZE))
+                if not data:
+                    raise DeltaError('Delta copies past the end of its base.')
+                self._copy_remaining -= len(data)
+                return data
+            if self._insert_remaining:
+                if not self._fill(1):
+                    raise DeltaError('Delta inserts past the end of its data.')
+                length = min(size, self._insert_remaining, len(self._ops))
+                data = bytes(self._ops[:length])
+                del self._ops[:length]
+                self._insert_remaining -= length
+                return data
+            if not self._fill(1):
+                return b''
+            op = bytes(self._ops[:1])
+            if op == _COPY:
+                offset, self._copy_remaining = self._header(_COPY_HEADER)
+                self.base.seek(offset)
+            elif op == _INSERT:
+                (self._insert_remaining,) = self._header(_INSERT_HEADER)
+            else:
+                raise DeltaError(f"Unknown delta operation {op!r}.")
+        return b''
+
+    def _header(self, header):
+        """Consume an operation byte and its header."""
+        if not self._fill(1 + header.size):
+            raise DeltaError('Truncated delta.')
+        values = header.unpack_from(self._ops, 1)
+        del self._ops[:1 + header.size]
+        return values
+
+    def _fill(self, size):
+        """Decompress until at least ``size`` operation bytes are buffered; False if the delta ends first."""
+        while len(self._ops) < size:
+            try:
+                if self._decompressor.unconsumed_tail:
+                    data = self._decompressor.decompress(self._decompressor.unconsumed_tail, READ_SIZE)
+                elif self._decompressor.eof:
+                    return False
+                else:
+                    chunk = self.delta.read(READ_SIZE)
+                    if not chunk:
+                        raise DeltaError('Truncated delta.')
+                    data = self._decompressor.decompress(chunk, READ_SIZE)
+            except zlib.error as exc:
+                raise DeltaError(str(exc)) from exc
+            self._ops += data
+        return True
+
+    def close(self):
+        if not self.closed:
+            self.base.close()
+            self.delta.close()
+        super().close()
+
+
+def apply_delta(base, delta):
+    """Rebuild the target bytes from ``base`` and a delta made by ``encode_delta``."""
+    with DeltaReader(io.BytesIO(base), io.BytesIO(delta)) as reader:
+        return reader.read()
@@ -0,0 +1,185 @@
+"""
+File downloads with conditional and range requests.
+
+Responses carry an ``ETag`` derived from the content's SHA-256, so clients
+revalidate with ``If-None-Match`` and get a ``304`` without a byte sent.
+A single ``Range`` is answered with ``206 Partial Content``. When
+``DOCUMENT_DOWNLOAD_SENDFILE`` names a front-end server, stored files are
+handed off with ``X-Accel-Redirect`` (nginx) or ``X-Sendfile`` (Apache,
+lighttpd) and never pass through Python; otherwise they are streamed in
+blocks, which WSGI servers such as gunicorn turn into ``sendfile()``.
+"""
+import mimetypes
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import content_disposition_header
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+# Bytes read at a time when skipping to a range in a stream that cannot seek
+SKIP_SIZE = 64 * 1024
+
+
+class RangeNotSatisfiable(Exception):
+    """Raised when a requested byte range lies outside the file."""
+
+
+class FileRange:
+    """Read at most ``length`` bytes of a file from its current position."""
+
+    def __init__(self, fileobj, length):
+        self.fileobj = fileobj
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fileobj.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        # Lets the WSGI server sendfile() from the current offset for Content-Length bytes
+        return self.fileobj.fileno()
+
+    def close(self):
+        self.fileobj.close()
+
+
+def parse_range(header, size):
+    """
+    Return the inclusive ``(start, end)`` of a single byte range.
+
+    Returns None when the whole file should be served: there is no header,
+    it is malformed (including a last byte before the first), or it asks
+    for several ranges, all of which RFC 7233 says to ignore. Raises
+    RangeNotSatisfiable when the range starts past the end of the file, asks
+    for an empty suffix or the file is empty.
+    """
+    match = RANGE_RE.match(header or '')
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first and last and int(last) < int(first):
+        return None
+    if not size:
+        raise RangeNotSatisfiable
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if not length:
+            raise RangeNotSatisfiable
+        return max(size - length, 0), size - 1
+    start = int(first)
+    if start >= size:
+        raise RangeNotSatisfiable
+    end = min(int(last), size - 1) if last else size - 1
+    return start, end
+
+
+def skip_to(fileobj, offset):
+    """Move to ``offset`` in a file opened at its start, reading forward when it cannot seek."""
+    if getattr(fileobj, 'seekable', lambda: True)():
+        fileobj.seek(offset)
+        return
+    while offset:
+        data = fileobj.read(min(offset, SKIP_SIZE))
+        if not data:
+            break
+        offset -= len(data)
+
+
+def make_etag(checksum):
+    return f'"{checksum}"' if checksum else None
+
+
+def _handoff_response(stored_name, storage, filename):
+    """Return a response asking the front-end server to send the file, or None to stream it."""
+    backend = settings.DOCUMENT_DOWNLOAD_SENDFILE
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    if backend == 'x-accel-redirect':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = settings.DOCUMENT_DOWNLOAD_ACCEL_PREFIX + quote(stored_name)
+        return response
+    if backend == 'x-sendfile':
+        try:
+            path = storage.path(stored_name)
+        except NotImplementedError:
+            return None
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = path
+        return response
+    return None
+
+
+def file_response(request, open_file, size, filename, etag=None, stored_name=None, storage=None):
+    """
+    Build a download response for a file of ``size`` bytes.
+
+    ``open_file`` is called only when the body is streamed. ``stored_name``
+    and ``storage`` identify the file as stored, allowing a hand-off to the
+    front-end server; pass None when the bytes are produced in Python.
+    """
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        if etag:
+            not_modified['ETag'] = etag
+        return not_modified
+
+    response = None
+    if stored_name and storage is not None:
+        response = _handoff_response(stored_name, storage, filename)
+    if response is None:
+        response = _stream_response(request, open_file, size, filename, etag)
+
+    if etag:
+        response['ETag'] = etag
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    # Downloads need authorization, so only the client may cache them, revalidating by ETag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def _stream_response(request, open_file, size, filename, etag):
+    header = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+    if if_range is not None and (not etag or if_range != etag):
+        # The client's copy is stale, so a partial response cannot complete it
+        header = None
+
+    try:
+        byte_range = parse_range(header, size)
+    except RangeNotSatisfiable:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f"bytes */{size}"
+        return response
+
+    fileobj = open_file()
+    if byte_range is None:
+        response = FileResponse(fileobj, filename=filename)
+        response['Content-Length'] = size
+        return response
+
+    start, end = byte_range
+    skip_to(fileobj, start)
+    response = FileResponse(FileRange(fileobj, end - start + 1), status=206, filename=filename)
+    response['Content-Length'] = end - start + 1
+    response['Content-Range'] = f"bytes {start}-{end}/{size}"
+    return response
+
+
+def fieldfile_response(request, fieldfile, filename, size=None, checksum=''):
+    """Build a download response for a stored file field."""
+    return file_response(
+        request,
+        lambda: fieldfile.storage.open(fieldfile.name, 'rb'),
+        size or fieldfile.size,
+        filename,
+        etag=make_etag(checksum),
+        stored_name=fieldfile.name,
+        storage=fieldfile.storage
+    )
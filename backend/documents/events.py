@@ -0,0 +1,223 @@
+"""
+Document activity events for push subscribers.
+
+Signals publish an event once its change commits. It goes to the channel
+of the document it concerns and to the channels of the users it concerns
+(a document's owner, or the user a share is for). A broker fans each event
+out to the subscriptions listening on its channel. There are two brokers:
+
+- ``InMemoryBroker`` reaches subscribers in this process only. It suits a
+  single ASGI worker that also serves the API.
+- ``RedisBroker`` relays events through Redis pub/sub, so an event
+  published by any web or Celery process reaches subscribers in every
+  worker.
+
+Set ``DOCUMENT_EVENTS_BROKER`` to ``memory`` or ``redis``. Events are
+encoded to JSON once per publish, however many subscribers receive them.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# Events after which a subscriber's access to the document is checked again
+ACCESS_EVENTS = frozenset({'share.updated', 'share.deleted', 'document.updated', 'document.changed'})
+
+
+def document_channel(document_id):
+    return f"document:{document_id}"
+
+
+def user_channel(user_id):
+    return f"user:{user_id}"
+
+
+class Subscription:
+    """
+    The events published on a set of channels, queued for one subscriber.
+
+    Events are ``(channel, event_type, message)`` tuples, where ``message``
+    is the event encoded as JSON. When the subscriber falls more than
+    ``max_pending`` events behind, new events are dropped and
+    ``overflowed`` is set, so the subscriber can tell its client to
+    refetch.
+    """
+
+    def __init__(self, broker, channels, max_pending):
+        self.broker = broker
+        self.channels = set(channels)
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(max_pending)
+        self.overflowed = False
+
+    def deliver(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self, timeout=None):
+        """Wait up to ``timeout`` seconds for the next event; raise ``asyncio.TimeoutError`` if none came."""
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def get_nowait(self):
+        """Return the next queued event, or None."""
+        try:
+            return self.queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return None
+
+    def remove_channel(self, channel):
+        self.broker.remove_channel(self, channel)
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+def _deliver_all(subscriptions, event):
+    for subscription in subscriptions:
+        subscription.deliver(event)
+
+
+class InMemoryBroker:
+    """Fan events out to the subscriptions in this process."""
+
+    def __init__(self):
+        self.published = 0
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, channels, max_pending=None):
+        """Subscribe the running event loop to ``channels``."""
+        subscription = Subscription(self, channels, max_pending or settings.DOCUMENT_EVENTS_QUEUE_SIZE)
+        with self._lock:
+            for channel in subscription.channels:
+                self._channels.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                self._discard(channel, subscription)
+
+    def remove_channel(self, subscription, channel):
+        with self._lock:
+            subscription.channels.discard(channel)
+            self._discard(channel, subscription)
+
+    def _discard(self, channel, subscription):
+        subscribers = self._channels.get(channel)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._channels[channel]
+
+    def publish(self, channel, event_type, message):
+        """Deliver an event to the channel's subscribers; safe to call from any thread."""
+        self._fan_out(channel, event_type, message)
+
+    def _fan_out(self, channel, event_type, message):
+        with self._lock:
+            subscribers = list(self._channels.get(channel, ()))
+        self.published += 1
+        # One wake-up per event loop, however many of its subscribers listen
+        by_loop = {}
+        for subscription in subscribers:
+            by_loop.setdefault(subscription.loop, []).append(subscription)
+        event = (channel, event_type, message)
+        for loop, subscriptions in by_loop.items():
+            try:
+                loop.call_soon_threadsafe(_deliver_all, subscriptions, event)
+            except RuntimeError:
+                # The loop has closed; its subscriptions are going away with it
+                pass
+
+    def subscriber_count(self):
+        with self._lock:
+            return len({subscription for subscribers in self._channels.values() for subscription in subscribers})
+
+
+class RedisBroker(InMemoryBroker):
+    """
+    Relay events through Redis pub/sub to the subscribers of every process.
+
+    Each process listens to all event channels on one connection, started
+    with its first subscription, and fans the events out locally.
+    """
+
+    def __init__(self, url, prefix='dochub:events:'):
+        super().__init__()
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._listener = None
+
+    def publish(self, channel, event_type, message):
+        self.client.publish(self.prefix + channel, f"{event_type}\n{message}")
+
+    def subscribe(self, channels, max_pending=None):
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name='document-events', daemon=True)
+                self._listener.start()
+        return super().subscribe(channels, max_pending)
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(self.prefix + '*')
+                for message in pubsub.listen():
+                    channel = message['channel'].decode()[len(self.prefix):]
+                    event_type, _, payload = message['data'].decode().partition('\n')
+                    self._fan_out(channel, event_type, payload)
+            except Exception as exc:
+                logger.warning('Document event listener lost Redis: %s', exc)
+                time.sleep(1)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """Return this process's broker, created from the settings on first use."""
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            if settings.DOCUMENT_EVENTS_BROKER == 'redis':
+                _broker = RedisBroker(settings.DOCUMENT_EVENTS_REDIS_URL)
+            elif settings.DOCUMENT_EVENTS_BROKER == 'memory':
+                _broker = InMemoryBroker()
+            else:
+                raise ValueError(f"Unknown DOCUMENT_EVENTS_BROKER {settings.DOCUMENT_EVENTS_BROKER!r}")
+        return _broker
+
+
+def publish_event(event_type, document_id, user_ids=(), **data):
+    """
+    Publish an event on the document's channel and each user's channel once the transaction commits.
+
+    A failing broker is logged and otherwise ignored, as the change itself
+    has already been committed.
+    """
+    message = json.dumps({'type': event_type, 'document': document_id, **data}, cls=DjangoJSONEncoder)
+    channels = [document_channel(document_id)] + [user_channel(user_id) for user_id in user_ids]
+
+    def publish():
+        try:
+            broker = get_broker()
+            for channel in channels:
+                broker.publish(channel, event_type, message)
+        except Exception as exc:
+            logger.warning('Publishing %s for document %s failed: %s', event_type, document_id, exc)
+
+    transaction.on_commit(publish)
@@ -0,0 +1,96 @@
+import codecs
+import os
+import shutil
+import tempfile
+
+from django.db import transaction
+from PyPDF2 import PdfReader
+
+from .models import ExtractedText
+from .storage import SPOOL_MAX_SIZE
+
+# File types read as plain text, in TEXT_CHUNK_SIZE pieces
+TEXT_FILE_TYPES = {'txt', 'md', 'csv', 'tsv', 'json', 'xml', 'html', 'htm', 'rtf', 'log'}
+TEXT_CHUNK_SIZE = 64 * 1024
+
+# Pages buffered before each bulk insert
+PAGE_BATCH_SIZE = 50
+
+
+def iter_pdf_pages(fileobj):
+    """
+    Yield the text of each PDF page; PyPDF2 only parses the page being read.
+
+    PyPDF2 seeks around the file, so streams that cannot seek, such as
+    rebuilt delta versions, are first spooled to a temporary file.
+    """
+    if not getattr(fileobj, 'seekable', lambda: True)():
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as spool:
+            shutil.copyfileobj(fileobj, spool)
+            spool.seek(0)
+            yield from iter_pdf_pages(spool)
+        return
+    reader = PdfReader(fileobj)
+    for page in reader.pages:
+        yield page.extract_text() or ''
+
+
+def iter_text_chunks(fileobj):
+    """Yield a text file as fixed-size decoded chunks."""
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    while True:
+        data = fileobj.read(TEXT_CHUNK_SIZE)
+        if not data:
+            break
+        yield decoder.decode(data)
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+def get_page_iterator(file_type):
+    """Return the page iterator for a file type, or None when it has no extractable text."""
+    file_type = (file_type or '').lower()
+    if file_type == 'pdf':
+        return iter_pdf_pages
+    if file_type in TEXT_FILE_TYPES:
+        return iter_text_chunks
+    return None
+
+
+def file_type_for(fieldfile, default=''):
+    """Derive a file type from a stored file's extension."""
+    ext = os.path.splitext(fieldfile.name or '')[1]
+    return ext[1:].lower() if ext else default
+
+
+def extract_text(document, fieldfile, file_type, version=None, opener=None):
+    """
+    Replace the extracted text stored for ``document`` (or one of its versions).
+
+    The file is streamed from storage and written PAGE_BATCH_SIZE pages at a
+    time, so memory use does not grow with the file size. ``opener`` returns
+    the file object to read instead of opening ``fieldfile`` directly.
+    Returns the number of pages stored.
+    """
+    iter_pages = get_page_iterator(file_type)
+    pages = 0
+    with transaction.atomic():
+        ExtractedText.objects.filter(document=document, version=version).delete()
+        if iter_pages is None or not fieldfile:
+            return pages
+
+        batch = []
+        with (opener() if opener else fieldfile.open('rb')) as fileobj:
+            for text in iter_pages(fileobj):
+                pages += 1
+                if not text.strip():
+                    continue
+                batch.append(ExtractedText(
+                    document=document, version=version, page=pages, content=text.replace('\x00', '')
+                ))
+                if len(batch) >= PAGE_BATCH_SIZE:
+                    ExtractedText.objects.bulk_create(batch)
+                    batch = []
+        ExtractedText.objects.bulk_create(batch)
+    return pages
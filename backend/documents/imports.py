@@ -0,0 +1,241 @@
+"""
+Bulk import of files as new documents.
+
+Files are hashed and stored by a pool of worker threads, since hashing
+releases the GIL and storage writes wait on I/O. Rows are then inserted a
+batch at a time:
+
+- one query resolves the batch's slugs;
+- one ``bulk_create`` inserts its documents;
+- blob rows and reference counts are written in bulk.
+
+``bulk_create`` sends no signals, so this module does the document
+signals' per-row work itself, once per batch. That covers blob references,
+search vectors, text extraction and document list invalidation.
+"""
+import functools
+import os
+import tarfile
+import tempfile
+import time
+import zipfile
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files import File
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.text import slugify
+
+from .caching import bump_document_lists
+from .models import SLUG_ATTEMPTS, Blob, Document, suffixed_slug
+from .search import update_search_vector
+from .storage import SPOOL_MAX_SIZE, blob_storage
+from .tasks import extract_document_text
+
+
+class ArchiveError(Exception):
+    """Raised when an uploaded archive is not a readable zip or tar file."""
+
+
+class ImportReport:
+    """Running totals of an import."""
+
+    def __init__(self):
+        self.imported = 0
+        self.bytes = 0
+        self.failures = []
+        self.started = time.perf_counter()
+
+    @property
+    def seconds(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def files_per_second(self):
+        seconds = self.seconds
+        return self.imported / seconds if seconds else 0.0
+
+    def as_dict(self):
+        return {
+            'imported': self.imported,
+            'failed': len(self.failures),
+            'bytes': self.bytes,
+            'seconds': round(self.seconds, 3),
+            'files_per_second': round(self.files_per_second, 1),
+            'failures': [{'name': name, 'detail': detail} for name, detail in self.failures],
+        }
+
+
+def directory_files(root):
+    """Yield ``(name, opener)`` for every file under ``root``, in a stable order."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            yield os.path.relpath(path, root), functools.partial(_open_path, path)
+
+
+def uploaded_files(files):
+    """Yield ``(name, opener)`` for uploaded files."""
+    for upload in files:
+        yield upload.name, lambda upload=upload: upload
+
+
+def archive_files(fileobj):
+    """
+    Yield ``(name, opener)`` for every regular file in a zip or tar archive.
+
+    Tar archives may be compressed and are read as a stream. Each member is
+    copied out as the import reaches it, into memory or, past
+    ``SPOOL_MAX_SIZE``, a temporary file.
+    """
+    try:
+        if zipfile.is_zipfile(fileobj):
+            fileobj.seek(0)
+            with zipfile.ZipFile(fileobj) as archive:
+                for info in archive.infolist():
+                    if not info.is_dir():
+                        with archive.open(info) as member:
+                            yield info.filename, _spool(member)
+            return
+        fileobj.seek(0)
+        with tarfile.open(fileobj=fileobj, mode='r|*') as archive:
+            for member in archive:
+                if member.isfile():
+                    yield member.name, _spool(archive.extractfile(member))
+    except (tarfile.TarError, zipfile.BadZipFile, EOFError) as exc:
+        raise ArchiveError(f"Could not read the archive as zip or tar: {exc}") from exc
+
+
+def _open_path(path):
+    return File(open(path, 'rb'), name=os.path.basename(path))
+
+
+def _spool(stream):
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    for chunk in iter(functools.partial(stream.read, 64 * 1024), b''):
+        spool.write(chunk)
+    spool.seek(0)
+    return functools.partial(File, spool)
+
+
+def _store(name, opener):
+    with opener() as content:
+        return blob_storage.store_content(name, content)
+
+
+def unique_slugs(titles):
+    """Slug ``titles`` as ``Document.save`` would, with one query for the slugs already taken."""
+    bases = [slugify(title) for title in titles]
+    taken = set(Document.objects.filter(slug__in=set(bases)).values_list('slug', flat=True))
+    slugs = []
+    for base in bases:
+        slug = suffixed_slug(base) if base in taken else base
+        taken.add(slug)
+        slugs.append(slug)
+    return slugs
+
+
+def import_documents(owner, files, is_public=False, workers=None, batch_size=None, on_batch=None):
+    """
+    Create a document owned by ``owner`` for every ``(name, opener)`` in ``files``.
+
+    ``opener()`` returns the file's content as a Django ``File``. Each batch
+    of ``batch_size`` stored files is inserted in its own transaction and
+    then passed to ``on_batch(documents, report)``. A file that cannot be read
+    is recorded in the report's failures and skipped. Returns the
+    ``ImportReport``.
+    """
+    workers = workers or settings.DOCUMENT_IMPORT_WORKERS
+    batch_size = batch_size or settings.DOCUMENT_IMPORT_BATCH_SIZE
+    report = ImportReport()
+    batch = []
+
+    def collect(name, future):
+        try:
+            batch.append((name,) + future.result())
+        except OSError as exc:
+            report.failures.append((name, str(exc)))
+        if len(batch) >= batch_size:
+            flush()
+
+    def flush():
+        documents = _insert_batch(owner, batch, is_public)
+        report.imported += len(documents)
+        report.bytes += sum(document.file_size for document in documents)
+        batch.clear()
+        if on_batch is not None:
+            on_batch(documents, report)
+
+    with ThreadPoolExecutor(workers) as executor:
+        # Bound the files read ahead, which archive members hold in memory or temporary files
+        in_flight = deque()
+        for name, opener in files:
+            in_flight.append((name, executor.submit(_store, name, opener)))
+            if len(in_flight) >= workers * 2:
+                collect(*in_flight.popleft())
+        while in_flight:
+            collect(*in_flight.popleft())
+    if batch:
+        flush()
+    return report
+
+
+def _insert_batch(owner, stored, is_public):
+    """Insert documents for ``(name, blob name, sha256, size)`` rows and count their blob references."""
+    titles = [os.path.splitext(os.path.basename(name))[0][:255] or name[:255] for name, *_ in stored]
+    documents = [
+        Document(
+            owner=owner,
+            title=title,
+            slug=slug,
+            file=blob,
+            file_type=os.path.splitext(blob)[1][1:].lower()[:50],
+            file_size=size,
+            checksum=sha256,
+            is_public=is_public
+        )
+        for title, slug, (name, blob, sha256, size) in zip(titles, unique_slugs(titles), stored)
+    ]
+
+    # Committed on their own, like the rows ContentAddressedStorage creates, so gc_blobs
+    # can find the stored files even if the documents are rolled back
+    # One row per distinct blob: an upsert cannot touch the same row twice
+    blobs = {blob: Blob(name=blob, sha256=sha256, size=size) for name, blob, sha256, size in stored}
+    Blob.objects.bulk_create(
+        list(blobs.values()),
+        update_conflicts=True,
+        unique_fields=['name'],
+        update_fields=['last_used_at']
+    )
+
+    with transaction.atomic():
+        _bulk_create_with_unique_slugs(documents)
+        references = Counter(blob for name, blob, sha256, size in stored)
+        for count in set(references.values()):
+            names = [blob for blob, references_to in references.items() if references_to == count]
+            Blob.objects.filter(name__in=names).update(ref_count=F('ref_count') + count)
+
+        document_ids = [document.pk for document in documents]
+        update_search_vector(document_ids)
+        transaction.on_commit(lambda: bump_document_lists((), [owner.pk], public=is_public))
+        for document_id in document_ids:
+            transaction.on_commit(functools.partial(extract_document_text.delay, document_id), robust=True)
+    return documents
+
+
+def _bulk_create_with_unique_slugs(documents):
+    """Insert ``documents``, suffixing every slug and retrying if one was taken since it was resolved."""
+    for attempt in range(SLUG_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                Document.objects.bulk_create(documents)
+            return
+        except IntegrityError:
+            taken = Document.objects.filter(slug__in=[document.slug for document in documents]).exists()
+            if attempt == SLUG_ATTEMPTS - 1 or not taken:
+                raise
+            for document in documents:
+                document.slug = suffixed_slug(slugify(document.title))
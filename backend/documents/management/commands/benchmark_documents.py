@@ -0,0 +1,137 @@
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from documents.models import Document, SharedDocument
+from documents.search import build_search_query, is_search_supported, update_search_vector
+
+User = get_user_model()
+
+TITLE_WORDS = (
+    'quarterly', 'invoice', 'contract', 'roadmap', 'minutes', 'proposal',
+    'budget', 'report', 'design', 'policy', 'handbook', 'summary',
+)
+
+
+class Command(BaseCommand):
+    """Seed synthetic documents and time the document list and search queries."""
+
+    help = 'Benchmark document list and search latency at increasing table sizes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scenario', choices=('list', 'search'), default='list',
+            help='Queries to time: the visibility filter or title/description search.'
+        )
+        parser.add_argument('--term', default='quarterly budget', help='Search term for --scenario search.')
+        parser.add_argument(
+            '--sizes', default='10000,100000,1000000',
+            help='Comma separated document counts to benchmark at.'
+        )
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per query.')
+        parser.add_argument('--page-size', type=int, default=10)
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per bulk insert.')
+        parser.add_argument(
+            '--keep', action='store_true',
+            help='Keep the seeded rows instead of rolling them back.'
+        )
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        with transaction.atomic():
+            owner, viewer = self._create_users()
+            seeded = 0
+            for size in sizes:
+                self._seed(owner, viewer, seeded, size, options['batch_size'])
+                seeded = size
+                if options['scenario'] == 'search':
+                    self._report_search(size, viewer, options)
+                else:
+                    self._report(size, viewer, options)
+            if not options['keep']:
+                transaction.set_rollback(True)
+
+    def _create_users(self):
+        owner = User.objects.create_user(
+            email=f"bench-owner-{time.time_ns()}@example.com",
+            first_name='Bench', last_name='Owner'
+        )
+        viewer = User.objects.create_user(
+            email=f"bench-viewer-{time.time_ns()}@example.com",
+            first_name='Bench', last_name='Viewer'
+        )
+        return owner, viewer
+
+    def _seed(self, owner, viewer, start, stop, batch_size):
+        """Insert documents ``start..stop``: 10% public, 1% shared with the viewer."""
+        for offset in range(start, stop, batch_size):
+            documents = Document.objects.bulk_create([
+                Document(
+                    title=self._title(i),
+                    description=f"Benchmark document {i}",
+                    slug=f"benchmark-{owner.pk}-{i}",
+                    file=f"documents/{owner.pk}/benchmark-{i}.pdf",
+                    file_type='pdf',
+                    owner=owner,
+                    is_public=i % 10 == 0,
+                )
+                for i in range(offset, min(offset + batch_size, stop))
+            ])
+            SharedDocument.objects.bulk_create([
+                SharedDocument(document=document, shared_with=viewer)
+                for document in documents if document.pk % 100 == 1
+            ])
+            update_search_vector([document.pk for document in documents])
+        self.stdout.write(f"Seeded {stop} documents")
+
+    @staticmethod
+    def _title(i):
+        first = TITLE_WORDS[i % len(TITLE_WORDS)]
+        second = TITLE_WORDS[i // 7 % len(TITLE_WORDS)]
+        return f"{first} {second} {i}"
+
+    def _report(self, size, viewer, options):
+        queries = {
+            'or-join + distinct': Document.objects.filter(
+                Q(owner=viewer) | Q(is_public=True) | Q(shares__shared_with=viewer)
+            ).distinct(),
+            'accessible_to': Document.objects.accessible_to(viewer),
+        }
+        self._write_timings(size, queries, options)
+
+    def _report_search(self, size, viewer, options):
+        terms = options['term'].split()
+        icontains = Q()
+        for term in terms:
+            icontains &= Q(title__icontains=term) | Q(description__icontains=term)
+        visible = Document.objects.accessible_to(viewer)
+        queries = {'icontains': visible.filter(icontains)}
+        if is_search_supported():
+            query = build_search_query(terms)
+            queries['tsvector + gin'] = visible.filter(search_vector=query)
+        else:
+            self.stdout.write('Full-text search needs PostgreSQL; timing icontains only')
+        self._write_timings(size, queries, options)
+
+    def _write_timings(self, size, queries, options):
+        for label, queryset in queries.items():
+            timings = self._time(queryset, options['page_size'], options['repeat'])
+            self.stdout.write(
+                f"{size:>9} rows  {label:<20} "
+                f"median {statistics.median(timings):8.2f} ms  "
+                f"max {max(timings):8.2f} ms"
+            )
+
+    def _time(self, queryset, page_size, repeat):
+        """Time one list page (count + first page), as the list endpoint issues it."""
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            queryset.count()
+            list(queryset[:page_size])
+            timings.append((time.perf_counter() - start) * 1000)
+        return timings
@@ -0,0 +1,141 @@
+import asyncio
+import gc
+import json
+import socket
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import AccessToken
+
+from documents.events import document_channel, get_broker
+from documents.models import Document
+from documents.push import EVENTS_PATH
+
+User = get_user_model()
+
+
+def rss_bytes():
+    """Resident memory of this process, or None where /proc is not available."""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+
+
+class Command(BaseCommand):
+    """Hold many idle event streams open on an in-process server and time event fan-out to them."""
+
+    help = 'Benchmark memory per open event stream and event delivery rate.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=1000, help='Event streams to open.')
+        parser.add_argument('--events', type=int, default=20, help='Events to publish to every stream.')
+
+    def handle(self, *args, **options):
+        try:
+            import uvicorn
+        except ImportError:
+            raise CommandError('uvicorn is required to run the event stream benchmark')
+
+        owner = User.objects.create_user(
+            email=f"bench-events-{time.time_ns()}@example.com",
+            first_name='Bench', last_name='Events'
+        )
+        document = Document.objects.create(
+            title='Event benchmark', owner=owner,
+            file=ContentFile(b'event benchmark', name='events.txt')
+        )
+        try:
+            asyncio.run(self._run(uvicorn, str(AccessToken.for_user(owner)), document, options))
+        finally:
+            document.delete()
+            owner.delete()
+
+    async def _run(self, uvicorn, token, document, options):
+        from dochub.asgi import application
+
+        connections = options['connections']
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        host, port = listener.getsockname()
+        config = uvicorn.Config(
+            application, lifespan='off', log_level='warning', backlog=max(2048, connections)
+        )
+        server = uvicorn.Server(config)
+        serving = asyncio.ensure_future(server.serve(sockets=[listener]))
+        while not server.started:
+            await asyncio.sleep(0.05)
+
+        gc.collect()
+        before = rss_bytes()
+        request = (
+            f"GET {EVENTS_PATH}?token={token}&documents={document.slug} HTTP/1.0\r\n"
+            f"Host: {host}\r\n\r\n"
+        ).encode()
+        handshakes = asyncio.Semaphore(200)
+
+        async def connect():
+            async with handshakes:
+                reader, writer = await asyncio.open_connection(host, port)
+                writer.write(request)
+                head = await reader.readuntil(b'\r\n\r\n')
+                if b' 200 ' not in head.split(b'\r\n', 1)[0]:
+                    raise CommandError(f"Stream refused: {head.decode(errors='replace')}")
+                await reader.readuntil(b'\n\n')
+                return reader, writer
+
+        start = time.perf_counter()
+        streams = await asyncio.gather(*(connect() for _ in range(connections)))
+        opened = time.perf_counter() - start
+        gc.collect()
+        after = rss_bytes()
+        self.stdout.write(f"{connections} streams opened in {opened:.2f}s")
+        if before is not None:
+            self.stdout.write(f"Memory: {(after - before) / connections / 1024:.1f} KiB per stream (client and server side)")
+
+        latencies = []
+        received = {'count': 0}
+        round_done = asyncio.Event()
+
+        async def read(reader):
+            while True:
+                frame = await reader.readuntil(b'\n\n')
+                if frame.startswith(b'event: bench'):
+                    data = frame.split(b'data: ', 1)[1]
+                    latencies.append(time.perf_counter() - json.loads(data)['sent'])
+                    received['count'] += 1
+                    if received['count'] == connections:
+                        round_done.set()
+
+        readers = [asyncio.ensure_future(read(reader)) for reader, writer in streams]
+        broker = get_broker()
+        channel = document_channel(document.pk)
+        start = time.perf_counter()
+        for n in range(options['events']):
+            received['count'] = 0
+            round_done.clear()
+            broker.publish(channel, 'bench', json.dumps({'type': 'bench', 'n': n, 'sent': time.perf_counter()}))
+            await asyncio.wait_for(round_done.wait(), 60)
+        elapsed = time.perf_counter() - start
+
+        delivered = len(latencies)
+        latencies.sort()
+        self.stdout.write(
+            f"{delivered} events delivered in {elapsed:.2f}s ({delivered / elapsed:.0f} events/sec), "
+            f"latency median {statistics.median(latencies) * 1000:.1f}ms, "
+            f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f}ms"
+        )
+
+        for task in readers:
+            task.cancel()
+        for reader, writer in streams:
+            writer.close()
+        server.should_exit = True
+        await serving
+
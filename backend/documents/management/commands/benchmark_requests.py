@@ -0,0 +1,163 @@
+import asyncio
+import http.client
+import socket
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import WSGIRequestHandler, WSGIServer
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.test.utils import override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from documents.models import Document
+
+User = get_user_model()
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadPoolWSGIServer(WSGIServer):
+    """Serve requests on a fixed set of threads, as gunicorn's threaded workers do."""
+
+    def __init__(self, *args, workers, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.executor = ThreadPoolExecutor(workers)
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+class Command(BaseCommand):
+    """Serve the API in-process and time concurrent requests to one endpoint."""
+
+    help = 'Benchmark requests/sec and latency of the document list under the current database settings.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--server', choices=('wsgi', 'asgi'), default='wsgi',
+            help='A threaded WSGI server, or uvicorn with the ASGI application.'
+        )
+        parser.add_argument('--requests', type=int, default=2000, help='Timed requests.')
+        parser.add_argument('--concurrency', type=int, default=8, help='Requests in flight, and WSGI server threads.')
+        parser.add_argument('--documents', type=int, default=100, help='Documents the requesting user owns.')
+        parser.add_argument('--path', default='/api/documents/', help='Endpoint to request.')
+        parser.add_argument(
+            '--cache', action='store_true',
+            help='Keep the response cache on; by default every request reaches the database.'
+        )
+
+    def handle(self, *args, **options):
+        settings_dict = connection.settings_dict
+        self.stdout.write(
+            f"{options['server']}: {settings_dict['ENGINE']}, CONN_MAX_AGE={settings_dict['CONN_MAX_AGE']}, "
+            f"CONN_HEALTH_CHECKS={settings_dict['CONN_HEALTH_CHECKS']}"
+        )
+        user = User.objects.create_user(
+            email=f"bench-requests-{time.time_ns()}@example.com",
+            first_name='Bench', last_name='Requests'
+        )
+        Document.objects.bulk_create([
+            Document(
+                title=f"Request benchmark {i}",
+                slug=f"request-benchmark-{user.pk}-{i}",
+                file=f"documents/{user.pk}/request-benchmark-{i}.txt",
+                file_type='txt',
+                owner=user
+            )
+            for i in range(options['documents'])
+        ])
+        headers = {'Authorization': f"Bearer {AccessToken.for_user(user)}", 'Host': 'localhost'}
+
+        try:
+            caching = nullcontext() if options['cache'] else override_settings(DOCUMENT_RESPONSE_CACHE_TIMEOUT=0)
+            with caching:
+                port, stop = self._serve(options)
+                try:
+                    latencies, elapsed = self._load(port, headers, options)
+                finally:
+                    stop()
+        finally:
+            user.delete()
+
+        latencies.sort()
+        self.stdout.write(
+            f"{len(latencies)} requests in {elapsed:.2f}s: {len(latencies) / elapsed:.0f} requests/sec, "
+            f"median {statistics.median(latencies):.1f} ms, p99 {latencies[int(len(latencies) * 0.99) - 1]:.1f} ms"
+        )
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT count(*) FROM pg_stat_activity WHERE datname = current_database()')
+                self.stdout.write(f"Database connections still open: {cursor.fetchone()[0]}")
+
+    def _serve(self, options):
+        """Start the server on a free port in the background; return the port and a function that stops it."""
+        if options['server'] == 'wsgi':
+            server = ThreadPoolWSGIServer(('127.0.0.1', 0), QuietRequestHandler, workers=options['concurrency'])
+            server.set_app(get_wsgi_application())
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+
+            def stop():
+                server.shutdown()
+                server.executor.shutdown()
+                server.server_close()
+            return server.server_address[1], stop
+
+        try:
+            import uvicorn
+        except ImportError:
+            raise CommandError('uvicorn is required for --server asgi')
+        from dochub.asgi import application
+
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        server = uvicorn.Server(uvicorn.Config(application, lifespan='off', log_level='warning'))
+        thread = threading.Thread(target=asyncio.run, args=(server.serve(sockets=[listener]),), daemon=True)
+        thread.start()
+        while not server.started:
+            time.sleep(0.05)
+
+        def stop():
+            server.should_exit = True
+            thread.join()
+        return listener.getsockname()[1], stop
+
+    def _load(self, port, headers, options):
+        """Send the requests from ``concurrency`` threads; return their latencies in ms and the total time."""
+        def request(_):
+            start = time.perf_counter()
+            client = http.client.HTTPConnection('127.0.0.1', port)
+            try:
+                client.request('GET', options['path'], headers=headers)
+                response = client.getresponse()
+                response.read()
+            finally:
+                client.close()
+            if response.status != 200:
+                raise CommandError(f"{options['path']} answered {response.status}")
+            return (time.perf_counter() - start) * 1000
+
+        with ThreadPoolExecutor(options['concurrency']) as executor:
+            # Warm up every server thread before timing
+            list(executor.map(request, range(options['concurrency'] * 4)))
+            start = time.perf_counter()
+            latencies = list(executor.map(request, range(options['requests'])))
+            elapsed = time.perf_counter() - start
+        return latencies, elapsed
@@ -0,0 +1,60 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from documents.delta import READ_SIZE
+from documents.models import DocumentVersion
+from documents.versioning import build_delta, open_version, store_version_as_delta
+
+
+class Command(BaseCommand):
+    """Convert full document versions to deltas against periodic keyframes."""
+
+    help = 'Store existing document versions as deltas and report space saved and reconstruction latency.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--document', help='Only compact the versions of the document with this slug.')
+        parser.add_argument(
+            '--interval', type=int, default=None,
+            help='Versions between full keyframes (default: DOCUMENT_VERSION_KEYFRAME_INTERVAL).'
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Report without storing any deltas.')
+
+    def handle(self, *args, **options):
+        versions = DocumentVersion.objects.select_related('document').order_by('document_id', 'version_number')
+        if options['document']:
+            versions = versions.filter(document__slug=options['document'])
+
+        compacted = before = after = 0
+        for version in versions.filter(storage_mode='full').iterator():
+            if options['dry_run']:
+                built = build_delta(version, options['interval'])
+                delta_size = len(built[2]) if built else None
+            else:
+                delta_size = store_version_as_delta(version, options['interval'])
+            if delta_size is None:
+                continue
+            compacted += 1
+            before += version.file_size
+            after += delta_size
+
+        action = 'Would compact' if options['dry_run'] else 'Compacted'
+        self.stdout.write(
+            f"{action} {compacted} versions: {before} bytes -> {after} bytes, {before - after} bytes saved"
+        )
+        if not options['dry_run'] and compacted:
+            self.stdout.write('Run gc_blobs to delete the replaced full copies.')
+
+        timings = []
+        for version in versions.filter(storage_mode='delta').select_related('delta_base').iterator():
+            start = time.perf_counter()
+            with open_version(version, use_cache=False) as fileobj:
+                while fileobj.read(READ_SIZE):
+                    pass
+            timings.append((time.perf_counter() - start) * 1000)
+        if timings:
+            self.stdout.write(
+                f"Reconstructed {len(timings)} delta versions: "
+                f"median {statistics.median(timings):.1f}ms, max {max(timings):.1f}ms"
+            )
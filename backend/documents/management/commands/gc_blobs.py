@@ -0,0 +1,45 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from documents.models import Blob
+from documents.storage import blob_stats, blob_storage
+
+
+class Command(BaseCommand):
+    """Delete stored blobs no document or version references any more."""
+
+    help = 'Garbage collect unreferenced document blobs and report deduplication savings.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-minutes', type=int, default=60,
+            help='Keep unreferenced blobs stored or re-uploaded within this time, as the rows '
+                 'referencing them may not be committed yet.'
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Report without deleting.')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(minutes=options['grace_minutes'])
+        garbage = Blob.objects.filter(ref_count__lte=0, last_used_at__lt=cutoff)
+
+        deleted = freed = 0
+        for blob in garbage.iterator():
+            if not options['dry_run']:
+                # Re-check under the delete so a blob re-used since the scan survives
+                if not Blob.objects.filter(pk=blob.pk, ref_count__lte=0, last_used_at__lt=cutoff).delete()[0]:
+                    continue
+                if blob_storage.exists(blob.name):
+                    blob_storage.delete(blob.name)
+            deleted += 1
+            freed += blob.size
+
+        action = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(f"{action} {deleted} blobs ({freed} bytes)")
+
+        stats = blob_stats()
+        self.stdout.write(
+            f"{stats['blobs']} blobs, {stats['stored_bytes']} bytes stored, "
+            f"{stats['referenced_bytes']} bytes referenced, {stats['saved_bytes']} bytes saved by deduplication"
+        )
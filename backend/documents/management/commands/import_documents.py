@@ -0,0 +1,57 @@
+import os
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from documents.imports import directory_files, import_documents
+
+
+class Command(BaseCommand):
+    """Import every file under a local directory as a new document."""
+
+    help = 'Bulk import the files under a directory as documents owned by one user, reporting files/sec.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Directory to import, recursively.')
+        parser.add_argument('--owner', required=True, help='Email of the user who will own the documents.')
+        parser.add_argument('--public', action='store_true', help='Make the imported documents public.')
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='Threads hashing and storing files (default: DOCUMENT_IMPORT_WORKERS).'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=None,
+            help='Documents inserted per query (default: DOCUMENT_IMPORT_BATCH_SIZE).'
+        )
+
+    def handle(self, *args, **options):
+        if not os.path.isdir(options['directory']):
+            raise CommandError(f"{options['directory']} is not a directory")
+        try:
+            owner = get_user_model().objects.get(email=options['owner'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"No user with email {options['owner']}")
+
+        def progress(documents, report):
+            self.stdout.write(
+                f"{report.imported} imported, {len(report.failures)} failed, "
+                f"{report.files_per_second:.1f} files/sec"
+            )
+
+        report = import_documents(
+            owner,
+            directory_files(options['directory']),
+            is_public=options['public'],
+            workers=options['workers'],
+            batch_size=options['batch_size'],
+            on_batch=progress
+        )
+
+        for name, detail in report.failures:
+            self.stderr.write(f"Failed: {name}: {detail}")
+        workers = options['workers'] or settings.DOCUMENT_IMPORT_WORKERS
+        self.stdout.write(
+            f"Imported {report.imported} files ({report.bytes} bytes) in {report.seconds:.1f}s: "
+            f"{report.files_per_second:.1f} files/sec with {workers} workers"
+        )
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from documents.counters import rebuild_counters, stale_documents
+from documents.models import Document
+
+
+class Command(BaseCommand):
+    """Recompute the denormalized comment, version and share counters of documents."""
+
+    help = 'Rebuild document comment, version and share counts and latest version numbers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--document', help='Only rebuild the counters of the document with this slug.')
+        parser.add_argument('--dry-run', action='store_true', help='Report stale documents without fixing them.')
+
+    def handle(self, *args, **options):
+        documents = Document.objects.all()
+        if options['document']:
+            documents = documents.filter(slug=options['document'])
+
+        if options['dry_run']:
+            stale = stale_documents(documents)
+            for slug in stale.values_list('slug', flat=True).iterator():
+                self.stdout.write(f"Stale: {slug}")
+            self.stdout.write(f"Would rebuild the counters of {stale.count()} documents")
+        else:
+            self.stdout.write(f"Rebuilt the counters of {rebuild_counters(documents)} documents")
@@ -0,0 +1,72 @@
+import threading
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from documents.models import Document
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    """Create documents with one title from many threads at once and check every create succeeds."""
+
+    help = 'Stress slug allocation with parallel creators of the same title.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=50, help='Parallel creators.')
+        parser.add_argument('--per-thread', type=int, default=5, help='Documents each creator saves.')
+        parser.add_argument('--title', default='Stress test document', help='Title every document gets.')
+        parser.add_argument('--keep', action='store_true', help='Keep the created documents and user.')
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite':
+            self.stdout.write('SQLite serializes writers; run against PostgreSQL for real concurrency')
+        owner = User.objects.create_user(
+            email=f"stress-owner-{time.time_ns()}@example.com",
+            first_name='Stress', last_name='Owner'
+        )
+        barrier = threading.Barrier(options['threads'])
+        errors = []
+
+        def create(thread):
+            try:
+                barrier.wait()
+                for i in range(options['per_thread']):
+                    Document.objects.create(
+                        title=options['title'],
+                        owner=owner,
+                        file=ContentFile(f"stress {thread}-{i}".encode(), name='stress.txt')
+                    )
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connections.close_all()
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=create, args=(n,)) for n in range(options['threads'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        created = Document.objects.filter(owner=owner)
+        slugs = list(created.values_list('slug', flat=True))
+        expected = options['threads'] * options['per_thread']
+        self.stdout.write(
+            f"{len(slugs)}/{expected} documents created in {elapsed:.2f}s, "
+            f"{len(set(slugs))} distinct slugs, {len(errors)} errors"
+        )
+        for exc in errors[:5]:
+            self.stderr.write(f"{type(exc).__name__}: {exc}")
+
+        if not options['keep']:
+            for document in created:
+                document.delete()
+            owner.delete()
+        if errors or len(slugs) != expected or len(set(slugs)) != expected:
+            raise CommandError('Slug allocation failed under concurrency')
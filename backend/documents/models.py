@@ -1,15 +1,86 @@
-from django.db import models
+from django.contrib.postgres.search import SearchVectorField
+from django.db import IntegrityError, models, router, transaction
+from django.db.models import Exists, OuterRef, Q
 from django.conf import settings
+from django.utils import timezone
 from django.utils.text import slugify
 import uuid
 import os
 
+from .storage import blob_storage, checksum_from_name
+
 
 def document_file_path(instance, filename):
-    """Generate file path for new document file."""
+    """Generate file path for new document or document version file."""
     ext = filename.split('.')[-1]
     filename = f"{uuid.uuid4()}.{ext}"
-    return os.path.join('documents', str(instance.owner.id), filename)
+    owner_id = instance.owner_id if isinstance(instance, Document) else instance.document.owner_id
+    return os.path.join('documents', str(owner_id), filename)
+
+
+# Inserts tried before a slug collision is raised
+SLUG_ATTEMPTS = 5
+
+
+def suffixed_slug(base):
+    """Return ``base`` with a random suffix, shortened to fit the slug column."""
+    suffix = uuid.uuid4().hex[:8]
+    return f"{base[:255 - len(suffix) - 1]}-{suffix}"
+
+
+def store_pending_file(instance):
+    """
+    Store a newly assigned file before the row is written.
+    
+    Blob storage names the file after its content hash, so storing it up
+    front lets the row be inserted with its size and checksum without a
+    second query or a stat of the stored file.
+    """
+    fieldfile = instance.file
+    if not fieldfile or fieldfile._committed:
+        return
+    if not instance.file_size:
+        instance.file_size = fieldfile.size
+    fieldfile.save(fieldfile.name, fieldfile.file, save=False)
+    if not instance.checksum:
+        instance.checksum = checksum_from_name(fieldfile.name)
+
+
+class DocumentAccessQuerySet(models.QuerySet):
+    """
+    QuerySet resolving which rows a user may see through their document.
+
+    Visibility is expressed as ``owner OR is_public OR EXISTS(share)`` so the
+    planner can walk the ``(owner, -updated_at)`` / ``(is_public, -updated_at)``
+    indexes and probe ``(shared_with, document)`` per row, instead of joining
+    every share and de-duplicating the result with ``DISTINCT``.
+    """
+
+    # Path from the queried model to its Document; empty for Document itself.
+    document_path = ''
+
+    def accessible_to(self, user):
+        """Return rows whose document is owned by, public to or shared with the user."""
+        prefix = f"{self.document_path}__" if self.document_path else ''
+        shares = SharedDocument.objects.filter(
+            document=OuterRef(self.document_path or 'pk'),
+            shared_with=user
+        )
+        return self.filter(
+            Q(**{f"{prefix}owner": user}) |
+            Q(**{f"{prefix}is_public": True}) |
+            Exists(shares)
+        )
+
+
+class DocumentQuerySet(DocumentAccessQuerySet):
+    """QuerySet for Document."""
+
+
+class DocumentRelatedQuerySet(DocumentAccessQuerySet):
+    """QuerySet for models hanging off a Document (comments, versions)."""
+
+    document_path = 'document'
 
 
 class Document(models.Model):
@@ -17,9 +88,10 @@ class Document(models.Model):
     
     title = models.CharField(max_length=255)
     description = models.TextField(blank=True)
-    file = models.FileField(upload_to=document_file_path)
+    file = models.FileField(upload_to=document_file_path, storage=blob_storage)
     file_type = models.CharField(max_length=50, blank=True)
-    file_size = models.PositiveIntegerField(default=0)  # Size in bytes
+    file_size = models.PositiveBigIntegerField(default=0)  # Size in bytes
+    checksum = models.CharField(max_length=64, blank=True)  # SHA-256 hex digest
     owner = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
@@ -29,32 +101,93 @@ class Document(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     is_public = models.BooleanField(default=False)
     slug = models.SlugField(max_length=255, unique=True, blank=True)
+    # Weighted title/description vector, maintained on PostgreSQL only
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Maintained by signals as related rows come and go; rebuild with rebuild_document_counters
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+    version_count = models.PositiveIntegerField(default=0, editable=False)
+    share_count = models.PositiveIntegerField(default=0, editable=False)
+    latest_version_number = models.PositiveIntegerField(default=0, editable=False)
+    
+    objects = DocumentQuerySet.as_manager()
     
     class Meta:
         ordering = ['-updated_at']
+        indexes = [
+            models.Index(fields=['owner', '-updated_at'], name='document_owner_updated_idx'),
+            models.Index(fields=['is_public', '-updated_at'], name='document_public_updated_idx'),
+        ]
     
     def __str__(self):
         return self.title
     
-    def save(self, *args, **kwargs):
-        if not self.slug:
-            self.slug = slugify(self.title)
-            # Ensure uniqueness of slug
-            if Document.objects.filter(slug=self.slug).exists():
-                self.slug = f"{self.slug}-{uuid.uuid4().hex[:8]}"
+    def get_next_version_number(self):
+        """
+        Return the number the next uploaded version of this document should get.
         
-        # Set file size and type if file is provided
+        Read it from a row locked with ``select_for_update()`` inside the
+        transaction that saves the version, so concurrent uploads cannot take
+        the same number. Versions written without signals leave the counter
+        behind; ``rebuild_document_counters`` brings it back in line.
+        """
+        return self.latest_version_number + 1
+    
+    def save(self, *args, **kwargs):
+        # Set file size, type and checksum if file is provided
+        store_pending_file(self)
         if self.file and not self.file_size:
             self.file_size = self.file.size
             
         if self.file and not self.file_type:
             filename = self.file.name
             self.file_type = filename.split('.')[-1].lower()
-            
-        super().save(*args, **kwargs)
+        
+        if self.slug:
+            super().save(*args, **kwargs)
+        else:
+            self._save_with_unique_slug(*args, **kwargs)
+    
+    def _save_with_unique_slug(self, *args, **kwargs):
+        """
+        Save under the title's slug, letting the unique index detect collisions.
+        
+        A colliding insert is rolled back to a savepoint and retried with a
+        random suffix, so creates need no existence check and concurrent
+        creates of one title all succeed.
+        """
+        base = slugify(self.title)
+        self.slug = base
+        using = kwargs.get('using') or router.db_for_write(Document, instance=self)
+        for attempt in range(SLUG_ATTEMPTS):
+            try:
+                with transaction.atomic(using=using):
+                    super().save(*args, **kwargs)
+                return
+            except IntegrityError:
+                taken = Document.objects.using(using).filter(slug=self.slug).exists()
+                if attempt == SLUG_ATTEMPTS - 1 or not taken:
+                    raise
+                self.slug = suffixed_slug(base)
 
 
-class Comment(models.Model):
+class CountedOnDocument(models.Model):
+    """
+    A row counted on its document.
+    
+    Saving it runs in a transaction, so the counter update made by the
+    post_save signal commits or rolls back with the row.
+    """
+    
+    class Meta:
+        abstract = True
+    
+    def save(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
+
+
+class Comment(CountedOnDocument):
     """Comment model for document comments."""
     
     document = models.ForeignKey(
@@ -71,14 +204,21 @@ class Comment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = DocumentRelatedQuerySet.as_manager()
+    
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            # A document's thread in order, and its feed of new or edited comments
+            models.Index(fields=['document', 'created_at'], name='comment_document_created_idx'),
+            models.Index(fields=['document', 'updated_at', 'id'], name='comment_document_updated_idx'),
+        ]
     
     def __str__(self):
         return f"Comment by {self.author.get_full_name()} on {self.document.title}"
 
 
-class SharedDocument(models.Model):
+class SharedDocument(CountedOnDocument):
     """Model for tracking document shares."""
     
     PERMISSION_CHOICES = (
@@ -107,21 +247,30 @@ class SharedDocument(models.Model):
     class Meta:
         unique_together = ['document', 'shared_with']
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['shared_with', 'document'], name='shared_user_document_idx'),
+        ]
     
     def __str__(self):
         return f"{self.document.title} shared with {self.shared_with.get_full_name()}"
 
 
-class DocumentVersion(models.Model):
+class DocumentVersion(CountedOnDocument):
     """Model for tracking document versions."""
     
+    STORAGE_MODE_CHOICES = (
+        ('full', 'Full copy'),
+        ('delta', 'Delta against a full version'),
+    )
+    
     document = models.ForeignKey(
         Document,
         on_delete=models.CASCADE,
         related_name='versions'
     )
-    file = models.FileField(upload_to=document_file_path)
-    file_size = models.PositiveIntegerField(default=0)
+    file = models.FileField(upload_to=document_file_path, storage=blob_storage)
+    file_size = models.PositiveBigIntegerField(default=0)
+    checksum = models.CharField(max_length=64, blank=True)  # SHA-256 hex digest
     version_number = models.PositiveIntegerField()
     created_by = models.ForeignKey(
         settings.AUTH_USER_MODEL,
@@ -131,6 +280,17 @@ class DocumentVersion(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True)
     comment = models.TextField(blank=True)
+    # Delta versions store a binary diff against delta_base, which is always full
+    storage_mode = models.CharField(max_length=5, choices=STORAGE_MODE_CHOICES, default='full')
+    delta_base = models.ForeignKey(
+        'self',
+        on_delete=models.RESTRICT,
+        null=True,
+        blank=True,
+        related_name='delta_versions'
+    )
+    
+    objects = DocumentRelatedQuerySet.as_manager()
     
     class Meta:
         ordering = ['-version_number']
@@ -140,8 +300,117 @@ class DocumentVersion(models.Model):
         return f"{self.document.title} - v{self.version_number}"
     
     def save(self, *args, **kwargs):
-        # Set file size if file is provided
+        # Set file size and checksum if file is provided
+        store_pending_file(self)
         if self.file and not self.file_size:
             self.file_size = self.file.size
             
-        super().save(*args, **kwargs)
\ No newline at end of file
+        super().save(*args, **kwargs)
+
+
+class Blob(models.Model):
+    """A stored file shared by every document and version with the same content."""
+    
+    name = models.CharField(max_length=255, unique=True)
+    sha256 = models.CharField(max_length=64, db_index=True)
+    size = models.PositiveBigIntegerField()
+    ref_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Set whenever the content is stored again; gc_blobs spares recently used blobs
+    last_used_at = models.DateTimeField(default=timezone.now, db_index=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return self.name
+
+
+class UploadSession(models.Model):
+    """A resumable upload assembled from numbered chunks."""
+    
+    STATUS_CHOICES = (
+        ('active', 'Active'),
+        ('completed', 'Completed'),
+    )
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='upload_sessions'
+    )
+    # Set when the upload becomes a new version of an existing document
+    document = models.ForeignKey(
+        Document,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='upload_sessions'
+    )
+    filename = models.CharField(max_length=255)
+    title = models.CharField(max_length=255, blank=True)
+    description = models.TextField(blank=True)
+    is_public = models.BooleanField(default=False)
+    comment = models.TextField(blank=True)
+    total_size = models.PositiveBigIntegerField(null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='active')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"Upload of {self.filename} by {self.owner}"
+
+
+class UploadChunk(models.Model):
+    """One stored chunk of an upload session."""
+    
+    session = models.ForeignKey(
+        UploadSession,
+        on_delete=models.CASCADE,
+        related_name='chunks'
+    )
+    index = models.PositiveIntegerField()
+    size = models.PositiveBigIntegerField()
+    checksum = models.CharField(max_length=64)  # SHA-256 of this chunk
+    path = models.CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['index']
+        unique_together = ['session', 'index']
+    
+    def __str__(self):
+        return f"{self.session_id} chunk {self.index}"
+
+
+class ExtractedText(models.Model):
+    """Body text extracted from a document or version file, one row per page."""
+    
+    document = models.ForeignKey(
+        Document,
+        on_delete=models.CASCADE,
+        related_name='extracted_texts'
+    )
+    version = models.ForeignKey(
+        DocumentVersion,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='extracted_texts'
+    )
+    page = models.PositiveIntegerField()
+    content = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['version', 'page']
+        indexes = [
+            models.Index(fields=['document', 'version', 'page'], name='extracted_text_page_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.document.title} - page {self.page}"
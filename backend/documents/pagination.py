@@ -0,0 +1,184 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework import filters
+from rest_framework.exceptions import NotFound, ValidationError as RequestValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination keyed on a unique, indexed ordering.
+
+    Each page is fetched with a ``WHERE (key) < (cursor)`` predicate instead of
+    an ``OFFSET``, and no ``COUNT(*)`` is issued, so every page costs the same.
+    The mode is opt-in: requests without the ``cursor`` query parameter are
+    handed to the default page number pagination. Pass ``?cursor=`` (empty)
+    to start from the first page and follow ``next`` from there.
+
+    The keyset fixes the order, so a cursor cannot be combined with the
+    view's search or ``ordering`` parameters; such requests are rejected.
+    """
+
+    # Ordering used for the keyset; the last field must be unique.
+    ordering = ('-id',)
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    invalid_cursor_message = 'Invalid cursor.'
+    conflicting_params_message = 'Cursor pagination cannot be combined with {params}; use page number pagination.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params:
+            self.fallback = api_settings.DEFAULT_PAGINATION_CLASS()
+            return self.fallback.paginate_queryset(queryset, request, view=view)
+
+        self.fallback = None
+        conflicting = self.get_conflicting_params(request, view)
+        if conflicting:
+            raise RequestValidationError({
+                self.cursor_query_param: self.conflicting_params_message.format(params=', '.join(conflicting))
+            })
+
+        self.request = request
+        self.model = queryset.model
+        page_size = self.get_page_size(request)
+
+        queryset = queryset.order_by(*self.ordering)
+        cursor = request.query_params[self.cursor_query_param]
+        if cursor:
+            queryset = queryset.filter(self.get_keyset_filter(self.decode_cursor(cursor)))
+
+        results = list(queryset[:page_size + 1])
+        self.has_next = len(results) > page_size
+        self.page = results[:page_size]
+        return self.page
+
+    def get_paginated_response(self, data):
+        if self.fallback is not None:
+            return self.fallback.get_paginated_response(data)
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_conflicting_params(self, request, view):
+        """Return the view's search and ordering parameters set on the request, which reorder results."""
+        params = []
+        for backend in getattr(view, 'filter_backends', ()):
+            if issubclass(backend, filters.SearchFilter):
+                params.append(backend.search_param)
+            elif issubclass(backend, filters.OrderingFilter):
+                params.append(backend.ordering_param)
+        return [param for param in params if request.query_params.get(param)]
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        values = [getattr(last, field.lstrip('-')) for field in self.ordering]
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(values))
+
+    def get_keyset_filter(self, values):
+        """Build ``(a, b) < (x, y)`` as ``a < x OR (a = x AND b < y)`` per field direction."""
+        keyset = Q()
+        equal = {}
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            keyset |= Q(**equal, **{f"{name}__{lookup}": value})
+            equal[name] = value
+        return keyset
+
+    def encode_cursor(self, values):
+        payload = json.dumps([
+            value.isoformat() if hasattr(value, 'isoformat') else value
+            for value in values
+        ])
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            raw = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+            if not isinstance(raw, list) or len(raw) != len(self.ordering):
+                raise ValueError
+            return [
+                self.model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, raw)
+            ]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+
+class DocumentKeysetPagination(KeysetPagination):
+    """Keyset pagination for documents, newest changes first."""
+
+    ordering = ('-updated_at', '-id')
+
+
+class CommentKeysetPagination(KeysetPagination):
+    """Keyset pagination for comments, in thread order."""
+
+    ordering = ('created_at', 'id')
+
+
+class CommentFeedPagination(KeysetPagination):
+    """
+    Incremental feed of a thread's comments created or edited after the ``since`` cursor.
+
+    Comments come oldest change first. Every page also returns ``since``, the
+    cursor to poll with next, which stays put while nothing changes. Start
+    with ``?since=`` (empty). Deleted comments do not appear in the feed.
+    """
+
+    ordering = ('updated_at', 'id')
+    cursor_query_param = 'since'
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.fallback is None:
+            response.data['since'] = self.get_since()
+        return response
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties']['since'] = {'type': 'string'}
+        return response_schema
+
+    def get_since(self):
+        if not self.page:
+            return self.request.query_params[self.cursor_query_param]
+        last = self.page[-1]
+        return self.encode_cursor([getattr(last, field) for field in self.ordering])
+
+
+class DocumentVersionKeysetPagination(KeysetPagination):
+    """Keyset pagination for document versions, newest first."""
+
+    ordering = ('-created_at', '-id')
@@ -0,0 +1,218 @@
+"""
+ASGI app pushing document activity to clients.
+
+``/api/events/`` serves the same stream two ways. Over HTTP it is
+server-sent events (``EventSource``); over a WebSocket, each event is a
+text frame. Clients authenticate with their JWT access token, either as
+``?token=`` (``EventSource`` cannot set headers) or in an
+``Authorization: Bearer`` header. Every stream carries events for the
+user's own channel: comments and versions on their documents, and shares
+granted, changed or removed. ``?documents=<slug>,<slug>`` adds the full
+activity of documents the user can read.
+
+Each open stream costs a queue and a task on the worker's event loop, so
+one worker holds thousands of idle subscribers. Access to a subscribed
+document is checked again after events that can revoke it.
+"""
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+
+from .access import has_document_permission
+from .events import ACCESS_EVENTS, document_channel, get_broker, user_channel
+from .models import Document
+
+EVENTS_PATH = '/api/events/'
+
+# Most documents one stream may subscribe to
+MAX_DOCUMENTS = 100
+
+
+class StreamRefused(Exception):
+    """Raised when a stream cannot be opened; carries the HTTP status to answer with."""
+
+    def __init__(self, status, detail):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+
+@sync_to_async
+def authenticate(raw_token):
+    authentication = JWTAuthentication()
+    try:
+        return authentication.get_user(authentication.get_validated_token(raw_token))
+    except (InvalidToken, TokenError, AuthenticationFailed):
+        raise StreamRefused(401, 'Given token not valid or expired.')
+
+
+@sync_to_async
+def readable_documents(user, slugs):
+    """Return the ids of the documents with ``slugs`` the user may read, or refuse if any is missing."""
+    documents = dict(Document.objects.accessible_to(user).filter(slug__in=slugs).values_list('slug', 'pk'))
+    missing = sorted(set(slugs) - documents.keys())
+    if missing:
+        raise StreamRefused(404, f"Documents not found: {', '.join(missing)}.")
+    return list(documents.values())
+
+
+@sync_to_async
+def can_read(user, document_id):
+    document = Document.objects.filter(pk=document_id).first()
+    return document is not None and has_document_permission(user, document, 'view')
+
+
+class EventStreamApp:
+    def __init__(self, broker=None, heartbeat=None, max_connections=None):
+        self.broker = broker
+        self.heartbeat = heartbeat or settings.DOCUMENT_EVENTS_HEARTBEAT
+        self.max_connections = max_connections or settings.DOCUMENT_EVENTS_MAX_CONNECTIONS
+        self.connections = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            await self.serve_event_source(scope, receive, send)
+        elif scope['type'] == 'websocket':
+            await self.serve_websocket(scope, receive, send)
+
+    async def open(self, scope):
+        """Authenticate the request and subscribe it to its channels."""
+        if self.connections >= self.max_connections:
+            raise StreamRefused(503, 'Too many open event streams.')
+        query = parse_qs(scope.get('query_string', b'').decode())
+        headers = dict(scope.get('headers', []))
+        raw_token = query.get('token', [''])[0]
+        authorization = headers.get(b'authorization', b'').decode()
+        if not raw_token and authorization.startswith('Bearer '):
+            raw_token = authorization[len('Bearer '):]
+        if not raw_token:
+            raise StreamRefused(401, 'Authentication credentials were not provided.')
+        user = await authenticate(raw_token)
+
+        slugs = [slug for slug in ','.join(query.get('documents', [])).split(',') if slug]
+        if len(slugs) > MAX_DOCUMENTS:
+            raise StreamRefused(400, f"At most {MAX_DOCUMENTS} documents can be followed per stream.")
+        document_ids = await readable_documents(user, slugs) if slugs else []
+
+        channels = [user_channel(user.pk)] + [document_channel(document_id) for document_id in document_ids]
+        broker = self.broker or get_broker()
+        return user, broker.subscribe(channels)
+
+    async def stream(self, user, subscription, emit):
+        """Pass events to ``emit(events)`` until the connection closes; ``emit([])`` is a heartbeat."""
+        while True:
+            try:
+                events = [await subscription.get(self.heartbeat)]
+            except asyncio.TimeoutError:
+                await emit([])
+                continue
+            # Send whatever else is already queued in the same write
+            event = subscription.get_nowait()
+            while event is not None:
+                events.append(event)
+                event = subscription.get_nowait()
+            if subscription.overflowed:
+                subscription.overflowed = False
+                events.append((None, 'resync', json.dumps({'type': 'resync'})))
+
+            allowed = []
+            for channel, event_type, message in events:
+                if event_type in ACCESS_EVENTS and channel in subscription.channels and channel != user_channel(user.pk):
+                    document_id = int(channel.split(':', 1)[1])
+                    if not await can_read(user, document_id):
+                        subscription.remove_channel(channel)
+                        message = json.dumps({'type': 'access.revoked', 'document': document_id})
+                        allowed.append((channel, 'access.revoked', message))
+                        continue
+                allowed.append((channel, event_type, message))
+            await emit(allowed)
+
+    async def run(self, user, subscription, emit, wait_closed):
+        """Stream until ``wait_closed()`` returns or sending fails, then unsubscribe."""
+        self.connections += 1
+        streaming = asyncio.ensure_future(self.stream(user, subscription, emit))
+        closed = asyncio.ensure_future(wait_closed())
+        try:
+            await asyncio.wait({streaming, closed}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            streaming.cancel()
+            closed.cancel()
+            subscription.close()
+            self.connections -= 1
+        if streaming.done() and not streaming.cancelled() and streaming.exception() is not None:
+            exception = streaming.exception()
+            if not isinstance(exception, OSError):
+                raise exception
+
+    async def serve_event_source(self, scope, receive, send):
+        if scope['method'] != 'GET':
+            await send_json(send, 405, {'detail': f"Method \"{scope['method']}\" not allowed."})
+            return
+        try:
+            user, subscription = await self.open(scope)
+        except StreamRefused as exc:
+            await send_json(send, exc.status, {'detail': exc.detail})
+            return
+
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                # Stop nginx from buffering the stream
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': b': connected\n\n', 'more_body': True})
+
+        async def emit(events):
+            if events:
+                body = ''.join(f"event: {event_type}\ndata: {message}\n\n" for _, event_type, message in events)
+            else:
+                body = ': keep-alive\n\n'
+            await send({'type': 'http.response.body', 'body': body.encode(), 'more_body': True})
+
+        async def wait_closed():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        await self.run(user, subscription, emit, wait_closed)
+
+    async def serve_websocket(self, scope, receive, send):
+        if (await receive())['type'] != 'websocket.connect':
+            return
+        try:
+            user, subscription = await self.open(scope)
+        except StreamRefused as exc:
+            # Application close codes mirror the HTTP status
+            await send({'type': 'websocket.close', 'code': 4000 + exc.status, 'reason': exc.detail[:120]})
+            return
+        await send({'type': 'websocket.accept'})
+
+        async def emit(events):
+            for _, event_type, message in events:
+                await send({'type': 'websocket.send', 'text': message})
+
+        async def wait_closed():
+            # Messages from the client are ignored
+            while (await receive())['type'] != 'websocket.disconnect':
+                pass
+
+        await self.run(user, subscription, emit, wait_closed)
+
+
+async def send_json(send, status, payload):
+    body = json.dumps(payload).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': body})
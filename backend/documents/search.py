@@ -0,0 +1,106 @@
+import re
+
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connections
+from django.db.models import F, Func, OuterRef, Subquery, TextField, Value
+from rest_framework import filters
+
+# Text search configuration used for both the stored vector and the queries.
+SEARCH_CONFIG = 'english'
+
+SEARCH_INDEX_NAME = 'document_search_vector_gin'
+
+
+def is_search_supported(using='default'):
+    """Return whether the database behind ``using`` has the tsvector column maintained."""
+    return connections[using].vendor == 'postgresql'
+
+
+def search_vector_expression():
+    """
+    Weighted search vector for a document.
+
+    Title (A) ranks above description (B), which ranks above the extracted
+    body text of the file and its versions (C). The body is aggregated in
+    the database and truncated to DOCUMENT_SEARCH_BODY_LIMIT characters so
+    the vector stays within PostgreSQL's tsvector size limit.
+    """
+    from .models import ExtractedText
+    body = ExtractedText.objects.filter(document=OuterRef('pk')).order_by().values(
+        'document'
+    ).annotate(
+        text=StringAgg('content', delimiter=' ', ordering=('version', 'page'))
+    ).values('text')
+    truncated_body = Func(
+        Subquery(body), Value(settings.DOCUMENT_SEARCH_BODY_LIMIT),
+        function='left', output_field=TextField()
+    )
+    return (
+        SearchVector('title', weight='A', config=SEARCH_CONFIG) +
+        SearchVector('description', weight='B', config=SEARCH_CONFIG) +
+        SearchVector(truncated_body, weight='C', config=SEARCH_CONFIG)
+    )
+
+
+def update_search_vector(document_ids, using='default'):
+    """Recompute the stored search vector for the given documents."""
+    if not is_search_supported(using):
+        return
+    from .models import Document
+    Document.objects.using(using).filter(pk__in=document_ids).update(
+        search_vector=search_vector_expression()
+    )
+
+
+def install_search_index(using='default'):
+    """Create the GIN index on the search vector column if it is missing."""
+    if not is_search_supported(using):
+        return
+    from .models import Document
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f'CREATE INDEX IF NOT EXISTS {SEARCH_INDEX_NAME} '
+            f'ON {Document._meta.db_table} USING gin (search_vector)'
+        )
+
+
+def build_search_query(terms):
+    """
+    Build a prefix-matching ``tsquery`` requiring every term.
+
+    Terms are reduced to word characters so user input can never inject
+    ``tsquery`` operators; ``"inv rep"`` becomes ``inv:* & rep:*``.
+    """
+    words = [word for term in terms for word in re.findall(r'\w+', term)]
+    if not words:
+        return None
+    return SearchQuery(
+        ' & '.join(f"{word}:*" for word in words),
+        search_type='raw',
+        config=SEARCH_CONFIG
+    )
+
+
+class DocumentSearchFilter(filters.SearchFilter):
+    """
+    Ranked full-text search over the document search vector.
+
+    On PostgreSQL the ``search`` parameter is matched against the GIN-indexed
+    ``search_vector`` column, which also covers extracted body text, and
+    results are ordered by rank. Other databases (e.g. SQLite in local tests)
+    fall back to ``SearchFilter``'s ``icontains`` matching over ``search_fields``.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms or not is_search_supported(queryset.db):
+            return super().filter_queryset(request, queryset, view)
+
+        query = build_search_query(terms)
+        if query is None:
+            return queryset
+        return queryset.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F('search_vector'), query)
+        ).order_by('-search_rank', '-updated_at')
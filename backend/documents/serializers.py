@@ -1,10 +1,41 @@
 from rest_framework import serializers
+from rest_framework.reverse import reverse
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from .models import Document, Comment, SharedDocument, DocumentVersion
+from django.db.models import Prefetch
+from .models import (
+    Document, Comment, SharedDocument, DocumentVersion, UploadSession, UploadChunk
+)
 
 User = get_user_model()
 
 
+class EagerLoadingMixin:
+    """
+    Declare the relations a serializer reads so views can load them up front.
+    
+    ``select_related_fields`` lists forward relations joined into the main
+    query. ``prefetch_related_fields`` maps reverse relations to the serializer
+    used for the related rows, whose own plan is applied to the prefetch.
+    """
+    
+    select_related_fields = ()
+    prefetch_related_fields = {}
+    
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        """Apply this serializer's select/prefetch plan to a queryset."""
+        if cls.select_related_fields:
+            queryset = queryset.select_related(*cls.select_related_fields)
+        for relation, serializer_class in cls.prefetch_related_fields.items():
+            related_model = queryset.model._meta.get_field(relation).related_model
+            queryset = queryset.prefetch_related(Prefetch(
+                relation,
+                queryset=serializer_class.setup_eager_loading(related_model._default_manager.all())
+            ))
+        return queryset
+
+
 class UserMinimalSerializer(serializers.ModelSerializer):
     """Minimal serializer for User model."""
     
@@ -18,11 +49,13 @@ class UserMinimalSerializer(serializers.ModelSerializer):
         return obj.get_full_name()
 
 
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     """Serializer for the Comment model."""
     
     author = UserMinimalSerializer(read_only=True)
     
+    select_related_fields = ('author',)
+    
     class Meta:
         model = Comment
         fields = ('id', 'author', 'content', 'created_at', 'updated_at')
@@ -38,11 +71,33 @@ class CommentCreateSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
-class SharedDocumentSerializer(serializers.ModelSerializer):
+class CommentBulkItemSerializer(serializers.Serializer):
+    """One comment of a bulk create; documents are looked up together by the view."""
+    
+    document = serializers.IntegerField()
+    content = serializers.CharField()
+
+
+class CommentBulkCreateSerializer(serializers.Serializer):
+    """Serializer for creating many comments at once."""
+    
+    comments = CommentBulkItemSerializer(many=True, allow_empty=False)
+    
+    def validate_comments(self, comments):
+        if len(comments) > settings.DOCUMENT_BULK_COMMENT_LIMIT:
+            raise serializers.ValidationError(
+                f"At most {settings.DOCUMENT_BULK_COMMENT_LIMIT} comments can be created at once."
+            )
+        return comments
+
+
+class SharedDocumentSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     """Serializer for the SharedDocument model."""
     
     shared_with = UserMinimalSerializer(read_only=True)
     
+    select_related_fields = ('shared_with',)
+    
     class Meta:
         model = SharedDocument
         fields = ('id', 'shared_with', 'permission', 'created_at')
@@ -58,15 +113,70 @@ class SharedDocumentCreateSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
-class DocumentVersionSerializer(serializers.ModelSerializer):
+class SharedDocumentBulkDeleteSerializer(serializers.Serializer):
+    """Serializer for removing the shares of several documents with several users."""
+    
+    documents = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+    shared_with = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+    
+    def validate(self, attrs):
+        # Drop repeated ids, keeping the order results are reported in
+        attrs['documents'] = list(dict.fromkeys(attrs['documents']))
+        attrs['shared_with'] = list(dict.fromkeys(attrs['shared_with']))
+        pairs = len(attrs['documents']) * len(attrs['shared_with'])
+        if pairs > settings.DOCUMENT_BULK_SHARE_MAX_PAIRS:
+            raise serializers.ValidationError(
+                f"{pairs} document/user pairs exceed the limit of {settings.DOCUMENT_BULK_SHARE_MAX_PAIRS}."
+            )
+        return attrs
+
+
+class SharedDocumentBulkSerializer(SharedDocumentBulkDeleteSerializer):
+    """Serializer for sharing several documents with several users."""
+    
+    permission = serializers.ChoiceField(choices=SharedDocument.PERMISSION_CHOICES)
+
+
+class DownloadURLField(serializers.Field):
+    """Read-only link to an object's download endpoint."""
+    
+    def __init__(self, view_name, lookup_field='pk', **kwargs):
+        self.view_name = view_name
+        self.lookup_field = lookup_field
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+    
+    def to_representation(self, instance):
+        return reverse(
+            self.view_name,
+            args=[getattr(instance, self.lookup_field)],
+            request=self.context.get('request')
+        )
+
+
+class DocumentVersionSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     """Serializer for the DocumentVersion model."""
     
     created_by = UserMinimalSerializer(read_only=True)
+    download_url = DownloadURLField('documentversion-download')
+    
+    select_related_fields = ('created_by',)
     
     class Meta:
         model = DocumentVersion
-        fields = ('id', 'version_number', 'file', 'file_size', 'created_by', 'created_at', 'comment')
-        read_only_fields = ('id', 'file_size', 'created_at')
+        fields = (
+            'id', 'version_number', 'file', 'download_url', 'file_size', 'checksum', 'storage_mode',
+            'created_by', 'created_at', 'comment'
+        )
+        read_only_fields = ('id', 'file_size', 'checksum', 'storage_mode', 'created_at')
+    
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # The stored file of a delta version is not the document itself
+        if instance.storage_mode == 'delta':
+            data['file'] = data['download_url']
+        return data
 
 
 class DocumentVersionCreateSerializer(serializers.ModelSerializer):
@@ -78,36 +188,49 @@ class DocumentVersionCreateSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
-class DocumentSerializer(serializers.ModelSerializer):
+class DocumentSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     """Serializer for the Document model."""
     
     owner = UserMinimalSerializer(read_only=True)
+    download_url = DownloadURLField('document-download', lookup_field='slug')
+    
+    select_related_fields = ('owner',)
     
     class Meta:
         model = Document
         fields = (
-            'id', 'title', 'description', 'file', 'file_type', 'file_size',
-            'owner', 'created_at', 'updated_at', 'is_public', 'slug'
+            'id', 'title', 'description', 'file', 'download_url', 'file_type', 'file_size', 'checksum',
+            'owner', 'created_at', 'updated_at', 'is_public', 'slug',
+            'comment_count', 'version_count', 'share_count', 'latest_version_number'
         )
-        read_only_fields = ('id', 'file_size', 'file_type', 'created_at', 'updated_at', 'slug')
+        read_only_fields = ('id', 'file_size', 'file_type', 'checksum', 'created_at', 'updated_at', 'slug')
 
 
-class DocumentDetailSerializer(serializers.ModelSerializer):
+class DocumentDetailSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     """Detailed serializer for the Document model."""
     
     owner = UserMinimalSerializer(read_only=True)
+    download_url = DownloadURLField('document-download', lookup_field='slug')
     comments = CommentSerializer(many=True, read_only=True)
     shares = SharedDocumentSerializer(many=True, read_only=True)
     versions = DocumentVersionSerializer(many=True, read_only=True)
     
+    select_related_fields = ('owner',)
+    prefetch_related_fields = {
+        'comments': CommentSerializer,
+        'shares': SharedDocumentSerializer,
+        'versions': DocumentVersionSerializer,
+    }
+    
     class Meta:
         model = Document
         fields = (
-            'id', 'title', 'description', 'file', 'file_type', 'file_size',
+            'id', 'title', 'description', 'file', 'download_url', 'file_type', 'file_size', 'checksum',
             'owner', 'created_at', 'updated_at', 'is_public', 'slug',
+            'comment_count', 'version_count', 'share_count', 'latest_version_number',
             'comments', 'shares', 'versions'
         )
-        read_only_fields = ('id', 'file_size', 'file_type', 'created_at', 'updated_at', 'slug')
+        read_only_fields = ('id', 'file_size', 'file_type', 'checksum', 'created_at', 'updated_at', 'slug')
 
 
 class DocumentCreateSerializer(serializers.ModelSerializer):
@@ -116,4 +239,64 @@ class DocumentCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Document
         fields = ('id', 'title', 'description', 'file', 'is_public')
-        read_only_fields = ('id',)
\ No newline at end of file
+        read_only_fields = ('id',)
+
+
+class DocumentImportSerializer(serializers.Serializer):
+    """Serializer for importing many files, or a zip or tar archive of them, as new documents."""
+    
+    files = serializers.ListField(child=serializers.FileField(), required=False)
+    archive = serializers.FileField(required=False)
+    is_public = serializers.BooleanField(default=False)
+    
+    def validate(self, attrs):
+        if bool(attrs.get('files')) == bool(attrs.get('archive')):
+            raise serializers.ValidationError("Provide either files or an archive.")
+        return attrs
+
+
+class UploadChunkSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    """Serializer for stored upload chunks."""
+    
+    class Meta:
+        model = UploadChunk
+        fields = ('index', 'size', 'checksum', 'created_at')
+        read_only_fields = fields
+
+
+class UploadSessionSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    """Serializer for upload sessions, listing the chunks received so far."""
+    
+    chunks = UploadChunkSerializer(many=True, read_only=True)
+    received_bytes = serializers.SerializerMethodField()
+    
+    prefetch_related_fields = {'chunks': UploadChunkSerializer}
+    
+    class Meta:
+        model = UploadSession
+        fields = (
+            'id', 'document', 'filename', 'title', 'description', 'is_public',
+            'comment', 'total_size', 'status', 'chunks', 'received_bytes',
+            'created_at', 'updated_at'
+        )
+        read_only_fields = fields
+    
+    def get_received_bytes(self, obj):
+        return sum(chunk.size for chunk in obj.chunks.all())
+
+
+class UploadSessionCreateSerializer(serializers.ModelSerializer):
+    """
+    Serializer for starting an upload session.
+    
+    Leave ``document`` empty to upload a new document, or set it to upload a
+    new version of an existing one.
+    """
+    
+    class Meta:
+        model = UploadSession
+        fields = (
+            'id', 'document', 'filename', 'title', 'description', 'is_public',
+            'comment', 'total_size'
+        )
+        read_only_fields = ('id',)
@@ -0,0 +1,237 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_migrate, post_save
+from django.dispatch import receiver
+
+from .access import document_scope
+from .bulk import defer_document_update
+from .caching import bump_document_lists, bump_generation, user_scope
+from .counters import adjust_counters
+from .events import publish_event
+from .models import Comment, Document, DocumentVersion, SharedDocument
+from .search import install_search_index, update_search_vector
+from .storage import release_blob, retain_blob
+from .tasks import compact_version, extract_document_text, extract_version_text
+
+
+def _deleted_with_document(origin):
+    return isinstance(origin, Document) or getattr(origin, 'model', None) is Document
+
+
+# Document fields feeding the search vector; extracted text is refreshed by the extraction tasks
+SEARCH_FIELDS = ('title', 'description')
+
+
+def _search_values(instance):
+    return tuple(instance.__dict__.get(field) for field in SEARCH_FIELDS)
+
+
+@receiver(post_init, sender=Document)
+def remember_search_values(sender, instance, **kwargs):
+    """Remember the searched fields, so saves that leave them alone skip the vector refresh."""
+    instance._stored_search_values = _search_values(instance) if instance.pk else None
+
+
+@receiver(post_save, sender=Document)
+def refresh_document_search_vector(sender, instance, created, raw=False, using='default', update_fields=None, **kwargs):
+    """Keep the stored search vector in step with the title and description."""
+    if raw or (update_fields is not None and not update_fields.intersection(SEARCH_FIELDS)):
+        return
+    values = _search_values(instance)
+    if created or values != instance._stored_search_values:
+        update_search_vector([instance.pk], using=using)
+        instance._stored_search_values = values
+
+
+@receiver(post_save, sender=Document)
+def queue_document_text_extraction(sender, instance, created, raw=False, **kwargs):
+    """Extract the uploaded file's text in the background once the row is committed."""
+    if created and not raw:
+        # robust: the row is already committed, so a broker outage is logged rather than failing the request
+        transaction.on_commit(lambda: extract_document_text.delay(instance.pk), robust=True)
+
+
+@receiver(post_save, sender=DocumentVersion)
+def queue_version_text_extraction(sender, instance, created, raw=False, **kwargs):
+    """Extract a new version's text in the background once the row is committed."""
+    if created and not raw:
+        transaction.on_commit(lambda: extract_version_text.delay(instance.pk), robust=True)
+
+
+@receiver(post_save, sender=DocumentVersion)
+def queue_version_compaction(sender, instance, created, raw=False, **kwargs):
+    """Store a new version as a delta in the background when delta storage is enabled."""
+    if created and not raw and settings.DOCUMENT_VERSION_DELTA_STORAGE:
+        transaction.on_commit(lambda: compact_version.delay(instance.pk), robust=True)
+
+
+@receiver(post_migrate)
+def create_document_search_index(sender, using='default', **kwargs):
+    """Install the GIN search index once the documents table exists."""
+    if sender.name == 'documents':
+        install_search_index(using=using)
+
+
+@receiver(post_init, sender=Document)
+@receiver(post_init, sender=DocumentVersion)
+def remember_stored_file(sender, instance, **kwargs):
+    """Remember the stored file name so a replaced file can release its blob."""
+    value = instance.__dict__.get('file')
+    instance._stored_file_name = getattr(value, 'name', value) if instance.pk else None
+
+
+@receiver(post_init, sender=Document)
+def remember_public_flag(sender, instance, **kwargs):
+    """Remember whether the document was public, so making it private refreshes every list."""
+    instance._stored_is_public = bool(instance.pk and instance.__dict__.get('is_public'))
+
+
+@receiver(post_save, sender=Document)
+@receiver(post_save, sender=DocumentVersion)
+def count_blob_reference(sender, instance, raw=False, **kwargs):
+    """Reference the row's blob, and release the previous one when the file changed."""
+    if raw or 'file' not in instance.__dict__:
+        return
+    name = instance.file.name
+    if name == instance._stored_file_name:
+        return
+    retain_blob(name)
+    release_blob(instance._stored_file_name)
+    instance._stored_file_name = name
+
+
+@receiver(post_delete, sender=Document)
+@receiver(post_delete, sender=DocumentVersion)
+def release_blob_reference(sender, instance, **kwargs):
+    """Release the deleted row's blob; gc_blobs removes it once unreferenced."""
+    release_blob(instance._stored_file_name)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_save, sender=DocumentVersion)
+@receiver(post_save, sender=SharedDocument)
+def count_on_document(sender, instance, created, raw=False, **kwargs):
+    """Count a new comment, version or share on its document, in the transaction that saves it."""
+    if created and not raw and not defer_document_update(instance.document_id):
+        adjust_counters(instance, 1)
+
+
+@receiver(post_delete, sender=Comment)
+@receiver(post_delete, sender=DocumentVersion)
+@receiver(post_delete, sender=SharedDocument)
+def uncount_on_document(sender, instance, origin=None, **kwargs):
+    """Uncount a deleted comment, version or share, unless its document is being deleted too."""
+    if not _deleted_with_document(origin) and not defer_document_update(instance.document_id):
+        adjust_counters(instance, -1)
+
+
+@receiver(post_save, sender=Document)
+@receiver(post_delete, sender=Document)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+@receiver(post_save, sender=DocumentVersion)
+@receiver(post_delete, sender=DocumentVersion)
+@receiver(post_save, sender=SharedDocument)
+@receiver(post_delete, sender=SharedDocument)
+def invalidate_document_lists(sender, instance, raw=False, **kwargs):
+    """Drop the cached lists showing the document, and its counters, once a change is committed."""
+    user_ids, public = (), False
+    if sender is Document:
+        document_id = instance.pk
+        # A deleted document can no longer be looked up once committed
+        user_ids = [instance.owner_id]
+        public = instance.is_public or instance._stored_is_public
+        instance._stored_is_public = instance.is_public
+    else:
+        document_id = instance.document_id
+        if sender is SharedDocument:
+            user_ids = [instance.shared_with_id]
+    if not raw and not defer_document_update(document_id):
+        transaction.on_commit(lambda: bump_document_lists([document_id], user_ids, public))
+
+
+@receiver(post_save, sender=Document)
+@receiver(post_delete, sender=Document)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+@receiver(post_save, sender=DocumentVersion)
+@receiver(post_delete, sender=DocumentVersion)
+@receiver(post_save, sender=SharedDocument)
+@receiver(post_delete, sender=SharedDocument)
+def invalidate_document_cache(sender, instance, raw=False, **kwargs):
+    """Drop the document's cached responses and permissions once the change is committed."""
+    document_id = instance.pk if sender is Document else instance.document_id
+    if not raw and not defer_document_update(document_id):
+        transaction.on_commit(lambda: bump_generation(document_scope(document_id)))
+
+
+@receiver(post_save, sender=Document)
+def publish_document_saved(sender, instance, created, raw=False, **kwargs):
+    """Tell the document's subscribers it changed, so they can refetch it and recheck access."""
+    if not created and not raw and not defer_document_update(instance.pk):
+        publish_event('document.updated', instance.pk)
+
+
+@receiver(post_delete, sender=Document)
+def publish_document_deleted(sender, instance, **kwargs):
+    publish_event('document.deleted', instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+def publish_comment_saved(sender, instance, created, raw=False, **kwargs):
+    """Tell the document's subscribers, and its owner, about a new or edited comment."""
+    if raw or defer_document_update(instance.document_id):
+        return
+    owner_id = instance.document.owner_id
+    publish_event(
+        'comment.created' if created else 'comment.updated', instance.document_id,
+        user_ids=[owner_id] if owner_id != instance.author_id else [],
+        comment=instance.pk, author=instance.author_id
+    )
+
+
+@receiver(post_delete, sender=Comment)
+def publish_comment_deleted(sender, instance, origin=None, **kwargs):
+    if not _deleted_with_document(origin) and not defer_document_update(instance.document_id):
+        publish_event('comment.deleted', instance.document_id, comment=instance.pk)
+
+
+@receiver(post_save, sender=DocumentVersion)
+def publish_version_created(sender, instance, created, raw=False, **kwargs):
+    """Tell the document's subscribers, and its owner, about a new version."""
+    if not created or raw or defer_document_update(instance.document_id):
+        return
+    owner_id = instance.document.owner_id
+    publish_event(
+        'version.created', instance.document_id,
+        user_ids=[owner_id] if owner_id != instance.created_by_id else [],
+        version=instance.pk, version_number=instance.version_number
+    )
+
+
+@receiver(post_save, sender=SharedDocument)
+def publish_share_saved(sender, instance, created, raw=False, **kwargs):
+    """Tell the document's subscribers and the user it is shared with about a new or changed share."""
+    if not raw and not defer_document_update(instance.document_id):
+        publish_event(
+            'share.created' if created else 'share.updated', instance.document_id,
+            user_ids=[instance.shared_with_id],
+            shared_with=instance.shared_with_id, permission=instance.permission
+        )
+
+
+@receiver(post_delete, sender=SharedDocument)
+def publish_share_deleted(sender, instance, origin=None, **kwargs):
+    if not _deleted_with_document(origin) and not defer_document_update(instance.document_id):
+        publish_event(
+            'share.deleted', instance.document_id,
+            user_ids=[instance.shared_with_id], shared_with=instance.shared_with_id
+        )
+
+
+@receiver(post_save, sender=get_user_model())
+def invalidate_user_cache(sender, instance, raw=False, **kwargs):
+    """Drop the user's cached responses once the change is committed."""
+    if not raw:
+        transaction.on_commit(lambda: bump_generation(user_scope(instance.pk)))
@@ -0,0 +1,156 @@
+import hashlib
+import os
+import re
+import tempfile
+
+from django.core.files import File
+from django.core.files.storage import Storage, default_storage
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+BLOB_PREFIX = 'blobs'
+BLOB_NAME_RE = re.compile(rf'^{BLOB_PREFIX}/[0-9a-f]{{2}}/[0-9a-f]{{2}}/(?P<sha256>[0-9a-f]{{64}})(\.\w+)?$')
+
+# Uploads larger than this are spooled to disk while being hashed
+SPOOL_MAX_SIZE = 1024 * 1024
+READ_SIZE = 64 * 1024
+
+
+def blob_name(sha256, ext=''):
+    return f"{BLOB_PREFIX}/{sha256[:2]}/{sha256[2:4]}/{sha256}{ext}"
+
+
+def checksum_from_name(name):
+    """Return the SHA-256 encoded in a blob name, or '' for files stored before blobs."""
+    match = BLOB_NAME_RE.match(name or '')
+    return match.group('sha256') if match else ''
+
+
+@deconstructible
+class ContentAddressedStorage(Storage):
+    """
+    Storage that names every file after the SHA-256 of its content.
+
+    Saving bytes that are already stored writes nothing and returns the
+    existing name, so identical uploads share one blob. Each blob has a
+    ``Blob`` row whose ``ref_count`` is kept by the document signals;
+    unreferenced blobs are removed by the ``gc_blobs`` command once they
+    have not been saved again for its grace period. Files
+    themselves live in the default storage backend, and names that predate
+    blob storage are still served from there unchanged.
+    """
+
+    @property
+    def backend(self):
+        return default_storage
+
+    def _save(self, name, content):
+        from .models import Blob
+
+        stored, sha256, size = self.store_content(name, content)
+        blob, created = Blob.objects.get_or_create(name=stored, defaults={'sha256': sha256, 'size': size})
+        if not created:
+            # The reference is only counted when the row using it is saved, which
+            # may be much later; until then the fresh timestamp keeps gc_blobs away
+            Blob.objects.filter(pk=blob.pk).update(last_used_at=timezone.now())
+        return stored
+
+    def store_content(self, name, content):
+        """
+        Store ``content`` under its hash without creating its ``Blob`` row.
+
+        Returns the stored name, the SHA-256 and the size. Callers storing
+        many files create the rows themselves, in bulk.
+        """
+        ext = os.path.splitext(name)[1].lower()
+        if hasattr(content, 'temporary_file_path'):
+            # Already on local disk: hash it in place and let the backend move it
+            sha256, size = self._hash(content)
+            stored = self._store(blob_name(sha256, ext), content)
+        else:
+            with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as spool:
+                sha256, size = self._hash(content, copy_to=spool)
+                spool.seek(0)
+                stored = self._store(blob_name(sha256, ext), File(spool))
+        return stored, sha256, size
+
+    def _hash(self, content, copy_to=None):
+        digest = hashlib.sha256()
+        size = 0
+        for chunk in content.chunks(READ_SIZE):
+            digest.update(chunk)
+            size += len(chunk)
+            if copy_to is not None:
+                copy_to.write(chunk)
+        return digest.hexdigest(), size
+
+    def _store(self, name, content):
+        if self.backend.exists(name):
+            return name
+        stored = self.backend.save(name, content)
+        if stored != name:
+            # Lost a race with an identical upload; keep the canonical copy
+            self.backend.delete(stored)
+        return name
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def generate_filename(self, filename):
+        return filename
+
+    def open(self, name, mode='rb'):
+        return self.backend.open(name, mode)
+
+    def delete(self, name):
+        self.backend.delete(name)
+
+    def exists(self, name):
+        return self.backend.exists(name)
+
+    def size(self, name):
+        return self.backend.size(name)
+
+    def url(self, name):
+        return self.backend.url(name)
+
+    def path(self, name):
+        return self.backend.path(name)
+
+
+blob_storage = ContentAddressedStorage()
+
+
+def retain_blob(name):
+    """Count one more row referencing the blob stored as ``name``."""
+    from .models import Blob
+    if name:
+        Blob.objects.filter(name=name).update(ref_count=F('ref_count') + 1)
+
+
+def release_blob(name):
+    """Count one less row referencing the blob stored as ``name``."""
+    from .models import Blob
+    if name:
+        Blob.objects.filter(name=name).update(ref_count=F('ref_count') - 1)
+
+
+def blob_stats():
+    """Return blob counts and the bytes stored versus the bytes referenced."""
+    from .models import Blob
+    referenced = Q(ref_count__gt=0)
+    totals = Blob.objects.aggregate(
+        stored_bytes=Sum('size'),
+        live_bytes=Sum('size', filter=referenced),
+        referenced_bytes=Sum(F('size') * F('ref_count'), filter=referenced)
+    )
+    live_bytes = totals['live_bytes'] or 0
+    referenced_bytes = totals['referenced_bytes'] or 0
+    return {
+        'blobs': Blob.objects.count(),
+        'unreferenced_blobs': Blob.objects.exclude(referenced).count(),
+        'stored_bytes': totals['stored_bytes'] or 0,
+        'referenced_bytes': referenced_bytes,
+        'saved_bytes': referenced_bytes - live_bytes,
+    }
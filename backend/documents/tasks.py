@@ -0,0 +1,45 @@
+import logging
+
+from celery import shared_task
+
+from .extraction import extract_text
+from .models import Document, DocumentVersion
+from .search import update_search_vector
+from .versioning import open_version, store_version_as_delta, version_file_type
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def extract_document_text(document_id):
+    """Extract the body text of a document's file and refresh its search vector."""
+    document = Document.objects.filter(pk=document_id).first()
+    if document is None:
+        return
+    pages = extract_text(document, document.file, document.file_type)
+    update_search_vector([document.pk])
+    logger.info("Extracted %d pages from document %s", pages, document.pk)
+
+
+@shared_task
+def extract_version_text(version_id):
+    """Extract the body text of a document version and refresh the document's search vector."""
+    version = DocumentVersion.objects.select_related('document').filter(pk=version_id).first()
+    if version is None:
+        return
+    document = version.document
+    file_type = version_file_type(version, default=document.file_type)
+    pages = extract_text(document, version.file, file_type, version=version, opener=lambda: open_version(version))
+    update_search_vector([document.pk])
+    logger.info("Extracted %d pages from version %s", pages, version.pk)
+
+
+@shared_task
+def compact_version(version_id):
+    """Store a document version as a delta against its keyframe when that saves space."""
+    version = DocumentVersion.objects.select_related('document').filter(pk=version_id).first()
+    if version is None:
+        return
+    delta_size = store_version_as_delta(version)
+    if delta_size is not None:
+        logger.info("Stored version %s as a %d byte delta", version.pk, delta_size)
@@ -0,0 +1,850 @@
+import asyncio
+import json
+import random
+import shutil
+import tempfile
+import threading
+import unittest
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from kombu.exceptions import OperationalError
+from rest_framework.test import APITestCase, APITransactionTestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from users.models import User
+
+from .caching import PUBLIC_DOCUMENT_LISTS_SCOPE, document_lists_scope, get_generation
+from .delta import DeltaError, DeltaReader, apply_delta, encode_delta
+from .downloads import RangeNotSatisfiable, parse_range
+from .events import InMemoryBroker, document_channel, user_channel
+from .models import Blob, Comment, Document, DocumentVersion, ExtractedText, SharedDocument, UploadSession
+from .push import EventStreamApp
+from .search import SEARCH_INDEX_NAME, is_search_supported, update_search_vector
+from .storage import blob_storage
+from .versioning import DeltaIntegrityError, open_version, read_version_content, version_cache
+
+# Responses and permissions are not cached, so every request takes the uncached path
+NO_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+
+class TemporaryMediaMixin:
+    """Store uploaded files in a temporary directory for the duration of the test case."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.media = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+
+@override_settings(CACHES=NO_CACHE)
+class QueryCountTests(TemporaryMediaMixin, APITestCase):
+    """Each endpoint runs the same number of queries however many related rows it returns."""
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner@example.com', 'password', first_name='Doc', last_name='Owner')
+        self.client.force_authenticate(self.owner)
+
+    def create_document(self, related):
+        """Create a document with ``related`` comments, versions and shares, each by a different user."""
+        number = Document.objects.count()
+        document = Document.objects.create(
+            title=f"Document {number}",
+            owner=self.owner,
+            file=SimpleUploadedFile('document.txt', f"Document {number}".encode())
+        )
+        for i in range(related):
+            user = User.objects.create_user(f"user-{number}-{i}@example.com", 'password')
+            Comment.objects.create(document=document, author=user, content=f"Comment {i}")
+            DocumentVersion.objects.create(
+                document=document,
+                version_number=i + 1,
+                file=SimpleUploadedFile('version.txt', f"Version {i}".encode()),
+                created_by=user
+            )
+            SharedDocument.objects.create(document=document, shared_with=user)
+        return document
+
+    def assert_constant_queries(self, queries, path_for):
+        """Request ``path_for(document)`` for documents with 1 and 5 related rows of each kind."""
+        for related in (1, 5):
+            document = self.create_document(related)
+            with self.assertNumQueries(queries):
+                response = self.client.get(path_for(document))
+            self.assertEqual(response.status_code, 200)
+
+    def test_list(self):
+        for related in (1, 5):
+            for _ in range(related):
+                self.create_document(related)
+            with self.assertNumQueries(2):
+                response = self.client.get('/api/documents/')
+            self.assertEqual(response.status_code, 200)
+
+    def test_retrieve(self):
+        self.assert_constant_queries(5, lambda document: f"/api/documents/{document.slug}/")
+
+    def test_comments(self):
+        self.assert_constant_queries(2, lambda document: f"/api/documents/{document.slug}/comments/")
+
+    def test_versions(self):
+        self.assert_constant_queries(2, lambda document: f"/api/documents/{document.slug}/versions/")
+
+
+@override_settings(CACHES=NO_CACHE)
+class KeysetPaginationTests(TemporaryMediaMixin, APITestCase):
+    """Cursor pages follow the keyset order, which search and ``ordering`` would contradict."""
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner@example.com', 'password')
+        self.client.force_authenticate(self.owner)
+        for i in range(3):
+            Document.objects.create(
+                title=f"Report {i}",
+                owner=self.owner,
+                file=SimpleUploadedFile('report.txt', f"Report {i}".encode())
+            )
+
+    def test_cursor_pages(self):
+        response = self.client.get('/api/documents/?cursor=&page_size=2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 2)
+        response = self.client.get(response.data['next'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNone(response.data['next'])
+
+    def test_cursor_rejects_search_and_ordering(self):
+        for query in ('search=report', 'ordering=title'):
+            response = self.client.get(f"/api/documents/?cursor=&{query}")
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('cursor', response.data)
+
+
+@override_settings(CACHES=NO_CACHE)
+class DocumentPermissionTests(TemporaryMediaMixin, APITestCase):
+    """An edit share lets its user change a document, but only the owner deletes or shares it."""
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner@example.com', 'password')
+        self.editor = User.objects.create_user('editor@example.com', 'password')
+        self.document = Document.objects.create(
+            title='Shared',
+            owner=self.owner,
+            file=SimpleUploadedFile('shared.txt', b'Shared')
+        )
+        self.share = SharedDocument.objects.create(document=self.document, shared_with=self.editor, permission='edit')
+        self.client.force_authenticate(self.editor)
+
+    def test_editor_updates(self):
+        response = self.client.patch(f"/api/documents/{self.document.slug}/", {'title': 'Renamed'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_editor_cannot_delete(self):
+        response = self.client.delete(f"/api/documents/{self.document.slug}/")
+        self.assertEqual(response.status_code, 403)
+        self.assertTrue(Document.objects.filter(pk=self.document.pk).exists())
+
+    def test_owner_deletes(self):
+        self.client.force_authenticate(self.owner)
+        response = self.client.delete(f"/api/documents/{self.document.slug}/")
+        self.assertEqual(response.status_code, 204)
+
+    def test_editor_cannot_manage_shares(self):
+        other = User.objects.create_user('other@example.com', 'password')
+        response = self.client.post('/api/shares/', {'document': self.document.pk, 'shared_with': other.pk})
+        self.assertEqual(response.status_code, 403)
+        response = self.client.patch(f"/api/shares/{self.share.pk}/", {'permission': 'view'})
+        self.assertEqual(response.status_code, 403)
+        response = self.client.delete(f"/api/shares/{self.share.pk}/")
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(SharedDocument.objects.filter(document=self.document).count(), 1)
+
+
+@override_settings(CACHES=NO_CACHE)
+@override_settings(CACHES=NO_CACHE)
+class SearchTests(TemporaryMediaMixin, APITestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner@example.com', 'password')
+        self.client.force_authenticate(self.owner)
+        self.document = Document.objects.create(
+            title='Quarterly invoice', description='Finance report', owner=self.owner,
+            file=SimpleUploadedFile('invoice.txt', b'invoice')
+        )
+        self.other = Document.objects.create(
+            title='Meeting notes', owner=self.owner, file=SimpleUploadedFile('notes.txt', b'notes')
+        )
+
+    def search(self, terms):
+        response = self.client.get('/api/documents/', {'search': terms})
+        self.assertEqual(response.status_code, 200)
+        return [document['title'] for document in response.data['results']]
+
+    def test_vector_refreshed_only_when_searched_fields_change(self):
+        with mock.patch('documents.signals.update_search_vector') as refresh:
+            document = Document.objects.get(pk=self.document.pk)
+            document.is_public = True
+            document.save()
+            document.title = 'Quarterly invoice'
+            document.save()
+            document.description = 'Annual report'
+            document.save(update_fields=['is_public'])
+            refresh.assert_not_called()
+
+            document.save()
+            refresh.assert_called_once_with([document.pk], using='default')
+            document.save()
+            refresh.assert_called_once()
+
+            Document.objects.only('id', 'title').get(pk=document.pk).save(update_fields=['title'])
+            refresh.assert_called_once()
+
+    def test_search(self):
+        if not is_search_supported():
+            self.skipTest('Full-text search needs PostgreSQL.')
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT indexdef FROM pg_indexes WHERE indexname = %s', [SEARCH_INDEX_NAME])
+            self.assertIn('gin (search_vector)', cursor.fetchone()[0])
+
+        self.assertEqual(self.search('quarter inv'), ['Quarterly invoice'])
+        # Title (A) outranks description (B)
+        self.other.description = 'Invoices discussed'
+        self.other.save()
+        self.assertEqual(self.search('invoice'), ['Quarterly invoice', 'Meeting notes'])
+
+        # Body text is searchable once extraction refreshes the vector
+        ExtractedText.objects.create(document=self.other, page=1, content='Reconciliation of ledgers')
+        self.assertEqual(self.search('reconcil'), [])
+        update_search_vector([self.other.pk])
+        self.assertEqual(self.search('reconcil'), ['Meeting notes'])
+
+        response = self.client.patch(f"/api/documents/{self.document.slug}/", {'title': 'Budget'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.search('budget'), ['Budget'])
+        self.assertEqual(self.search('quarterly'), [])
+        self.assertEqual(self.search('!&|'), ['Budget', 'Meeting notes'])
+
+
+class UploadSessionTests(TemporaryMediaMixin, APITestCase):
+    """Chunks can arrive in any order and be retried; finalize assembles them once."""
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner@example.com', 'password')
+        self.client.force_authenticate(self.owner)
+
+    def start(self, **data):
+        response = self.client.post('/api/uploads/', {'filename': 'report.txt', **data})
+        self.assertEqual(response.status_code, 201)
+        return f"/api/uploads/{response.data['id']}/"
+
+    def put_chunk(self, session, index, data):
+        return self.client.put(f"{session}chunks/{index}/", data, content_type='application/octet-stream')
+
+    def test_resume_and_finalize(self):
+        session = self.start(title='Report', total_size=12)
+        self.assertEqual(self.put_chunk(session, 2, b'ird!').status_code, 201)
+        self.assertEqual(self.put_chunk(session, 0, b'xxxx').status_code, 201)
+
+        response = self.client.post(f"{session}finalize/")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['detail'], 'Missing chunks: [1].')
+
+        # Resuming: the session reports what arrived; chunk 0 is sent again
+        response = self.client.get(session)
+        self.assertEqual([chunk['index'] for chunk in response.data['chunks']], [0, 2])
+        self.assertEqual(response.data['received_bytes'], 8)
+        self.assertEqual(self.put_chunk(session, 0, b'firs').status_code, 201)
+        self.assertEqual(self.put_chunk(session, 1, b't th').status_code, 201)
+
+        response = self.client.post(f"{session}finalize/")
+        self.assertEqual(response.status_code, 201)
+        document = Document.objects.get(pk=response.data['id'])
+        self.assertEqual(document.title, 'Report')
+        self.assertEqual(document.file_size, 12)
+        self.assertEqual(document.file.read(), b'first third!')
+        self.assertEqual(UploadSession.objects.get().status, 'completed')
+
+        self.assertEqual(self.put_chunk(session, 3, b'late').status_code, 400)
+        self.assertEqual(self.client.post(f"{session}finalize/").status_code, 400)
+        self.assertEqual(Document.objects.count(), 1)
+
+    def test_finalize_version(self):
+        document = Document.objects.create(
+            title='Report', owner=self.owner, file=SimpleUploadedFile('report.txt', b'first')
+        )
+        session = self.start(document=document.pk, comment='Second draft')
+        self.put_chunk(session, 0, b'second')
+        response = self.client.post(f"{session}finalize/")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['version_number'], 1)
+        self.assertEqual(document.versions.get().file.read(), b'second')
+
+    def test_rejects_empty_chunk_and_size_mismatch(self):
+        session = self.start(total_size=10)
+        self.assertEqual(self.put_chunk(session, 0, b'').status_code, 400)
+        self.put_chunk(session, 0, b'short')
+        response = self.client.post(f"{session}finalize/")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Document.objects.count(), 0)
+
+    @override_settings(UPLOAD_CHUNK_MAX_SIZE=4)
+    def test_rejects_oversized_chunk(self):
+        session = self.start()
+        self.assertEqual(self.put_chunk(session, 0, b'too long').status_code, 400)
+        self.assertEqual(self.client.get(session).data['chunks'], [])
+
+    def test_sizes_above_two_gigabytes(self):
+        size = 5 * 1024 ** 3
+        document = Document.objects.create(
+            title='Large', owner=self.owner, file=SimpleUploadedFile('large.txt', b'large'), file_size=size
+        )
+        version = DocumentVersion.objects.create(
+            document=document, version_number=1, file=SimpleUploadedFile('large.txt', b'larger'), file_size=size
+        )
+        document.refresh_from_db()
+        version.refresh_from_db()
+        self.assertEqual(document.file_size, size)
+        self.assertEqual(version.file_size, size)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class DocumentListInvalidationTests(TemporaryMediaMixin, TestCase):
+    """A change invalidates only the document lists that can show the document."""
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner@example.com', 'password')
+        self.reader = User.objects.create_user('reader@example.com', 'password')
+        self.stranger = User.objects.create_user('stranger@example.com', 'password')
+        self.document = Document.objects.create(
+            title='Private', owner=self.owner, file=SimpleUploadedFile('private.txt', b'private')
+        )
+        SharedDocument.objects.create(document=self.document, shared_with=self.reader)
+
+    def generations(self):
+        scopes = [document_lists_scope(user.pk) for user in (self.owner, self.reader, self.stranger)]
+        return [get_generation(scope) for scope in scopes + [PUBLIC_DOCUMENT_LISTS_SCOPE]]
+
+    def changed(self, write, *args, **kwargs):
+        """Return, per owner, reader, stranger and public scope, whether ``write(...)`` bumped it."""
+        before = self.generations()
+        with self.captureOnCommitCallbacks(execute=True):
+            write(*args, **kwargs)
+        return [old != new for old, new in zip(before, self.generations())]
+
+    def test_private_document(self):
+        changed = self.changed(Comment.objects.create, document=self.document, author=self.reader, content='Hi')
+        self.assertEqual(changed, [True, True, False, False])
+
+    def test_unshare(self):
+        shares = SharedDocument.objects.filter(document=self.document)
+        self.assertEqual(self.changed(shares.delete), [True, True, False, False])
+
+    def test_public_document(self):
+        def publish():
+            self.document.is_public = True
+            self.document.save()
+        self.assertEqual(self.changed(publish), [True, True, False, True])
+
+        def unpublish():
+            self.document.is_public = False
+            self.document.save()
+        self.assertEqual(self.changed(unpublish), [True, True, False, True])
+
+
+class ParseRangeTests(SimpleTestCase):
+
+    def test_ranges(self):
+        self.assertEqual(parse_range('bytes=2-4', 10), (2, 4))
+        self.assertEqual(parse_range('bytes=2-', 10), (2, 9))
+        self.assertEqual(parse_range('bytes=5-50', 10), (5, 9))
+        self.assertEqual(parse_range('bytes=-3', 10), (7, 9))
+        self.assertEqual(parse_range('bytes=-30', 10), (0, 9))
+
+    def test_ignored(self):
+        for header in (None, '', 'bytes=-', 'bytes=0-1,3-4', 'items=0-1', 'bytes=5-3'):
+            self.assertIsNone(parse_range(header, 10), header)
+
+    def test_not_satisfiable(self):
+        for header, size in (('bytes=10-', 10), ('bytes=-0', 10), ('bytes=-5', 0), ('bytes=0-', 0)):
+            with self.assertRaises(RangeNotSatisfiable, msg=header):
+                parse_range(header, size)
+
+
+@override_settings(CACHES=NO_CACHE)
+class DownloadTests(TemporaryMediaMixin, APITestCase):
+    """Downloads answer conditional and range requests, or hand the file to the front-end server."""
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner@example.com', 'password')
+        self.client.force_authenticate(self.owner)
+        self.document = self.create_document(b'0123456789')
+        self.path = f"/api/documents/{self.document.slug}/download/"
+        self.etag = f'"{self.document.checksum}"'
+
+    def create_document(self, content):
+        return Document.objects.create(
+            title='Download', owner=self.owner, file=SimpleUploadedFile('download.txt', content)
+        )
+
+    def get(self, path=None, **headers):
+        response = self.client.get(path or self.path, headers=headers)
+        # Consuming the stream closes the file
+        content = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, content
+
+    def test_full(self):
+        response, content = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content, b'0123456789')
+        self.assertEqual(response['ETag'], self.etag)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+    def test_partial(self):
+        response, content = self.get(Range='bytes=2-4')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(content, b'234')
+        self.assertEqual(response['Content-Range'], 'bytes 2-4/10')
+        self.assertEqual(response['Content-Length'], '3')
+
+    def test_not_satisfiable(self):
+        response, content = self.get(Range='bytes=10-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+
+        empty = self.create_document(b'')
+        response, content = self.get(f"/api/documents/{empty.slug}/download/", Range='bytes=-5')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */0')
+
+    def test_invalid_range_serves_whole_file(self):
+        response, content = self.get(Range='bytes=5-3')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content, b'0123456789')
+
+    def test_if_none_match(self):
+        response, content = self.get(If_None_Match=self.etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(content, b'')
+        response, content = self.get(If_None_Match='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_if_range(self):
+        response, content = self.get(Range='bytes=0-1', If_Range=self.etag)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(content, b'01')
+        response, content = self.get(Range='bytes=0-1', If_Range='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content, b'0123456789')
+
+    @override_settings(DOCUMENT_DOWNLOAD_SENDFILE='x-accel-redirect', DOCUMENT_DOWNLOAD_ACCEL_PREFIX='/protected/')
+    def test_accel_redirect(self):
+        response, content = self.get(Range='bytes=2-4')
+        # The front-end server answers the range from the file itself
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content, b'')
+        self.assertEqual(response['X-Accel-Redirect'], f"/protected/{self.document.file.name}")
+        self.assertEqual(response['ETag'], self.etag)
+        self.assertEqual(response['Content-Type'], 'text/plain')
+
+
+def edited(content, seed):
+    """Return ``content`` with a few bytes replaced, inserted and removed."""
+    rng = random.Random(seed)
+    content = bytearray(content)
+    for _ in range(3):
+        position = rng.randrange(len(content))
+        content[position:position + rng.randrange(100)] = rng.randbytes(rng.randrange(200))
+    return bytes(content)
+
+
+class DeltaTests(SimpleTestCase):
+
+    def setUp(self):
+        self.base = random.Random(0).randbytes(200_000)
+
+    def round_trip(self, target, base=None, **kwargs):
+        base = self.base if base is None else base
+        delta = encode_delta(base, target, **kwargs)
+        self.assertIsNotNone(delta)
+        self.assertEqual(apply_delta(base, delta), target)
+        # Read back in small pieces, as a download streams it
+        with DeltaReader(BytesIO(base), BytesIO(delta)) as reader:
+            pieces = iter(lambda: reader.read(1000), b'')
+            self.assertEqual(b''.join(pieces), target)
+        return delta
+
+    def test_round_trips(self):
+        base = self.base
+        targets = [
+            base,
+            base[:5000] + b'inserted' + base[5000:],
+            base[:5000] + base[9000:],
+            b'prefix' + base[3:],
+            base + b'appended',
+            base[100_000:] + base[:100_000],
+            edited(base, 1),
+            base[:10],
+        ]
+        for target in targets:
+            self.round_trip(target, max_ratio=1.0)
+        self.round_trip(b'', max_ratio=1.0)
+        self.round_trip(b'from nothing', base=b'', max_ratio=1.0)
+
+    def test_similar_versions_are_small(self):
+        delta = self.round_trip(edited(self.base, 2))
+        self.assertLess(len(delta), len(self.base) // 50)
+
+    def test_unrelated_versions_are_not_encoded(self):
+        self.assertIsNone(encode_delta(self.base, random.Random(1).randbytes(200_000)))
+
+    def test_corrupt_deltas(self):
+        delta = encode_delta(self.base, edited(self.base, 3))
+        for corrupt, base in (
+            (b'nope' + delta[4:], self.base),
+            (delta[:len(delta) // 2], self.base),
+            (delta, self.base[:1000]),
+        ):
+            with self.assertRaises(DeltaError):
+                apply_delta(base, corrupt)
+
+
+@override_settings(CACHES=NO_CACHE)
+class VersionDeltaStorageTests(TemporaryMediaMixin, APITestCase):
+    """compact_versions stores versions as deltas against keyframes, and they read back unchanged."""
+
+    def setUp(self):
+        version_cache.clear()
+        self.addCleanup(version_cache.clear)
+        self.owner = User.objects.create_user('owner@example.com', 'password')
+        self.client.force_authenticate(self.owner)
+        content = random.Random(0).randbytes(100_000)
+        self.document = Document.objects.create(
+            title='Versions', owner=self.owner, file=SimpleUploadedFile('versions.bin', content)
+        )
+        self.contents = {}
+        for number in range(1, 6):
+            content = edited(content, number)
+            self.contents[number] = content
+            DocumentVersion.objects.create(
+                document=self.document,
+                version_number=number,
+                file=SimpleUploadedFile('versions.bin', content),
+                created_by=self.owner
+            )
+
+    def compact(self):
+        output = StringIO()
+        call_command('compact_versions', '--interval', '3', stdout=output)
+        return {version.version_number: version for version in self.document.versions.select_related('delta_base')}
+
+    def test_compact_and_read_back(self):
+        versions = self.compact()
+        # Versions 1 and 4 stay keyframes; each delta is against the keyframe, never another delta
+        self.assertEqual({number: version.storage_mode for number, version in versions.items()}, {
+            1: 'full', 2: 'delta', 3: 'delta', 4: 'full', 5: 'delta'
+        })
+        self.assertEqual(versions[3].delta_base, versions[1])
+        self.assertEqual(versions[5].delta_base, versions[4])
+        for number, version in versions.items():
+            self.assertEqual(read_version_content(version, use_cache=False), self.contents[number])
+
+        # Compacting again changes nothing
+        self.assertEqual(
+            {number: version.file.name for number, version in self.compact().items()},
+            {number: version.file.name for number, version in versions.items()}
+        )
+
+    def test_streams_and_caches_deltas(self):
+        version = self.compact()[2]
+        with open_version(version) as fileobj:
+            self.assertFalse(fileobj.seekable())
+            self.assertEqual(fileobj.read(), self.contents[2])
+        # Read in full once, the version is served from the cache
+        with open_version(version) as fileobj:
+            self.assertTrue(fileobj.seekable())
+            self.assertEqual(fileobj.read(), self.contents[2])
+
+    def test_checksum_mismatch(self):
+        version = self.compact()[2]
+        version.checksum = '0' * 64
+        with self.assertRaises(DeltaIntegrityError):
+            read_version_content(version, use_cache=False)
+
+    def test_download_delta_version(self):
+        version = self.compact()[3]
+        path = f"/api/versions/{version.pk}/download/"
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.contents[3])
+        response = self.client.get(path, headers={'Range': 'bytes=50000-50099'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.contents[3][50000:50100])
+
+
+class EventPublishingTests(TemporaryMediaMixin, TransactionTestCase):
+    """Events are published once their change commits, and never for rolled back writes."""
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner@example.com', 'password')
+        self.editor = User.objects.create_user('editor@example.com', 'password')
+        self.document = Document.objects.create(
+            title='Events', owner=self.owner, file=SimpleUploadedFile('events.txt', b'events')
+        )
+        self.share = SharedDocument.objects.create(document=self.document, shared_with=self.editor, permission='edit')
+        self.broker = mock.Mock(spec=InMemoryBroker)
+        patcher = mock.patch('documents.events.get_broker', return_value=self.broker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def published(self):
+        return [(channel, json.loads(message)) for channel, _, message in (
+            call.args for call in self.broker.publish.call_args_list
+        )]
+
+    def test_published_after_commit(self):
+        with transaction.atomic():
+            comment = Comment.objects.create(document=self.document, author=self.editor, content='Hello')
+            self.assertEqual(self.published(), [])
+        event = {
+            'type': 'comment.created', 'document': self.document.pk, 'comment': comment.pk, 'author': self.editor.pk
+        }
+        self.assertEqual(self.published(), [
+            (document_channel(self.document.pk), event),
+            (user_channel(self.owner.pk), event),
+        ])
+
+    def test_rolled_back_writes_publish_nothing(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            Comment.objects.create(document=self.document, author=self.editor, content='Hello')
+            DocumentVersion.objects.create(
+                document=self.document, version_number=1,
+                file=SimpleUploadedFile('events.txt', b'v1'), created_by=self.editor
+            )
+            self.share.delete()
+            self.document.title = 'Renamed'
+            self.document.save()
+            raise RuntimeError
+        self.assertEqual(self.published(), [])
+
+        # A rolled back savepoint drops its events while the outer transaction's go out
+        with transaction.atomic():
+            self.document.save()
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                Comment.objects.create(document=self.document, author=self.editor, content='Hello')
+                raise RuntimeError
+        self.assertEqual([event['type'] for _, event in self.published()], ['document.updated'])
+
+    def test_broker_failure_is_logged(self):
+        self.broker.publish.side_effect = ConnectionError('Broker down')
+        with self.assertLogs('documents.events', 'WARNING'):
+            Comment.objects.create(document=self.document, author=self.editor, content='Hello')
+        self.assertEqual(self.document.comments.count(), 1)
+
+
+class EventStreamTests(TemporaryMediaMixin, TransactionTestCase):
+    """Subscribers of the push app receive committed events only."""
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner@example.com', 'password')
+        self.editor = User.objects.create_user('editor@example.com', 'password')
+        self.document = Document.objects.create(
+            title='Events', owner=self.owner, file=SimpleUploadedFile('events.txt', b'events')
+        )
+        self.share = SharedDocument.objects.create(document=self.document, shared_with=self.editor, permission='edit')
+        self.broker = InMemoryBroker()
+        patcher = mock.patch('documents.events.get_broker', return_value=self.broker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.app = EventStreamApp(broker=self.broker, heartbeat=30)
+
+    async def connect(self, user, query=''):
+        """Open a WebSocket stream for ``user``; return its inbox, outbox and task."""
+        inbox, outbox = asyncio.Queue(), asyncio.Queue()
+        scope = {'type': 'websocket', 'query_string': f"token={AccessToken.for_user(user)}&{query}".encode()}
+        await inbox.put({'type': 'websocket.connect'})
+        task = asyncio.ensure_future(self.app(scope, inbox.get, outbox.put))
+        self.assertEqual((await asyncio.wait_for(outbox.get(), 5))['type'], 'websocket.accept')
+        return inbox, outbox, task
+
+    async def receive(self, outbox):
+        return json.loads((await asyncio.wait_for(outbox.get(), 5))['text'])
+
+    async def disconnect(self, inbox, task):
+        await inbox.put({'type': 'websocket.disconnect'})
+        await asyncio.wait_for(task, 5)
+        self.assertEqual(self.broker.subscriber_count(), 0)
+
+    def comment(self, content, rollback=False):
+        try:
+            with transaction.atomic():
+                comment = Comment.objects.create(document=self.document, author=self.editor, content=content)
+                if rollback:
+                    raise RuntimeError
+        except RuntimeError:
+            return None
+        return comment.pk
+
+    async def test_committed_events_only(self):
+        inbox, outbox, task = await self.connect(self.owner)
+        await sync_to_async(self.comment)('Rolled back', rollback=True)
+        comment_id = await sync_to_async(self.comment)('Committed')
+        event = await self.receive(outbox)
+        self.assertEqual((event['type'], event['comment']), ('comment.created', comment_id))
+        self.assertTrue(outbox.empty())
+        await self.disconnect(inbox, task)
+
+    async def test_access_revoked(self):
+        inbox, outbox, task = await self.connect(self.editor, f"documents={self.document.slug}")
+        await sync_to_async(self.share.delete)()
+        # The document channel's event is replaced, as the editor can no longer read it
+        self.assertEqual(await self.receive(outbox), {'type': 'access.revoked', 'document': self.document.pk})
+        self.assertEqual((await self.receive(outbox))['type'], 'share.deleted')
+        await sync_to_async(self.comment)('Unseen')
+        await self.disconnect(inbox, task)
+        self.assertTrue(outbox.empty())
+
+    async def test_refused(self):
+        scope = {'type': 'websocket', 'query_string': b'token=invalid'}
+        inbox, outbox = asyncio.Queue(), asyncio.Queue()
+        await inbox.put({'type': 'websocket.connect'})
+        await asyncio.wait_for(self.app(scope, inbox.get, outbox.put), 5)
+        self.assertEqual((await outbox.get())['code'], 4401)
+
+
+class BlobGarbageCollectionTests(TemporaryMediaMixin, TestCase):
+    """gc_blobs deletes blobs that stayed unreferenced for the grace period, and only those."""
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner@example.com', 'password')
+
+    def create_unreferenced_blob(self, content):
+        """Store ``content`` for a document, delete it and age the blob past the grace period."""
+        document = Document.objects.create(
+            title='Old', owner=self.owner, file=SimpleUploadedFile('old.txt', content)
+        )
+        name = document.file.name
+        document.delete()
+        long_ago = timezone.now() - timedelta(days=1)
+        Blob.objects.filter(name=name).update(created_at=long_ago, last_used_at=long_ago)
+        self.assertEqual(Blob.objects.get(name=name).ref_count, 0)
+        return name
+
+    def test_deletes_old_unreferenced_blob(self):
+        name = self.create_unreferenced_blob(b'garbage')
+        call_command('gc_blobs', stdout=StringIO())
+        self.assertFalse(Blob.objects.filter(name=name).exists())
+        self.assertFalse(blob_storage.exists(name))
+
+    def test_keeps_reuploaded_blob_before_it_is_referenced(self):
+        name = self.create_unreferenced_blob(b'uploaded again')
+        # Stored again, but the row referencing it is not saved yet
+        self.assertEqual(blob_storage.save('new.txt', ContentFile(b'uploaded again')), name)
+        call_command('gc_blobs', stdout=StringIO())
+        self.assertTrue(Blob.objects.filter(name=name).exists())
+        self.assertTrue(blob_storage.exists(name))
+
+        document = Document.objects.create(
+            title='New', owner=self.owner, file=SimpleUploadedFile('new.txt', b'uploaded again')
+        )
+        self.assertEqual(document.file.name, name)
+        self.assertEqual(Blob.objects.get(name=name).ref_count, 1)
+        self.assertEqual(document.file.read(), b'uploaded again')
+
+
+@override_settings(CACHES=NO_CACHE)
+class TextExtractionTests(TemporaryMediaMixin, APITransactionTestCase):
+    """Text is extracted once uploads commit, and a broker outage does not fail the upload."""
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner@example.com', 'password')
+        self.client.force_authenticate(self.owner)
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+    def test_extracts_documents_and_versions_eagerly(self):
+        response = self.client.post(
+            '/api/documents/', {'title': 'Notes', 'file': SimpleUploadedFile('notes.txt', b'first draft')}
+        )
+        self.assertEqual(response.status_code, 201)
+        document = Document.objects.get()
+        self.assertEqual(
+            list(ExtractedText.objects.filter(document=document, version=None).values_list('content', flat=True)),
+            ['first draft']
+        )
+
+        response = self.client.post(
+            f"/api/documents/{document.slug}/add_version/",
+            {'document': document.pk, 'version_number': 1, 'file': SimpleUploadedFile('notes.txt', b'second draft')}
+        )
+        self.assertEqual(response.status_code, 201)
+        version = document.versions.get()
+        self.assertEqual(
+            list(ExtractedText.objects.filter(version=version).values_list('content', flat=True)),
+            ['second draft']
+        )
+
+    @mock.patch('documents.signals.extract_document_text.delay', side_effect=OperationalError('Broker down'))
+    def test_upload_survives_broker_outage(self, delay):
+        with self.assertLogs('django.db.backends.base', 'ERROR'):
+            response = self.client.post(
+                '/api/documents/', {'title': 'Notes', 'file': SimpleUploadedFile('notes.txt', b'notes')}
+            )
+        self.assertEqual(response.status_code, 201)
+        delay.assert_called_once_with(response.data['id'])
+        self.assertTrue(Document.objects.filter(pk=response.data['id']).exists())
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'SQLite serializes writers')
+class ConcurrentSlugTests(TemporaryMediaMixin, TransactionTestCase):
+    """Parallel creators of documents with one title all succeed, each with its own slug."""
+
+    threads = 50
+    per_thread = 5
+
+    # Committed documents queue text extraction, which needs no broker here
+    @mock.patch('documents.signals.extract_document_text')
+    def test_parallel_creators_get_unique_slugs(self, extract_document_text):
+        owner = User.objects.create_user('owner@example.com', 'password')
+        barrier = threading.Barrier(self.threads)
+        errors = []
+
+        def create(thread):
+            try:
+                barrier.wait()
+                for i in range(self.per_thread):
+                    Document.objects.create(
+                        title='Same title',
+                        owner=owner,
+                        file=SimpleUploadedFile('same.txt', f"Document {thread}-{i}".encode())
+                    )
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=create, args=(n,)) for n in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        slugs = list(Document.objects.filter(owner=owner).values_list('slug', flat=True))
+        self.assertEqual(len(slugs), self.threads * self.per_thread)
+        self.assertEqual(len(set(slugs)), len(slugs))
@@ -0,0 +1,164 @@
+import hashlib
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from .access import has_document_permission
+from .models import Document, DocumentVersion, UploadChunk, UploadSession
+
+
+class UploadError(Exception):
+    """Raised when a chunk or an upload session cannot be accepted."""
+
+
+class UploadPermissionError(UploadError):
+    """Raised when the session's owner may no longer add versions to its document."""
+
+
+class HashingReader:
+    """
+    File-like wrapper that counts and hashes bytes as they are read.
+
+    Storage backends pull from it in small pieces, so the data is never
+    held in memory as a whole.
+    """
+
+    def __init__(self, stream, limit=None):
+        self.stream = stream
+        self.limit = limit
+        self.size = 0
+        self._sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.size += len(data)
+        if self.limit is not None and self.size > self.limit:
+            raise UploadError(f"Chunk exceeds the maximum size of {self.limit} bytes.")
+        self._sha256.update(data)
+        return data
+
+    @property
+    def checksum(self):
+        return self._sha256.hexdigest()
+
+
+class ChunkStream:
+    """Read stored chunk files back from storage, in order, as one stream."""
+
+    def __init__(self, paths, storage=default_storage):
+        self.paths = iter(paths)
+        self.storage = storage
+        self.current = None
+
+    def read(self, size=-1):
+        while True:
+            if self.current is None:
+                path = next(self.paths, None)
+                if path is None:
+                    return b''
+                self.current = self.storage.open(path, 'rb')
+            data = self.current.read(size)
+            if data:
+                return data
+            self.current.close()
+            self.current = None
+
+
+def chunk_path(session, index):
+    return f"uploads/{session.pk}/{index:06d}"
+
+
+def store_chunk(session, index, stream):
+    """Write one chunk straight from the request stream to storage."""
+    if stream is None:
+        raise UploadError('Chunk body is empty.')
+
+    discard_chunks(session, session.chunks.filter(index=index))
+    path = chunk_path(session, index)
+    reader = HashingReader(stream, limit=settings.UPLOAD_CHUNK_MAX_SIZE)
+    try:
+        path = default_storage.save(path, File(reader, name=path))
+    except UploadError:
+        if default_storage.exists(path):
+            default_storage.delete(path)
+        raise
+    if not reader.size:
+        default_storage.delete(path)
+        raise UploadError('Chunk body is empty.')
+
+    return UploadChunk.objects.create(
+        session=session,
+        index=index,
+        size=reader.size,
+        checksum=reader.checksum,
+        path=path
+    )
+
+
+def discard_chunks(session, chunks=None):
+    """Delete stored chunk files and their rows."""
+    chunks = session.chunks.all() if chunks is None else chunks
+    for chunk in chunks:
+        if default_storage.exists(chunk.path):
+            default_storage.delete(chunk.path)
+    chunks.delete()
+
+
+def finalize_session(session):
+    """
+    Assemble a session's chunks into a new Document or DocumentVersion.
+
+    Chunks are streamed from storage into the final file while its size and
+    SHA-256 checksum are computed, so the row never needs to stat the file.
+    The session stays locked throughout, so concurrent calls finalize it
+    once, and the owner's edit permission is checked again for versions.
+    """
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(pk=session.pk)
+        if session.status != 'active':
+            raise UploadError('Upload session is already completed.')
+        if session.document_id is not None and not has_document_permission(session.owner, session.document, 'edit'):
+            raise UploadPermissionError('You do not have permission to add versions.')
+
+        chunks = list(session.chunks.order_by('index'))
+        if not chunks:
+            raise UploadError('No chunks have been uploaded.')
+        missing = sorted(set(range(chunks[-1].index + 1)) - {chunk.index for chunk in chunks})
+        if missing:
+            raise UploadError(f"Missing chunks: {missing}.")
+
+        reader = HashingReader(ChunkStream([chunk.path for chunk in chunks]))
+        if session.document_id is None:
+            target = Document(
+                owner=session.owner,
+                title=session.title or session.filename,
+                description=session.description,
+                is_public=session.is_public
+            )
+        else:
+            target = DocumentVersion(
+                document=session.document,
+                created_by=session.owner,
+                comment=session.comment
+            )
+        target.file.save(session.filename, File(reader, name=session.filename), save=False)
+        if session.total_size is not None and reader.size != session.total_size:
+            # The unreferenced blob is left for gc_blobs: other rows may share it
+            raise UploadError(
+                f"Uploaded {reader.size} bytes but the session declared {session.total_size}."
+            )
+        target.file_size = reader.size
+        target.checksum = reader.checksum
+        if isinstance(target, DocumentVersion):
+            # Lock the document only now, so concurrent uploads queue for the insert, not the copy
+            locked = Document.objects.select_for_update().get(pk=session.document_id)
+            target.version_number = locked.get_next_version_number()
+        target.save()
+
+        session.status = 'completed'
+        session.save(update_fields=['status', 'updated_at'])
+
+    discard_chunks(session)
+    return target
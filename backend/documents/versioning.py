@@ -0,0 +1,222 @@
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+
+from .delta import DeltaReader, encode_delta
+from .extraction import file_type_for
+from .models import DocumentVersion
+
+
+class DeltaIntegrityError(Exception):
+    """Raised when a reconstructed version does not match its checksum."""
+
+
+class MaterializedVersionCache:
+    """Process-local LRU of reconstructed version bytes, bounded by total size."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+            return data
+
+    def fits(self, size):
+        # A single entry may not take more than a quarter of the cache
+        return size <= self.max_bytes // 4
+
+    def set(self, key, data):
+        if not self.fits(len(data)):
+            return
+        with self._lock:
+            if key in self._items:
+                self.size -= len(self._items.pop(key))
+            self._items[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+
+version_cache = MaterializedVersionCache(settings.DOCUMENT_VERSION_CACHE_BYTES)
+
+
+def _read_stored(fieldfile):
+    with fieldfile.open('rb') as fileobj:
+        return fileobj.read()
+
+
+def _open_stored(fieldfile):
+    """Open a stored file on its own file object, leaving the field's file untouched."""
+    return fieldfile.storage.open(fieldfile.name, 'rb')
+
+
+def _extension(fieldfile):
+    return os.path.splitext(fieldfile.name or '')[1].lower()
+
+
+class VersionReader(io.RawIOBase):
+    """
+    Stream a delta version's content, rebuilt from its base as it is read.
+
+    The content is checked against the version's checksum once fully read,
+    raising DeltaIntegrityError on a mismatch. Versions small enough for
+    the materialized version cache are kept there once read in full.
+    """
+
+    def __init__(self, version, cache_key=None):
+        super().__init__()
+        self.version = version
+        self.reader = DeltaReader(_open_stored(version.delta_base.file), _open_stored(version.file))
+        self.sha256 = hashlib.sha256()
+        self.cache_key = cache_key
+        self.content = bytearray() if cache_key and version_cache.fits(version.file_size) else None
+        self.finished = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        length = self.reader.readinto(buffer)
+        if length:
+            data = memoryview(buffer)[:length]
+            self.sha256.update(data)
+            if self.content is not None:
+                self.content += data
+        elif not self.finished:
+            self.finished = True
+            self._verify()
+        return length
+
+    def _verify(self):
+        if self.version.checksum and self.sha256.hexdigest() != self.version.checksum:
+            raise DeltaIntegrityError(f"Version {self.version.pk} does not match its checksum.")
+        if self.content is not None:
+            version_cache.set(self.cache_key, bytes(self.content))
+
+    def close(self):
+        if not self.closed:
+            self.reader.close()
+        super().close()
+
+
+def open_version(version, use_cache=True):
+    """
+    Open a version's content for reading, whatever its storage mode.
+
+    Delta versions are rebuilt while they are read, in constant memory,
+    unless the materialized version cache already holds them; the returned
+    stream is then not seekable.
+    """
+    if version.storage_mode != 'delta':
+        return version.file.open('rb')
+
+    key = (version.pk, version.file.name) if use_cache else None
+    content = version_cache.get(key) if key else None
+    if content is not None:
+        return io.BytesIO(content)
+    return VersionReader(version, cache_key=key)
+
+
+def read_version_content(version, use_cache=True):
+    """Return the full bytes of a version, rebuilding delta versions from their base."""
+    with open_version(version, use_cache=use_cache) as fileobj:
+        return fileobj.read()
+
+
+def named_file(version):
+    """Return the stored file whose name carries the version's original extension."""
+    return version.delta_base.file if version.storage_mode == 'delta' else version.file
+
+
+def version_file_type(version, default=''):
+    """Derive a version's file type; delta versions share their base's extension."""
+    return file_type_for(named_file(version), default=default)
+
+
+def find_delta_base(version, interval=None):
+    """
+    Return the full version ``version`` should be stored as a delta against.
+
+    Returns None when it should stay a full keyframe: it is the first
+    version, or the nearest earlier full version is ``interval`` or more
+    versions back.
+    """
+    interval = interval or settings.DOCUMENT_VERSION_KEYFRAME_INTERVAL
+    base = version.document.versions.filter(
+        storage_mode='full',
+        version_number__lt=version.version_number
+    ).order_by('-version_number').first()
+    if base is None or version.version_number - base.version_number >= interval:
+        return None
+    return base
+
+
+def build_delta(version, interval=None):
+    """
+    Return ``(base, content, delta)`` for storing a full version as a delta.
+
+    Returns None when the version should stay a full copy: it is a keyframe,
+    other versions are stored as deltas against it, its base has a different
+    extension, or a delta would not save enough space.
+    """
+    if version.storage_mode == 'delta' or version.delta_versions.exists():
+        return None
+    base = find_delta_base(version, interval)
+    if base is None or _extension(base.file) != _extension(version.file):
+        return None
+
+    content = _read_stored(version.file)
+    delta = encode_delta(_read_stored(base.file), content)
+    if delta is None or len(delta) >= len(content):
+        return None
+    return base, content, delta
+
+
+def store_version_as_delta(version, interval=None):
+    """
+    Replace a full version's stored file with a delta against its keyframe.
+
+    The previous blob is released by the document signals and removed by
+    ``gc_blobs``. Returns the delta size in bytes, or None when the version
+    is kept as a full copy.
+    """
+    built = build_delta(version, interval)
+    if built is None:
+        return None
+    base, content, delta = built
+
+    with transaction.atomic():
+        # Lock both rows, so neither can be converted meanwhile by another task, and
+        # check again that no version has been stored as a delta against this one
+        locked = {
+            row.pk: row.storage_mode
+            for row in DocumentVersion.objects.select_for_update().filter(pk__in=[version.pk, base.pk]).order_by('pk')
+        }
+        if locked.get(version.pk) != 'full' or locked.get(base.pk) != 'full' or version.delta_versions.exists():
+            return None
+
+        if not version.checksum:
+            version.checksum = hashlib.sha256(content).hexdigest()
+        version.file.save(f"v{version.version_number}.delta", ContentFile(delta), save=False)
+        version.storage_mode = 'delta'
+        version.delta_base = base
+        version.save(update_fields=['file', 'checksum', 'storage_mode', 'delta_base'])
+    return len(delta)
@@ -1,16 +1,34 @@
-from rest_framework import viewsets, permissions, status, filters
+import functools
+import os
+
+from rest_framework import viewsets, mixins, permissions, status, filters
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, PermissionDenied
 from rest_framework.response import Response
+from django.db import transaction
 from django.db.models import Q
 from django.shortcuts import get_object_or_404
 
-from .models import Document, Comment, SharedDocument, DocumentVersion
+from .access import document_scope, has_document_permission
+from .bulk import bulk_comment, bulk_share, bulk_unshare
+from .caching import PUBLIC_DOCUMENT_LISTS_SCOPE, cached_response, document_lists_scope, user_scope
+from .downloads import fieldfile_response, file_response, make_etag
+from .imports import ArchiveError, archive_files, import_documents, uploaded_files
+from .models import Document, Comment, SharedDocument, DocumentVersion, UploadSession
+from .pagination import (
+    DocumentKeysetPagination, CommentKeysetPagination, CommentFeedPagination, DocumentVersionKeysetPagination
+)
+from .search import DocumentSearchFilter
 from .serializers import (
-    DocumentSerializer, DocumentDetailSerializer, DocumentCreateSerializer,
-    CommentSerializer, CommentCreateSerializer,
+    DocumentSerializer, DocumentDetailSerializer, DocumentCreateSerializer, DocumentImportSerializer,
+    CommentSerializer, CommentCreateSerializer, CommentBulkCreateSerializer,
     SharedDocumentSerializer, SharedDocumentCreateSerializer,
-    DocumentVersionSerializer, DocumentVersionCreateSerializer
+    SharedDocumentBulkSerializer, SharedDocumentBulkDeleteSerializer,
+    DocumentVersionSerializer, DocumentVersionCreateSerializer,
+    UploadSessionSerializer, UploadSessionCreateSerializer, UploadChunkSerializer
 )
+from .uploads import UploadError, UploadPermissionError, discard_chunks, finalize_session, store_chunk
+from .versioning import named_file, open_version
 
 
 class IsOwnerOrReadOnly(permissions.BasePermission):
@@ -30,33 +48,57 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
 class HasDocumentPermission(permissions.BasePermission):
     """
     Custom permission to check if user has permission to access a document.
+    
+    Reading needs any access to the document (ownership, a share or a
+    public document); changing it needs ownership or an edit share, and
+    deleting it needs ownership.
     """
     
     def has_object_permission(self, request, view, obj):
-        # Allow if user is the owner
-        if obj.owner == request.user:
-            return True
-            
-        # Allow if document is public and the request is a safe method
-        if obj.is_public and request.method in permissions.SAFE_METHODS:
+        # Versions are checked against their document
+        obj = getattr(obj, 'document', obj)
+        if request.method in permissions.SAFE_METHODS:
+            required = 'view'
+        elif request.method == 'DELETE':
+            required = 'owner'
+        else:
+            required = 'edit'
+        return has_document_permission(request.user, obj, required, request)
+
+
+class IsDocumentOwnerOrReadOnly(permissions.BasePermission):
+    """
+    Custom permission to only allow the owner of a share's document to change it.
+    """
+    
+    def has_object_permission(self, request, view, obj):
+        if request.method in permissions.SAFE_METHODS:
             return True
-            
-        # Allow if document is shared with the user
-        return SharedDocument.objects.filter(
-            document=obj,
-            shared_with=request.user
-        ).exists()
+        return obj.document.owner_id == request.user.pk
 
 
-class DocumentViewSet(viewsets.ModelViewSet):
+class EagerLoadingViewMixin:
+    """
+    Load the relations declared by the action's serializer along with the queryset.
+    """
+    
+    def eager_load(self, queryset, serializer_class=None):
+        serializer_class = serializer_class or self.get_serializer_class()
+        if hasattr(serializer_class, 'setup_eager_loading'):
+            return serializer_class.setup_eager_loading(queryset)
+        return queryset
+
+
+class DocumentViewSet(EagerLoadingViewMixin, viewsets.ModelViewSet):
     """
     ViewSet for viewing and editing Document instances.
     """
     
     queryset = Document.objects.all()
     permission_classes = [permissions.IsAuthenticated, HasDocumentPermission]
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
-    search_fields = ['title', 'description']
+    pagination_class = DocumentKeysetPagination
+    filter_backends = [DocumentSearchFilter, filters.OrderingFilter]
+    search_fields = ['title', 'description', 'extracted_texts__content']
     ordering_fields = ['title', 'created_at', 'updated_at', 'file_size']
     lookup_field = 'slug'
     
@@ -66,12 +108,11 @@ class DocumentViewSet(viewsets.ModelViewSet):
         for the currently authenticated user plus public documents
         and documents shared with the user.
         """
-        user = self.request.user
-        return Document.objects.filter(
-            Q(owner=user) | 
-            Q(is_public=True) | 
-            Q(shares__shared_with=user)
-        ).distinct()
+        queryset = Document.objects.accessible_to(self.request.user)
+        if self.action == 'retrieve':
+            # Comments, shares and versions are only loaded when the response is not cached
+            return queryset
+        return self.eager_load(queryset)
     
     def get_serializer_class(self):
         if self.action == 'create':
@@ -80,24 +121,101 @@ class DocumentViewSet(viewsets.ModelViewSet):
             return DocumentDetailSerializer
         return DocumentSerializer
     
+    def list(self, request, *args, **kwargs):
+        # Cached per user and URL until a document the user can see, or any public one, changes
+        return cached_response(
+            request,
+            [PUBLIC_DOCUMENT_LISTS_SCOPE, document_lists_scope(request.user.pk), user_scope(request.user.pk)],
+            functools.partial(super().list, request, *args, **kwargs)
+        )
+    
+    def retrieve(self, request, *args, **kwargs):
+        document = self.get_object()
+        
+        def build():
+            detail = self.eager_load(Document.objects.filter(pk=document.pk)).get()
+            return Response(self.get_serializer(detail).data)
+        
+        # The owner's name and picture are part of the detail
+        return cached_response(request, [document_scope(document.pk), user_scope(document.owner_id)], build)
+    
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
     
+    @action(detail=False, methods=['post'], url_path='import')
+    def import_documents(self, request):
+        """
+        Create a document for each uploaded file or each file in an uploaded zip or tar archive.
+        
+        Returns the created documents and the import's throughput.
+        """
+        serializer = DocumentImportSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        if serializer.validated_data.get('archive'):
+            files = archive_files(serializer.validated_data['archive'])
+        else:
+            files = uploaded_files(serializer.validated_data['files'])
+        created = []
+        try:
+            report = import_documents(
+                request.user, files,
+                is_public=serializer.validated_data['is_public'],
+                on_batch=lambda documents, report: created.extend(documents)
+            )
+        except ArchiveError as exc:
+            return Response(
+                {"detail": str(exc), "imported": len(created)}, status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        data = report.as_dict()
+        data['documents'] = [
+            {'id': document.pk, 'slug': document.slug, 'title': document.title} for document in created
+        ]
+        return Response(data, status=status.HTTP_201_CREATED)
+    
+    @action(detail=True, methods=['get'])
+    def download(self, request, slug=None):
+        """Download the document's file, honoring Range and If-None-Match."""
+        document = self.get_object()
+        if not document.file:
+            raise NotFound("This document has no file.")
+        filename = f"{document.slug}{os.path.splitext(document.file.name)[1]}"
+        return fieldfile_response(request, document.file, filename, document.file_size, document.checksum)
+    
     @action(detail=True, methods=['get'])
     def comments(self, request, slug=None):
-        """Get comments for a specific document."""
+        """
+        Get comments for a specific document.
+        
+        With ``?since=<cursor>``, only comments created or edited after the
+        cursor are returned, a page at a time, with the cursor to poll next.
+        """
         document = self.get_object()
-        comments = Comment.objects.filter(document=document)
-        serializer = CommentSerializer(comments, many=True)
-        return Response(serializer.data)
+        
+        def build():
+            comments = self.eager_load(Comment.objects.filter(document=document), CommentSerializer)
+            if CommentFeedPagination.cursor_query_param in request.query_params:
+                paginator = CommentFeedPagination()
+                page = paginator.paginate_queryset(comments, request, view=self)
+                return paginator.get_paginated_response(CommentSerializer(page, many=True).data)
+            return Response(CommentSerializer(comments, many=True).data)
+        
+        return cached_response(request, [document_scope(document.pk)], build)
     
     @action(detail=True, methods=['get'])
     def versions(self, request, slug=None):
         """Get versions for a specific document."""
         document = self.get_object()
-        versions = DocumentVersion.objects.filter(document=document)
-        serializer = DocumentVersionSerializer(versions, many=True)
-        return Response(serializer.data)
+        
+        def build():
+            versions = self.eager_load(
+                DocumentVersion.objects.filter(document=document), DocumentVersionSerializer
+            )
+            return Response(DocumentVersionSerializer(versions, many=True).data)
+        
+        return cached_response(request, [document_scope(document.pk)], build)
     
     @action(detail=True, methods=['get'])
     def shares(self, request, slug=None):
@@ -109,14 +227,16 @@ class DocumentViewSet(viewsets.ModelViewSet):
                 {"detail": "You do not have permission to view all shares."},
                 status=status.HTTP_403_FORBIDDEN
             )
-        shares = SharedDocument.objects.filter(document=document)
+        shares = self.eager_load(
+            SharedDocument.objects.filter(document=document), SharedDocumentSerializer
+        )
         serializer = SharedDocumentSerializer(shares, many=True)
         return Response(serializer.data)
     
     @action(detail=False, methods=['get'])
     def my_documents(self, request):
         """Get documents owned by the current user."""
-        documents = Document.objects.filter(owner=request.user)
+        documents = self.eager_load(Document.objects.filter(owner=request.user))
         page = self.paginate_queryset(documents)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
@@ -127,7 +247,7 @@ class DocumentViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def shared_with_me(self, request):
         """Get documents shared with the current user."""
-        documents = Document.objects.filter(shares__shared_with=request.user)
+        documents = self.eager_load(Document.objects.filter(shares__shared_with=request.user))
         page = self.paginate_queryset(documents)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
@@ -141,31 +261,22 @@ class DocumentViewSet(viewsets.ModelViewSet):
         document = self.get_object()
         
         # Check if user has edit permission
-        if document.owner != request.user:
-            share = SharedDocument.objects.filter(
-                document=document,
-                shared_with=request.user,
-                permission='edit'
-            ).first()
-            if not share:
-                return Response(
-                    {"detail": "You do not have permission to add versions."},
-                    status=status.HTTP_403_FORBIDDEN
-                )
-        
-        # Get the latest version number and increment
-        latest_version = DocumentVersion.objects.filter(document=document).order_by('-version_number').first()
-        version_number = 1
-        if latest_version:
-            version_number = latest_version.version_number + 1
+        if not has_document_permission(request.user, document, 'edit', request):
+            return Response(
+                {"detail": "You do not have permission to add versions."},
+                status=status.HTTP_403_FORBIDDEN
+            )
         
         serializer = DocumentVersionCreateSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save(
-                document=document,
-                created_by=request.user,
-                version_number=version_number
-            )
+            # Lock the document so concurrent uploads take consecutive version numbers
+            with transaction.atomic():
+                locked = Document.objects.select_for_update().get(pk=document.pk)
+                serializer.save(
+                    document=locked,
+                    created_by=request.user,
+                    version_number=locked.get_next_version_number()
+                )
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
@@ -197,19 +308,20 @@ class DocumentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        document = get_object_or_404(Document, id=document_id)
+        document = get_object_or_404(self.eager_load(Document.objects.all()), id=document_id)
         self.check_object_permissions(request, document)
         serializer = self.get_serializer(document)
         return Response(serializer.data)
 
 
-class CommentViewSet(viewsets.ModelViewSet):
+class CommentViewSet(EagerLoadingViewMixin, viewsets.ModelViewSet):
     """
     ViewSet for viewing and editing Comment instances.
     """
     
     queryset = Comment.objects.all()
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = CommentKeysetPagination
     
     def get_serializer_class(self):
         if self.action == 'create':
@@ -220,39 +332,47 @@ class CommentViewSet(viewsets.ModelViewSet):
         """
         This view should return comments for documents the user has access to.
         """
-        user = self.request.user
-        return Comment.objects.filter(
-            Q(document__owner=user) | 
-            Q(document__is_public=True) | 
-            Q(document__shares__shared_with=user)
-        ).distinct()
+        return self.eager_load(Comment.objects.accessible_to(self.request.user))
     
     def perform_create(self, serializer):
         document = serializer.validated_data['document']
         
-        # Check if user has permission to comment
-        if document.owner != self.request.user and not document.is_public:
-            share = SharedDocument.objects.filter(
-                document=document,
-                shared_with=self.request.user
-            ).first()
-            
-            if not share or share.permission not in ['edit', 'comment']:
-                return Response(
-                    {"detail": "You do not have permission to comment on this document."},
-                    status=status.HTTP_403_FORBIDDEN
-                )
+        # Check if user has permission to comment; anyone may comment on public documents
+        if not document.is_public and not has_document_permission(
+            self.request.user, document, 'comment', self.request
+        ):
+            raise PermissionDenied("You do not have permission to comment on this document.")
         
         serializer.save(author=self.request.user)
+    
+    @action(detail=False, methods=['post'])
+    def bulk_create(self, request):
+        """Create many comments, on one or several documents, in one transaction."""
+        serializer = CommentBulkCreateSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        items = serializer.validated_data['comments']
+        document_ids = {item['document'] for item in items}
+        documents = Document.objects.accessible_to(request.user).in_bulk(document_ids)
+        missing = sorted(document_ids - documents.keys())
+        if missing:
+            return Response({"detail": f"Documents not found: {missing}."}, status=status.HTTP_400_BAD_REQUEST)
+        for document in documents.values():
+            if not document.is_public and not has_document_permission(request.user, document, 'comment', request):
+                raise PermissionDenied(f"You do not have permission to comment on {document.slug}.")
+        
+        comments = bulk_comment(request.user, [(item['document'], item['content']) for item in items])
+        return Response(CommentSerializer(comments, many=True).data, status=status.HTTP_201_CREATED)
 
 
-class SharedDocumentViewSet(viewsets.ModelViewSet):
+class SharedDocumentViewSet(EagerLoadingViewMixin, viewsets.ModelViewSet):
     """
     ViewSet for viewing and editing SharedDocument instances.
     """
     
     queryset = SharedDocument.objects.all()
-    permission_classes = [permissions.IsAuthenticated]
+    permission_classes = [permissions.IsAuthenticated, IsDocumentOwnerOrReadOnly]
     
     def get_serializer_class(self):
         if self.action == 'create':
@@ -265,40 +385,162 @@ class SharedDocumentViewSet(viewsets.ModelViewSet):
         or shares where the user is the recipient.
         """
         user = self.request.user
-        return SharedDocument.objects.filter(
+        return self.eager_load(SharedDocument.objects.filter(
             Q(document__owner=user) | 
             Q(shared_with=user)
-        ).distinct()
+        ).distinct())
     
     def perform_create(self, serializer):
         document = serializer.validated_data['document']
         
         # Only document owner can create shares
         if document.owner != self.request.user:
-            return Response(
-                {"detail": "Only the document owner can share it."},
-                status=status.HTTP_403_FORBIDDEN
-            )
+            raise PermissionDenied("Only the document owner can share it.")
         
         serializer.save()
+    
+    @action(detail=False, methods=['post'])
+    def bulk_share(self, request):
+        """
+        Share several of the user's documents with several users at once.
+        
+        Every document is shared with every user; existing shares get the
+        new permission. Returns counts and a status for each pair.
+        """
+        serializer = SharedDocumentBulkSerializer(data=request.data)
+        if serializer.is_valid():
+            summary = bulk_share(
+                request.user,
+                serializer.validated_data['documents'],
+                serializer.validated_data['shared_with'],
+                serializer.validated_data['permission']
+            )
+            return Response(summary)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    @action(detail=False, methods=['post'])
+    def bulk_unshare(self, request):
+        """Remove the shares of several of the user's documents with several users at once."""
+        serializer = SharedDocumentBulkDeleteSerializer(data=request.data)
+        if serializer.is_valid():
+            summary = bulk_unshare(
+                request.user,
+                serializer.validated_data['documents'],
+                serializer.validated_data['shared_with']
+            )
+            return Response(summary)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class DocumentVersionViewSet(viewsets.ReadOnlyModelViewSet):
+class DocumentVersionViewSet(EagerLoadingViewMixin, viewsets.ReadOnlyModelViewSet):
     """
     ViewSet for viewing DocumentVersion instances.
     """
     
     queryset = DocumentVersion.objects.all()
-    permission_classes = [permissions.IsAuthenticated]
+    permission_classes = [permissions.IsAuthenticated, HasDocumentPermission]
+    pagination_class = DocumentVersionKeysetPagination
     serializer_class = DocumentVersionSerializer
     
     def get_queryset(self):
         """
         This view should return versions for documents the user has access to.
         """
-        user = self.request.user
-        return DocumentVersion.objects.filter(
-            Q(document__owner=user) | 
-            Q(document__is_public=True) | 
-            Q(document__shares__shared_with=user)
-        ).distinct()
\ No newline at end of file
+        return self.eager_load(DocumentVersion.objects.accessible_to(self.request.user))
+    
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """
+        Download a version's file, honoring Range and If-None-Match.
+        
+        Delta versions are rebuilt from their base before being sent.
+        """
+        version = self.get_object()
+        ext = os.path.splitext(named_file(version).name)[1]
+        filename = f"{version.document.slug}-v{version.version_number}{ext}"
+        if version.storage_mode == 'delta':
+            return file_response(
+                request,
+                lambda: open_version(version),
+                version.file_size,
+                filename,
+                etag=make_etag(version.checksum)
+            )
+        return fieldfile_response(request, version.file, filename, version.file_size, version.checksum)
+
+
+class UploadSessionViewSet(
+    mixins.CreateModelMixin,
+    mixins.RetrieveModelMixin,
+    mixins.DestroyModelMixin,
+    EagerLoadingViewMixin,
+    viewsets.GenericViewSet
+):
+    """
+    ViewSet for resumable chunked uploads.
+    
+    Create a session, PUT each chunk's raw bytes to ``chunks/{index}/``
+    (starting at 0, in any order, retrying as needed), then POST ``finalize/``
+    to create the document or version. Retrieving the session lists the
+    chunks already received, so an interrupted upload can resume.
+    """
+    
+    queryset = UploadSession.objects.all()
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_serializer_class(self):
+        if self.action == 'create':
+            return UploadSessionCreateSerializer
+        return UploadSessionSerializer
+    
+    def get_queryset(self):
+        return self.eager_load(
+            UploadSession.objects.filter(owner=self.request.user),
+            UploadSessionSerializer
+        )
+    
+    def perform_create(self, serializer):
+        document = serializer.validated_data.get('document')
+        
+        # Uploading a version needs the same permission as add_version
+        if document is not None and not has_document_permission(
+            self.request.user, document, 'edit', self.request
+        ):
+            raise PermissionDenied("You do not have permission to add versions.")
+        
+        serializer.save(owner=self.request.user)
+    
+    def perform_destroy(self, instance):
+        discard_chunks(instance)
+        instance.delete()
+    
+    @action(detail=True, methods=['put'], url_path=r'chunks/(?P<index>\d+)', parser_classes=[])
+    def chunk(self, request, pk=None, index=None):
+        """Store one chunk, read from the raw request body."""
+        session = self.get_object()
+        if session.status != 'active':
+            return Response(
+                {"detail": "Upload session is already completed."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            chunk = store_chunk(session, int(index), request.stream)
+        except UploadError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(UploadChunkSerializer(chunk).data, status=status.HTTP_201_CREATED)
+    
+    @action(detail=True, methods=['post'])
+    def finalize(self, request, pk=None):
+        """Assemble the chunks into a new document or document version."""
+        session = self.get_object()
+        try:
+            target = finalize_session(session)
+        except UploadPermissionError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_403_FORBIDDEN)
+        except UploadError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        serializer_class = DocumentSerializer if isinstance(target, Document) else DocumentVersionSerializer
+        serializer = serializer_class(target, context=self.get_serializer_context())
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
\ No newline at end of file
@@ -4,6 +4,8 @@ from rest_framework.views import APIView
 from rest_framework.decorators import action
 from django.contrib.auth import get_user_model
 
+from documents.caching import cached_response, user_scope
+
 from .serializers import (
     UserSerializer, 
     UserDetailSerializer, 
@@ -35,8 +37,11 @@ class UserViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def me(self, request):
         """Get the current authenticated user's details."""
-        serializer = self.get_serializer(request.user)
-        return Response(serializer.data)
+        return cached_response(
+            request,
+            [user_scope(request.user.pk)],
+            lambda: Response(self.get_serializer(request.user).data)
+        )
     
     @action(detail=False, methods=['put'])
     def change_password(self, request):
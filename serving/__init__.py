@@ -0,0 +1 @@
+"""Building blocks for the prediction service in ``app.py``."""
@@ -0,0 +1,287 @@
+"""
+ASGI entry point for the prediction API.
+
+Serves the same ``/api/predict/single``, ``/api/predict/batch`` and
+``/api/model`` contracts as ``app.py``, but runs every prediction in a
+pool of ``PREDICT_WORKERS`` processes, so CPU-bound model calls run in
+parallel instead of taking turns on one GIL while the event loop keeps
+accepting requests. Each worker loads the model itself (memory-mapped
+artifacts are shared between them) and picks up newly published versions
+on its own.
+
+At most ``PREDICT_QUEUE_DEPTH`` requests wait for or run in the pool;
+beyond that, requests get ``503`` at once instead of queueing without
+bound. Request bodies are read whole before being sent to a worker, so
+they are bounded too: a body over ``PREDICT_MAX_BODY_BYTES`` gets ``413``,
+and once ``PREDICT_MAX_BUFFERED_BYTES`` are held across requests, further
+ones get ``503``. Run a single server process, since the pool provides the
+parallelism::
+
+    uvicorn serving.asgi:app --port 8000
+"""
+import asyncio
+import io
+import json
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from serving import codecs
+from serving.forest import compile_forest
+from serving.registry import DEFAULT_MODEL_PATH, open_registry, train_dummy_model
+
+logger = logging.getLogger(__name__)
+
+ENGINES = {'sklearn': None, 'compiled': compile_forest}
+
+# The model in each pool worker, set by _init_worker
+_registry = None
+
+
+def _init_worker(path, check_interval, engine, placeholder):
+    global _registry
+    _registry = open_registry(path, check_interval=check_interval, prepare=ENGINES[engine], placeholder=placeholder)
+
+
+def _predict(features):
+    return _registry.current().model.predict(features)
+
+
+def _predict_rows(features):
+    return _predict(np.asarray(features, dtype=np.float64))
+
+
+def _predict_json_batch(body):
+    return _predict(np.array(json.loads(body)['features'])).tolist()
+
+
+def _predict_binary(body, rows, cols, dtype, chunk_rows):
+    return codecs.predict_binary(io.BytesIO(body), rows, cols, np.dtype(dtype), chunk_rows, _predict)
+
+
+def _predict_ndjson(body, n_features, chunk_rows):
+    return codecs.predict_ndjson(io.BytesIO(body), n_features, chunk_rows, _predict)
+
+
+class Overloaded(Exception):
+    """Raised when ``queue_depth`` requests or ``max_buffered_bytes`` of bodies are already waiting."""
+
+
+class BodyTooLarge(Exception):
+    """Raised when a request body exceeds ``max_body_bytes``."""
+
+
+class PredictionApp:
+    def __init__(self, model_path=DEFAULT_MODEL_PATH, check_interval=5.0, engine='sklearn',
+                 workers=None, queue_depth=64, chunk_rows=8192,
+                 max_body_bytes=64 * 1024 * 1024, max_buffered_bytes=256 * 1024 * 1024):
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown PREDICT_ENGINE {engine!r}")
+        self.model_path = model_path
+        self.check_interval = check_interval
+        self.engine = engine
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_depth = queue_depth
+        self.chunk_rows = chunk_rows
+        self.max_body_bytes = max_body_bytes
+        self.max_buffered_bytes = max_buffered_bytes
+        self.registry = None
+        self.pool = None
+        self.pending = 0
+        # Bytes of request bodies read and not yet answered
+        self.buffered = 0
+
+    @classmethod
+    def from_env(cls):
+        """Configure from the environment variables ``app.py`` reads, plus the pool's."""
+        return cls(
+            model_path=os.environ.get('MODEL_PATH', DEFAULT_MODEL_PATH),
+            check_interval=float(os.environ.get('MODEL_CHECK_INTERVAL', 5)),
+            engine=os.environ.get('PREDICT_ENGINE', 'sklearn'),
+            workers=int(os.environ.get('PREDICT_WORKERS', 0)) or None,
+            queue_depth=int(os.environ.get('PREDICT_QUEUE_DEPTH', 64)),
+            chunk_rows=int(os.environ.get('PREDICT_STREAM_CHUNK_ROWS', 8192)),
+            max_body_bytes=int(os.environ.get('PREDICT_MAX_BODY_BYTES', 64 * 1024 * 1024)),
+            max_buffered_bytes=int(os.environ.get('PREDICT_MAX_BUFFERED_BYTES', 256 * 1024 * 1024))
+        )
+
+    def startup(self):
+        # Without an artifact, every worker must serve the same placeholder model
+        placeholder = None if os.path.exists(self.model_path) else train_dummy_model()
+        self.registry = open_registry(self.model_path, check_interval=self.check_interval, placeholder=placeholder)
+        self._initargs = (self.model_path, self.check_interval, self.engine, placeholder)
+        self.pool = self._start_pool()
+
+    def _start_pool(self):
+        # spawn rather than fork: the server process runs an event loop and threads
+        return ProcessPoolExecutor(
+            self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=self._initargs
+        )
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+
+    async def run(self, fn, *args):
+        """Run ``fn(*args)`` in the pool, or raise Overloaded if too many requests are waiting."""
+        if self.pending >= self.queue_depth:
+            raise Overloaded('Too many predictions queued')
+        self.pending += 1
+        pool = self.pool
+        try:
+            return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); replace the pool once for later requests
+            if self.pool is pool:
+                logger.error('Prediction worker died; restarting the pool')
+                self.pool = self._start_pool()
+                pool.shutdown(wait=False)
+            raise
+        finally:
+            self.pending -= 1
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        route = (scope['method'], scope['path'])
+        if route == ('POST', '/api/predict/single'):
+            handler = self.predict_single
+        elif route == ('POST', '/api/predict/batch'):
+            handler = self.predict_batch
+        elif route == ('GET', '/api/model'):
+            handler = self.model_info
+        else:
+            await send_json(send, 404, {'status': 'error', 'message': 'Not found'})
+            return
+
+        try:
+            body = await self.read_body(scope, receive)
+        except BodyTooLarge as e:
+            await send_json(send, 413, {'status': 'error', 'message': str(e)})
+            return
+        except Overloaded as e:
+            await send_json(send, 503, {'status': 'error', 'message': str(e)})
+            return
+
+        request = Request(scope, body)
+        try:
+            await handler(request, send)
+        except Overloaded as e:
+            await send_json(send, 503, {'status': 'error', 'message': str(e)})
+        except BrokenProcessPool:
+            await send_json(send, 503, {'status': 'error', 'message': 'Prediction worker restarted'})
+        except Exception as e:
+            await send_json(send, 400, {'status': 'error', 'message': str(e)})
+        finally:
+            self.buffered -= len(body)
+
+    async def read_body(self, scope, receive):
+        """Read the request body, refusing it once it exceeds a limit; count it in ``buffered``."""
+        for name, value in scope['headers']:
+            if name.lower() == b'content-length' and value.isdigit() and int(value) > self.max_body_bytes:
+                raise BodyTooLarge(f"Request body exceeds {self.max_body_bytes} bytes")
+        chunks = []
+        size = 0
+        try:
+            while True:
+                message = await receive()
+                chunk = message.get('body', b'')
+                size += len(chunk)
+                self.buffered += len(chunk)
+                if size > self.max_body_bytes:
+                    raise BodyTooLarge(f"Request body exceeds {self.max_body_bytes} bytes")
+                if self.buffered > self.max_buffered_bytes:
+                    raise Overloaded('Too many request bytes buffered')
+                chunks.append(chunk)
+                if not message.get('more_body'):
+                    return b''.join(chunks)
+        except BaseException:
+            self.buffered -= size
+            raise
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    self.startup()
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    raise
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def predict_single(self, request, send):
+        row = np.asarray(json.loads(request.body)['features'], dtype=np.float64)
+        n_features = self.registry.current().model.n_features_in_
+        if row.shape != (n_features,):
+            raise ValueError(f"Expected {n_features} features, got array of shape {row.shape}")
+        prediction = await self.run(_predict_rows, row[np.newaxis])
+        await send_json(send, 200, {'status': 'success', 'prediction': float(prediction[0])})
+
+    async def predict_batch(self, request, send):
+        n_features = self.registry.current().model.n_features_in_
+        if request.mimetype == codecs.BINARY:
+            rows, cols, dtype = codecs.parse_binary_headers(
+                request.headers.get(codecs.SHAPE_HEADER.lower()),
+                request.headers.get(codecs.DTYPE_HEADER.lower()),
+                len(request.body),
+                n_features
+            )
+            predictions = await self.run(_predict_binary, request.body, rows, cols, dtype.str, self.chunk_rows)
+            await send_response(send, 200, codecs.encode_binary(predictions), codecs.BINARY, {
+                codecs.SHAPE_HEADER: str(rows),
+                codecs.DTYPE_HEADER: codecs.RESPONSE_DTYPE,
+            })
+        elif request.mimetype == codecs.NDJSON:
+            predictions = await self.run(_predict_ndjson, request.body, n_features, self.chunk_rows)
+            body = ''.join(codecs.iter_ndjson(predictions, self.chunk_rows)).encode()
+            await send_response(send, 200, body, codecs.NDJSON)
+        else:
+            predictions = await self.run(_predict_json_batch, request.body)
+            await send_json(send, 200, {'status': 'success', 'predictions': predictions})
+
+    async def model_info(self, request, send):
+        # Version and memory of the model in the server process, not the pool workers
+        await send_json(send, 200, self.registry.describe())
+
+
+class Request:
+    def __init__(self, scope, body):
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+        self.mimetype = self.headers.get('content-type', '').split(';')[0].strip().lower()
+        self.body = body
+
+
+async def send_response(send, status, body, content_type, headers=None):
+    raw_headers = [
+        (b'content-type', content_type.encode()),
+        (b'content-length', str(len(body)).encode()),
+    ]
+    raw_headers += [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()]
+    await send({'type': 'http.response.start', 'status': status, 'headers': raw_headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_json(send, status, payload):
+    # Same encoding as Flask's jsonify
+    body = json.dumps(payload, sort_keys=True, separators=(',', ':')).encode() + b'\n'
+    await send_response(send, status, body, 'application/json')
+
+
+app = PredictionApp.from_env()
@@ -0,0 +1,107 @@
+"""
+Request coalescing for single-row predictions.
+
+Concurrent requests each submit one feature row; a background thread
+gathers rows until ``max_batch_size`` are waiting or ``max_wait`` seconds
+have passed since the first one arrived, runs them through the model as a
+single NumPy batch, and hands every caller its own row of the result.
+Rows that are not finite are refused on submit; if a batch still fails,
+its rows are retried one at a time so only the failing row errors.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class Overloaded(Exception):
+    """Raised when the batch queue is full."""
+
+
+class MicroBatcher:
+    def __init__(self, predict_fn, n_features, max_batch_size=64, max_wait=0.002, max_queue=10000, on_batch=None):
+        self.predict_fn = predict_fn
+        # Called with each batch's size and the seconds each of its rows waited in the queue
+        self.on_batch = on_batch
+        self.n_features = n_features
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, features):
+        """Queue one feature row and return a Future for its prediction."""
+        row = np.asarray(features, dtype=np.float64)
+        if row.shape != (self.n_features,):
+            raise ValueError(
+                f"Expected {self.n_features} features, got array of shape {row.shape}"
+            )
+        if not np.isfinite(row).all():
+            raise ValueError('Features must be finite numbers')
+        if self._closed:
+            raise RuntimeError('Batcher is closed')
+        future = Future()
+        try:
+            self._queue.put_nowait((row, future, time.perf_counter()))
+        except queue.Full:
+            raise Overloaded('Too many predictions queued')
+        return future
+
+    def predict(self, features, timeout=None):
+        """Predict one row, blocking until its batch has run."""
+        return self.submit(features).result(timeout)
+
+    def close(self):
+        self._closed = True
+        self._queue.put((None, None, None))
+        self._thread.join()
+
+    def _collect(self):
+        row, future, queued_at = self._queue.get()
+        if future is None:
+            return None
+        rows, futures, queued = [row], [future], [queued_at]
+        deadline = time.monotonic() + self.max_wait
+        while len(rows) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                row, future, queued_at = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if future is None:
+                # Closing: run what we have, then stop
+                self._queue.put((None, None, None))
+                break
+            rows.append(row)
+            futures.append(future)
+            queued.append(queued_at)
+        return rows, futures, queued
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            rows, futures, queued = batch
+            if self.on_batch is not None:
+                started = time.perf_counter()
+                self.on_batch(len(rows), [started - queued_at for queued_at in queued])
+            try:
+                predictions = self.predict_fn(np.vstack(rows))
+            except Exception:
+                # Run the rows one at a time, so only the row that fails gets the error
+                self._run_each(rows, futures)
+                continue
+            for future, prediction in zip(futures, predictions):
+                future.set_result(prediction)
+
+    def _run_each(self, rows, futures):
+        for row, future in zip(rows, futures):
+            try:
+                future.set_result(self.predict_fn(row[np.newaxis])[0])
+            except Exception as exc:
+                future.set_exception(exc)
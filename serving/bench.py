@@ -0,0 +1,444 @@
+"""
+Load tests for the prediction service.
+
+Each scenario serves ``app.py`` on a local threaded WSGI server, drives it
+with concurrent keep-alive clients and prints throughput and latency
+percentiles::
+
+    python -m serving.bench batching --clients 1,8,32,64 --requests 4000
+    python -m serving.bench registry --workers 4
+    python -m serving.bench engines --sizes 1,100,10000,100000
+    python -m serving.bench formats --rows 1000000
+    python -m serving.bench cache --distinct 200
+    python -m serving.bench asgi --clients 1,8,32,64
+    python -m serving.bench metrics
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import threading
+import time
+
+import numpy as np
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def serve(wsgi_app):
+    """Serve ``wsgi_app`` on a free local port in a background thread."""
+    server = make_server('127.0.0.1', 0, wsgi_app, threaded=True, request_handler=QuietRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_load(port, path, body, clients, total, content_type='application/json'):
+    """
+    POST ``body`` ``total`` times from ``clients`` threads; return throughput and latencies.
+
+    ``body`` may be a list of bodies, which each client cycles through.
+    """
+    bodies = body if isinstance(body, list) else [body]
+    per_client = max(total // clients, 1)
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def client(offset):
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        local = []
+        failed = 0
+        for i in range(per_client):
+            start = time.perf_counter()
+            conn.request('POST', path, bodies[(offset + i) % len(bodies)], {'Content-Type': content_type})
+            response = conn.getresponse()
+            response.read()
+            local.append(time.perf_counter() - start)
+            failed += response.status != 200
+        conn.close()
+        with lock:
+            latencies.extend(local)
+            errors.append(failed)
+
+    threads = [threading.Thread(target=client, args=(n * per_client,)) for n in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return {
+        'throughput': len(latencies) / elapsed,
+        'p50_ms': np.percentile(latencies, 50) * 1000,
+        'p99_ms': np.percentile(latencies, 99) * 1000,
+        'errors': sum(errors),
+    }
+
+
+def print_row(label, clients, stats):
+    print(
+        f"{label:<10} {clients:>7} {stats['throughput']:>10.0f} "
+        f"{stats['p50_ms']:>9.2f} {stats['p99_ms']:>9.2f} {stats['errors']:>6}"
+    )
+
+
+def print_header():
+    print(f"{'mode':<10} {'clients':>7} {'req/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'errors':>6}")
+
+
+def bench_batching(args):
+    import app as service
+    from serving.batching import MicroBatcher
+
+    server = serve(service.app)
+    body = json.dumps({'features': [0.1, 0.2, 0.3, 0.4]})
+    modes = {
+        'direct': None,
+        'batched': MicroBatcher(
+            service.predict,
+            service.registry.current().model.n_features_in_,
+            max_batch_size=args.batch_size,
+            max_wait=args.wait_ms / 1000
+        ),
+    }
+    print_header()
+    for clients in args.clients:
+        for label, batcher in modes.items():
+            service.batcher = batcher
+            stats = run_load(server.server_port, '/api/predict/single', body, clients, args.requests)
+            print_row(label, clients, stats)
+    server.shutdown()
+
+
+def bench_cache(args):
+    import app as service
+    from serving.cache import MemoryBackend, PredictionCache, RedisBackend
+
+    server = serve(service.app)
+    rng = np.random.default_rng(0)
+    distinct = rng.random((args.distinct, 4)).round(6)
+    # Requests draw from the distinct rows, so all but the first sight of each row can hit
+    bodies = [json.dumps({'features': distinct[i].tolist()}) for i in rng.integers(0, args.distinct, args.requests)]
+    modes = {'uncached': None, 'memory': lambda: MemoryBackend(max_entries=args.distinct)}
+    if args.redis_url:
+        modes['redis'] = lambda: RedisBackend(args.redis_url, prefix=f"bench-{time.time()}:")
+    print(f"{'mode':<10} {'clients':>7} {'req/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'errors':>6} {'hit rate':>9}")
+    for clients in args.clients:
+        for label, backend in modes.items():
+            service.cache = PredictionCache(backend()) if backend else None
+            stats = run_load(server.server_port, '/api/predict/single', bodies, clients, args.requests)
+            hit_rate = service.cache.stats()['hit_rate'] if service.cache else 0
+            print(
+                f"{label:<10} {clients:>7} {stats['throughput']:>10.0f} {stats['p50_ms']:>9.2f} "
+                f"{stats['p99_ms']:>9.2f} {stats['errors']:>6} {hit_rate:>9.1%}"
+            )
+    server.shutdown()
+
+
+def _load_in_worker(path, mmap_mode):
+    from serving.registry import ModelRegistry
+
+    registry = ModelRegistry(path, mmap_mode=mmap_mode)
+    registry.current().model.predict(np.zeros((1, registry.current().model.n_features_in_)))
+    return registry.describe()
+
+
+def _describe_preloaded(_):
+    registry = _preloaded
+    registry.current().model.predict(np.zeros((1, registry.current().model.n_features_in_)))
+    return registry.describe()
+
+
+_preloaded = None
+
+
+def bench_registry(args):
+    import multiprocessing
+    import tempfile
+
+    from serving.registry import ModelRegistry, save_model, train_dummy_model
+
+    global _preloaded
+    artifact = args.artifact
+    if artifact is None:
+        model = train_dummy_model(n_estimators=args.trees, n_samples=args.samples)
+        artifact = save_model(model, tempfile.mkdtemp(), version='bench')
+        del model
+
+    context = multiprocessing.get_context('fork')
+    print(f"{'mode':<10} {'worker':>6} {'load s':>8} {'rss MB':>8} {'pss MB':>8} {'shared MB':>10}")
+    for mode in ('copy', 'mmap', 'preload'):
+        if mode == 'preload':
+            # Loaded once before forking, like gunicorn --preload
+            _preloaded = ModelRegistry(artifact)
+            with context.Pool(args.workers) as pool:
+                results = pool.map(_describe_preloaded, range(args.workers))
+            _preloaded = None
+        else:
+            with context.Pool(args.workers) as pool:
+                results = pool.starmap(
+                    _load_in_worker, [(artifact, 'r' if mode == 'mmap' else None)] * args.workers
+                )
+        for worker, info in enumerate(results):
+            print(
+                f"{mode:<10} {worker:>6} {info['load_seconds']:>8.3f} "
+                f"{info['rss_bytes'] / 1e6:>8.1f} {(info['pss_bytes'] or 0) / 1e6:>8.1f} "
+                f"{(info['shared_bytes'] or 0) / 1e6:>10.1f}"
+            )
+
+
+def _best_time(fn, X, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(X)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_engines(args):
+    from serving.forest import CompiledForest
+    from serving.registry import train_dummy_model
+
+    model = train_dummy_model(n_estimators=args.trees, n_samples=args.samples)
+    compiled = CompiledForest.from_sklearn(model, max_rows=args.max_rows)
+    rng = np.random.default_rng(0)
+    print(f"{compiled.max_depth} max depth, {len(compiled.value)} nodes in {args.trees} trees")
+    print(f"{'rows':>8} {'sklearn ms':>11} {'arrays ms':>10} {'compiled ms':>12} {'speedup':>8} {'max diff':>9}")
+    for size in args.sizes:
+        X = rng.random((size, model.n_features_in_))
+        difference = float(np.max(np.abs(model.predict(X) - compiled.traverse(X))))
+        sklearn_time = _best_time(model.predict, X, args.repeat)
+        arrays_time = _best_time(compiled.traverse, X, args.repeat)
+        compiled_time = _best_time(compiled.predict, X, args.repeat)
+        print(
+            f"{size:>8} {sklearn_time * 1000:>11.2f} {arrays_time * 1000:>10.2f} {compiled_time * 1000:>12.2f} "
+            f"{sklearn_time / compiled_time:>7.1f}x {difference:>9.1e}"
+        )
+
+
+def _serve_forever(connection):
+    import app as service
+
+    server = serve(service.app)
+    connection.send(server.server_port)
+    connection.recv()
+
+
+def _proc_status_kb(pid, field):
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    return 0
+
+
+def bench_metrics(args):
+    """Per-request cost of the instrumentation, called in-process to leave out network noise."""
+    import app as service
+    from serving.forest import compile_forest
+    from serving.metrics import ServiceMetrics
+    from serving.registry import ModelRegistry, train_dummy_model
+
+    # The compiled forest predicts a row in about 0.1 ms, so the instrumentation is not lost in model time
+    service.registry = ModelRegistry.from_model(train_dummy_model(), version='bench', prepare=compile_forest)
+    client = service.app.test_client()
+    rng = np.random.default_rng(0)
+    workloads = {
+        'single': ('/api/predict/single', {'features': rng.random(4).tolist()}),
+        f"batch{args.batch_rows}": ('/api/predict/batch', {'features': rng.random((args.batch_rows, 4)).tolist()}),
+    }
+    print(f"{'workload':<10} {'disabled us':>12} {'enabled us':>11} {'overhead us':>12} {'overhead':>9}")
+    for label, (path, payload) in workloads.items():
+        best = {}
+        for _ in range(args.repeat):
+            for mode in ('disabled', 'enabled'):
+                service.metrics = ServiceMetrics() if mode == 'enabled' else None
+                start = time.perf_counter()
+                for _ in range(args.requests):
+                    client.post(path, json=payload)
+                elapsed = (time.perf_counter() - start) / args.requests * 1e6
+                best[mode] = min(best.get(mode, elapsed), elapsed)
+        overhead = best['enabled'] - best['disabled']
+        print(
+            f"{label:<10} {best['disabled']:>12.1f} {best['enabled']:>11.1f} "
+            f"{overhead:>12.1f} {overhead / best['disabled']:>9.1%}"
+        )
+
+    # The bookkeeping alone, without the request noise around it
+    metrics = ServiceMetrics()
+    start = time.perf_counter()
+    for _ in range(args.requests):
+        timer = metrics.timer('single')
+        for stage in ('parse', 'convert', 'predict', 'serialize'):
+            timer.mark(stage)
+        metrics.finish('single', timer, 200)
+    print(f"Timing four stages and recording them: {(time.perf_counter() - start) / args.requests * 1e6:.1f} us")
+    start = time.perf_counter()
+    service.metrics.render()
+    print(f"Rendering /metrics: {(time.perf_counter() - start) * 1000:.2f} ms")
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Nothing is listening on port {port}")
+
+
+def bench_asgi(args):
+    """Compare the threaded Flask server with uvicorn and the process pool, each in its own process."""
+    import multiprocessing
+    import subprocess
+    import sys
+
+    context = multiprocessing.get_context('fork')
+    parent, child = context.Pipe()
+    flask_process = context.Process(target=_serve_forever, args=(child,), daemon=True)
+    flask_process.start()
+    flask_port = parent.recv()
+
+    asgi_port = _free_port()
+    env = dict(os.environ, PREDICT_WORKERS=str(args.workers), PREDICT_QUEUE_DEPTH=str(args.queue_depth))
+    asgi_process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'serving.asgi:app', '--port', str(asgi_port), '--log-level', 'warning'],
+        env=env
+    )
+    try:
+        _wait_for_port(asgi_port)
+        rng = np.random.default_rng(0)
+        workloads = {
+            'single': ('/api/predict/single', json.dumps({'features': rng.random(4).tolist()})),
+            f"batch{args.batch_rows}": (
+                '/api/predict/batch', json.dumps({'features': rng.random((args.batch_rows, 4)).tolist()})
+            ),
+        }
+        servers = {'flask': flask_port, 'asgi': asgi_port}
+        print(f"{'workload':<10} ", end='')
+        print_header()
+        for workload, (path, body) in workloads.items():
+            for clients in args.clients:
+                for label, port in servers.items():
+                    stats = run_load(port, path, body, clients, args.requests)
+                    print(f"{workload:<10} ", end='')
+                    print_row(label, clients, stats)
+    finally:
+        asgi_process.terminate()
+        asgi_process.wait()
+        parent.send('stop')
+        flask_process.join()
+
+
+def bench_formats(args):
+    """Time a large batch in each format against a fresh server process and report its peak memory."""
+    import multiprocessing
+
+    rows = args.rows
+    X = np.random.default_rng(0).random((rows, 4))
+    bodies = {
+        'json': (json.dumps({'features': X.tolist()}).encode(), {'Content-Type': 'application/json'}),
+        'binary': (X.astype('<f8').tobytes(), {'Content-Type': 'application/octet-stream', 'X-Shape': f"{rows},4"}),
+        'ndjson': (
+            ''.join(f"[{a!r},{b!r},{c!r},{d!r}]\n" for a, b, c, d in X.tolist()).encode(),
+            {'Content-Type': 'application/x-ndjson'}
+        ),
+    }
+    context = multiprocessing.get_context('fork')
+    print(f"{'format':<8} {'body MB':>8} {'seconds':>8} {'rows/s':>10} {'server base MB':>15} {'server peak MB':>15}")
+    for name, (body, headers) in bodies.items():
+        parent, child = context.Pipe()
+        process = context.Process(target=_serve_forever, args=(child,), daemon=True)
+        process.start()
+        port = parent.recv()
+        base = _proc_status_kb(process.pid, 'VmRSS')
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=600)
+        start = time.perf_counter()
+        conn.request('POST', '/api/predict/batch', body, headers)
+        response = conn.getresponse()
+        response.read()
+        elapsed = time.perf_counter() - start
+        peak = _proc_status_kb(process.pid, 'VmHWM')
+        parent.send('stop')
+        process.join()
+        print(
+            f"{name:<8} {len(body) / 1e6:>8.1f} {elapsed:>8.2f} {rows / elapsed:>10.0f} "
+            f"{base / 1024:>15.1f} {peak / 1024:>15.1f}"
+        )
+
+
+def parse_ints(value):
+    return [int(part) for part in value.split(',')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    scenarios = parser.add_subparsers(dest='scenario', required=True)
+
+    batching = scenarios.add_parser('batching', help='Single predictions with and without micro-batching.')
+    batching.add_argument('--clients', type=parse_ints, default=[1, 8, 32, 64])
+    batching.add_argument('--requests', type=int, default=2000, help='Requests per concurrency level.')
+    batching.add_argument('--batch-size', type=int, default=64)
+    batching.add_argument('--wait-ms', type=float, default=2)
+    batching.set_defaults(run=bench_batching)
+
+    registry = scenarios.add_parser('registry', help='Model load time and memory per forked worker.')
+    registry.add_argument('--artifact', help='Model artifact to load (default: train the placeholder model).')
+    registry.add_argument('--trees', type=int, default=100)
+    registry.add_argument('--samples', type=int, default=20000, help='Training rows; more rows grow deeper trees.')
+    registry.add_argument('--workers', type=int, default=4)
+    registry.set_defaults(run=bench_registry)
+
+    engines = scenarios.add_parser('engines', help='sklearn against the compiled forest across batch sizes.')
+    engines.add_argument('--sizes', type=parse_ints, default=[1, 10, 100, 1000, 10000, 100000])
+    engines.add_argument('--trees', type=int, default=100)
+    engines.add_argument('--samples', type=int, default=100, help='Training rows; more rows grow deeper trees.')
+    engines.add_argument('--max-rows', type=int, default=512)
+    engines.add_argument('--repeat', type=int, default=3)
+    engines.set_defaults(run=bench_engines)
+
+    cache = scenarios.add_parser('cache', help='Single predictions of repeated rows with and without the cache.')
+    cache.add_argument('--clients', type=parse_ints, default=[1, 8, 32])
+    cache.add_argument('--requests', type=int, default=4000, help='Requests per concurrency level.')
+    cache.add_argument('--distinct', type=int, default=200, help='Distinct feature rows among the requests.')
+    cache.add_argument('--redis-url', help='Also measure a Redis-compatible backend at this URL.')
+    cache.set_defaults(run=bench_cache)
+
+    metrics = scenarios.add_parser('metrics', help='Per-request cost of the /metrics instrumentation.')
+    metrics.add_argument('--requests', type=int, default=2000)
+    metrics.add_argument('--batch-rows', type=int, default=100)
+    metrics.add_argument('--repeat', type=int, default=5)
+    metrics.set_defaults(run=bench_metrics)
+
+    asgi = scenarios.add_parser('asgi', help='The Flask server against uvicorn with the process pool.')
+    asgi.add_argument('--clients', type=parse_ints, default=[1, 8, 32, 64])
+    asgi.add_argument('--requests', type=int, default=1000, help='Requests per concurrency level.')
+    asgi.add_argument('--batch-rows', type=int, default=1000)
+    asgi.add_argument('--workers', type=int, default=os.cpu_count())
+    asgi.add_argument('--queue-depth', type=int, default=64)
+    asgi.set_defaults(run=bench_asgi)
+
+    formats = scenarios.add_parser('formats', help='One large batch as JSON, binary and NDJSON.')
+    formats.add_argument('--rows', type=int, default=1000000)
+    formats.set_defaults(run=bench_formats)
+
+    args = parser.parse_args(argv)
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
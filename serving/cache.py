@@ -0,0 +1,148 @@
+"""
+Cached predictions for repeated feature vectors.
+
+A row's key hashes its features rounded to ``decimals`` places (so values
+that differ only by float noise share an entry) together with the model
+version, so a newly published model never serves predictions cached for
+the previous one. Entries live in a backend:
+
+- ``MemoryBackend``: an LRU dict in each worker, with a TTL.
+- ``RedisBackend``: any Redis-compatible server (Redis, Valkey, KeyDB),
+  shared by every worker and host pointed at it.
+
+A failing backend counts as a miss; the cache must never fail a
+prediction the model could have made.
+"""
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBackend:
+    def __init__(self, max_entries=100000, ttl=300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def size(self):
+        return len(self._entries)
+
+
+class RedisBackend:
+    def __init__(self, url, ttl=300.0, prefix='predict:'):
+        import redis
+
+        self.client = redis.Redis.from_url(url, socket_timeout=0.05, socket_connect_timeout=0.05)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.evictions = None
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return None if value is None else float(value)
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, repr(value), ex=max(int(self.ttl), 1))
+
+    def clear(self):
+        # Keys carry the model version and expire on their own; other workers may still use them
+        pass
+
+    def size(self):
+        # Keys cannot be counted without scanning the whole database
+        return None
+
+
+class PredictionCache:
+    def __init__(self, backend, decimals=6):
+        self.backend = backend
+        self.decimals = decimals
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def key(self, features, version, n_features=None):
+        """
+        Hash a feature row, rounded to ``decimals`` places, with the model version.
+
+        Raises ValueError unless ``features`` is a flat row (of ``n_features``
+        values, if given): the hash covers only the values, so a nested list
+        would otherwise share the key of the row it flattens to.
+        """
+        row = np.asarray(features, dtype=np.float64)
+        if row.ndim != 1 or (n_features is not None and row.shape != (n_features,)):
+            expected = n_features if n_features is not None else 'a list of'
+            raise ValueError(f"Expected {expected} features, got array of shape {row.shape}")
+        row = np.round(row, self.decimals)
+        # Adding 0.0 turns -0.0 into 0.0 so both hash the same
+        digest = hashlib.blake2b((row + 0.0).tobytes(), digest_size=16).hexdigest()
+        return f"{version}:{digest}"
+
+    def get(self, key):
+        """Return the cached prediction for ``key``, or None."""
+        try:
+            value = self.backend.get(key)
+        except Exception as exc:
+            logger.warning('Prediction cache lookup failed: %s', exc)
+            self.errors += 1
+            value = None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        try:
+            self.backend.set(key, float(value))
+        except Exception as exc:
+            logger.warning('Prediction cache store failed: %s', exc)
+            self.errors += 1
+
+    def invalidate(self, loaded=None):
+        """Drop every cached prediction; registered with ``ModelRegistry.on_swap``."""
+        self.backend.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else None,
+            'errors': self.errors,
+            'entries': self.backend.size(),
+            'evictions': self.backend.evictions,
+        }
@@ -0,0 +1,186 @@
+"""
+Binary and NDJSON encodings for batch predictions.
+
+Binary bodies are raw C-ordered feature arrays (little-endian ``float64``
+by default, or ``float32`` with ``X-Dtype: <f4``), with their shape given
+as ``X-Shape: <rows>,<cols>``; predictions come back as raw little-endian
+``float64``. NDJSON bodies hold one JSON array of features per line, and
+predictions come back one JSON number per line. Both are read from the
+request stream and predicted in fixed-size chunks, so only the
+predictions, one float per row, are held for the whole batch.
+
+Nothing is sent before the body has been read: most HTTP/1.1 clients only
+read the response once they have sent the whole request, so answering
+early deadlocks as soon as both socket buffers fill.
+"""
+import json
+
+import numpy as np
+
+BINARY = 'application/octet-stream'
+NDJSON = 'application/x-ndjson'
+SHAPE_HEADER = 'X-Shape'
+DTYPE_HEADER = 'X-Dtype'
+DTYPES = ('<f8', '<f4')
+RESPONSE_DTYPE = '<f8'
+
+
+class DecodeError(ValueError):
+    """Raised when a request body does not match its declared format."""
+
+
+def parse_shape(value, n_features):
+    """Parse an ``X-Shape: rows,cols`` header, checking the column count."""
+    try:
+        rows, cols = (int(part) for part in (value or '').split(','))
+    except ValueError:
+        raise DecodeError(f"{SHAPE_HEADER} must be '<rows>,<cols>'")
+    if rows < 0 or cols != n_features:
+        raise DecodeError(f"{SHAPE_HEADER} must be '<rows>,{n_features}'")
+    return rows, cols
+
+
+def parse_dtype(value):
+    dtype = value or DTYPES[0]
+    if dtype not in DTYPES:
+        raise DecodeError(f"{DTYPE_HEADER} must be one of {', '.join(DTYPES)}")
+    return np.dtype(dtype)
+
+
+def _read_into(stream, view):
+    filled = 0
+    readinto = getattr(stream, 'readinto', None)
+    while filled < len(view):
+        if readinto is not None:
+            count = readinto(view[filled:])
+        else:
+            data = stream.read(len(view) - filled)
+            count = len(data)
+            view[filled:filled + count] = data
+        if not count:
+            break
+        filled += count
+    return filled
+
+
+def iter_binary_chunks(stream, rows, cols, dtype, chunk_rows):
+    """
+    Yield the rows of a binary body as arrays of at most ``chunk_rows`` rows.
+
+    One buffer is reused for every chunk and each array is a view of it, so
+    a chunk must be consumed before the next one is read.
+    """
+    row_bytes = cols * dtype.itemsize
+    buffer = bytearray(min(chunk_rows, rows) * row_bytes)
+    view = memoryview(buffer)
+    remaining = rows
+    while remaining:
+        count = min(chunk_rows, remaining)
+        filled = _read_into(stream, view[:count * row_bytes])
+        if filled != count * row_bytes:
+            raise DecodeError(f"Body ended after {rows - remaining + filled // row_bytes} of {rows} rows")
+        yield np.frombuffer(buffer, dtype=dtype, count=count * cols).reshape(count, cols)
+        remaining -= count
+    if stream.read(1):
+        raise DecodeError(f"Body is longer than {rows} rows")
+
+
+def parse_binary_headers(shape, dtype, content_length, n_features):
+    """Return the ``(rows, cols, dtype)`` of a binary body from its headers."""
+    rows, cols = parse_shape(shape, n_features)
+    dtype = parse_dtype(dtype)
+    if content_length is not None and content_length != rows * cols * dtype.itemsize:
+        raise DecodeError(f"Body must be {rows * cols * dtype.itemsize} bytes for shape {rows},{cols}")
+    return rows, cols, dtype
+
+
+def predict_binary(stream, rows, cols, dtype, chunk_rows, predict_fn):
+    """Predict every row of a binary body, ``chunk_rows`` at a time."""
+    predictions = np.empty(rows, dtype=RESPONSE_DTYPE)
+    offset = 0
+    for chunk in iter_binary_chunks(stream, rows, cols, dtype, chunk_rows):
+        predictions[offset:offset + len(chunk)] = predict_fn(chunk)
+        offset += len(chunk)
+    return predictions
+
+
+def _iter_line_blocks(stream, block_size):
+    """Yield runs of whole lines read ``block_size`` bytes at a time."""
+    pending = b''
+    while True:
+        block = stream.read(block_size)
+        if not block:
+            break
+        block = pending + block
+        cut = block.rfind(b'\n') + 1
+        pending = block[cut:]
+        if cut:
+            yield block[:cut]
+    if pending.strip():
+        yield pending
+
+
+def _parse_lines(lines, n_features, first_line):
+    rows = [line for line in lines if line.strip()]
+    if not rows:
+        return np.empty((0, n_features))
+    try:
+        # One json.loads per block rather than per line
+        parsed = np.array(json.loads(b'[' + b','.join(rows) + b']'), dtype=np.float64)
+        if parsed.shape == (len(rows), n_features):
+            return parsed
+    except (TypeError, ValueError):
+        pass
+    # Find the offending line to report it
+    for number, line in enumerate(lines, start=first_line):
+        if not line.strip():
+            continue
+        try:
+            row = np.array(json.loads(line), dtype=np.float64)
+        except (TypeError, ValueError) as exc:
+            raise DecodeError(f"Line {number}: {exc}")
+        if row.shape != (n_features,):
+            raise DecodeError(f"Line {number}: expected a list of {n_features} numbers")
+    raise DecodeError('Invalid NDJSON body')
+
+
+def iter_ndjson_chunks(stream, n_features, chunk_rows, block_size=1 << 20):
+    """Yield the rows of an NDJSON body as float64 arrays of at most ``chunk_rows`` rows."""
+    parsed = []
+    count = 0
+    line_number = 1
+    for block in _iter_line_blocks(stream, block_size):
+        lines = block.split(b'\n')
+        rows = _parse_lines(lines, n_features, line_number)
+        line_number += len(lines) - 1
+        if not len(rows):
+            continue
+        parsed.append(rows)
+        count += len(rows)
+        while count >= chunk_rows:
+            rows = np.concatenate(parsed)
+            yield rows[:chunk_rows]
+            parsed = [rows[chunk_rows:]]
+            count -= chunk_rows
+    if count:
+        yield np.concatenate(parsed)
+
+
+def predict_ndjson(stream, n_features, chunk_rows, predict_fn):
+    """Predict every row of an NDJSON body, ``chunk_rows`` at a time."""
+    predictions = [predict_fn(chunk) for chunk in iter_ndjson_chunks(stream, n_features, chunk_rows)]
+    return np.concatenate(predictions) if predictions else np.empty(0)
+
+
+def encode_binary(predictions):
+    return np.asarray(predictions, dtype=RESPONSE_DTYPE).tobytes()
+
+
+def encode_ndjson(predictions):
+    return ''.join(f"{value!r}\n" for value in np.asarray(predictions, dtype=np.float64).tolist())
+
+
+def iter_ndjson(predictions, chunk_rows):
+    """Yield the NDJSON encoding of ``predictions`` ``chunk_rows`` lines at a time."""
+    for start in range(0, len(predictions), chunk_rows):
+        yield encode_ndjson(predictions[start:start + chunk_rows])
@@ -0,0 +1,202 @@
+"""
+Vectorized inference for fitted scikit-learn forest regressors.
+
+Every tree's nodes are flattened into shared contiguous arrays. A batch
+walks all trees at once: each step moves every unfinished (row, tree) pair
+one level down, and every few steps the pairs that reached a leaf add its
+value to their row and are dropped. Missing (NaN) features follow each
+split's ``missing_go_to_left`` as in sklearn; infinite ones are refused, as
+sklearn refuses them. This avoids sklearn's per-call overhead,
+which dominates small batches; for large batches sklearn's compiled loop is
+faster, so batches above ``max_rows`` go to the original estimator when the
+compiled forest keeps one.
+
+Without the estimator a compiled forest holds only NumPy arrays, so a saved
+one is shared between workers through the page cache when loaded with
+``mmap_mode``::
+
+    python -m serving.forest compile models/current.joblib --output models/compiled.joblib
+"""
+import argparse
+
+import joblib
+import numpy as np
+
+# Unfinished (row, tree) pairs walked at once; bounds memory per chunk of rows
+MAX_PAIRS = 1 << 20
+# Steps between dropping the pairs that reached a leaf
+COMPACT_EVERY = 4
+# Larger batches are faster through sklearn's own loop
+DEFAULT_MAX_ROWS = 512
+
+
+class CompiledForest:
+    # Forests compiled before missing values were routed refuse NaN features
+    missing_go_left = None
+
+    def __init__(self, feature, threshold, children, is_leaf, value, roots, max_depth, n_features_in_,
+                 estimator=None, max_rows=DEFAULT_MAX_ROWS, missing_go_left=None):
+        self.feature = feature
+        self.threshold = threshold
+        # Whether rows missing a node's feature go to its left child; None if NaN is not supported
+        self.missing_go_left = missing_go_left
+        self.children = children
+        self.is_leaf = is_leaf
+        self.value = value
+        self.roots = roots
+        self.max_depth = max_depth
+        self.n_features_in_ = n_features_in_
+        self.estimator = estimator
+        self.max_rows = max_rows
+
+    @classmethod
+    def from_sklearn(cls, model, keep_estimator=True, max_rows=DEFAULT_MAX_ROWS):
+        """Flatten a fitted single-output forest regressor (random forest or extra trees)."""
+        estimators = getattr(model, 'estimators_', None)
+        if not estimators or getattr(model, 'n_outputs_', 1) != 1 or not hasattr(estimators[0], 'tree_'):
+            raise TypeError(f"Cannot compile {type(model).__name__}: expected a fitted single-output forest regressor")
+
+        # sklearn routes NaN through trees that record a direction for it, unless monotonic constraints are set
+        supports_missing = (
+            hasattr(estimators[0].tree_, 'missing_go_to_left') and getattr(model, 'monotonic_cst', None) is None
+        )
+        features, thresholds, children, leaves, values, roots, missing = [], [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        for estimator in estimators:
+            tree = estimator.tree_
+            nodes = np.arange(tree.node_count)
+            is_leaf = tree.children_left == -1
+            # Children of node i sit at 2i (left) and 2i + 1 (right); leaves point at themselves
+            pairs = np.empty((tree.node_count, 2), dtype=np.intp)
+            pairs[:, 0] = np.where(is_leaf, nodes, tree.children_left) + offset
+            pairs[:, 1] = np.where(is_leaf, nodes, tree.children_right) + offset
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(tree.threshold)
+            children.append(pairs.ravel())
+            leaves.append(is_leaf)
+            values.append(tree.value[:, 0, 0])
+            if supports_missing:
+                missing.append(np.asarray(tree.missing_go_to_left, dtype=bool))
+            roots.append(offset)
+            offset += tree.node_count
+            max_depth = max(max_depth, tree.max_depth)
+
+        return cls(
+            feature=np.ascontiguousarray(np.concatenate(features), dtype=np.intp),
+            threshold=np.ascontiguousarray(np.concatenate(thresholds), dtype=np.float64),
+            children=np.ascontiguousarray(np.concatenate(children), dtype=np.intp),
+            is_leaf=np.concatenate(leaves),
+            value=np.ascontiguousarray(np.concatenate(values), dtype=np.float64),
+            roots=np.asarray(roots, dtype=np.intp),
+            max_depth=max_depth,
+            n_features_in_=model.n_features_in_,
+            estimator=model if keep_estimator else None,
+            max_rows=max_rows,
+            missing_go_left=np.concatenate(missing) if supports_missing else None
+        )
+
+    def predict(self, X):
+        X = np.asarray(X)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(
+                f"X has shape {X.shape}, but the forest expects {self.n_features_in_} features"
+            )
+        if self.estimator is not None and X.shape[0] > self.max_rows:
+            return self.estimator.predict(X)
+        return self.traverse(X)
+
+    def traverse(self, X):
+        """Predict with the flattened arrays regardless of batch size."""
+        # sklearn compares float32 features against float64 thresholds; do the same to match it
+        X = np.asarray(X, dtype=np.float32)
+        if np.isinf(X).any():
+            raise ValueError("Input X contains infinity or a value too large for dtype('float32').")
+        has_missing = bool(np.isnan(X).any())
+        if has_missing and self.missing_go_left is None:
+            raise ValueError('Input X contains NaN.')
+        out = np.empty(X.shape[0], dtype=np.float64)
+        chunk_rows = max(MAX_PAIRS // len(self.roots), 1)
+        for start in range(0, X.shape[0], chunk_rows):
+            out[start:start + chunk_rows] = self._traverse_chunk(X[start:start + chunk_rows], has_missing)
+        return out
+
+    def _traverse_chunk(self, X, has_missing=False):
+        n_rows, n_features = X.shape
+        n_trees = len(self.roots)
+        flat = X.ravel()
+        node = np.tile(self.roots, n_rows)
+        row = np.repeat(np.arange(n_rows, dtype=np.intp), n_trees)
+        offset = row * n_features
+        total = np.zeros(n_rows, dtype=np.float64)
+
+        for step in range(1, self.max_depth + 1):
+            x = flat[offset + self.feature[node]]
+            go_right = x > self.threshold[node]
+            if has_missing:
+                missing = np.isnan(x)
+                go_right[missing] = ~self.missing_go_left[node[missing]]
+            node = self.children[2 * node + go_right]
+            if step % COMPACT_EVERY and step != self.max_depth:
+                continue
+            done = self.is_leaf[node]
+            if done.any():
+                total += np.bincount(row[done], weights=self.value[node[done]], minlength=n_rows)
+                pending = ~done
+                node, row, offset = node[pending], row[pending], offset[pending]
+                if not node.size:
+                    break
+        if node.size:
+            # Trees that are a single leaf never step
+            total += np.bincount(row, weights=self.value[node], minlength=n_rows)
+        return total / n_trees
+
+
+def compile_forest(model, **kwargs):
+    """Return a compiled version of ``model``; already compiled models are returned as they are."""
+    if isinstance(model, CompiledForest):
+        return model
+    return CompiledForest.from_sklearn(model, **kwargs)
+
+
+def max_abs_difference(model, compiled, X):
+    """Largest absolute difference between sklearn's and the flattened predictions on ``X``."""
+    if not len(X):
+        return 0.0
+    return float(np.max(np.abs(model.predict(X) - compiled.traverse(X))))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    compile_parser = commands.add_parser('compile', help='Compile a saved sklearn forest and check it.')
+    compile_parser.add_argument('artifact')
+    compile_parser.add_argument('--output', required=True)
+    compile_parser.add_argument(
+        '--arrays-only', action='store_true',
+        help='Drop the sklearn estimator, so every batch size uses the flattened arrays.'
+    )
+    compile_parser.add_argument('--max-rows', type=int, default=DEFAULT_MAX_ROWS)
+    compile_parser.add_argument('--check-rows', type=int, default=10000)
+    compile_parser.add_argument('--tolerance', type=float, default=1e-9)
+    args = parser.parse_args(argv)
+
+    model = joblib.load(args.artifact)
+    compiled = compile_forest(model, keep_estimator=not args.arrays_only, max_rows=args.max_rows)
+    rng = np.random.default_rng(0)
+    X = rng.random((args.check_rows, compiled.n_features_in_))
+    if compiled.missing_go_left is not None:
+        # Blank one feature in every tenth row to check missing values are routed as sklearn does
+        blanked = np.arange(0, len(X), 10)
+        X[blanked, rng.integers(compiled.n_features_in_, size=len(blanked))] = np.nan
+    difference = max_abs_difference(model, compiled, X)
+    if difference > args.tolerance:
+        parser.exit(1, f"Compiled forest differs from sklearn by {difference:g}; not saved\n")
+    joblib.dump(compiled, args.output)
+    print(f"{args.output}: {len(compiled.value)} nodes, max difference {difference:g}")
+
+
+if __name__ == '__main__':
+    # Run from the importable module so saved forests unpickle as serving.forest.CompiledForest
+    from serving.forest import main
+    main()
@@ -0,0 +1,215 @@
+"""
+Prometheus metrics for the prediction service, in the text exposition format.
+
+Metrics are kept per process, like ``GET /api/model`` and ``GET
+/api/cache``; with several gunicorn workers, Prometheus scrapes each one
+(or sums them) as separate targets. With metrics disabled the service
+uses ``NULL_TIMER``, whose methods do nothing.
+
+Each request times its stages with a ``StageTimer``:
+
+- ``parse``: reading and decoding the JSON body.
+- ``convert``: building the NumPy array.
+- ``cache``: prediction cache lookups.
+- ``predict``: model calls, including any micro-batch wait.
+- ``decode``: reading binary or NDJSON rows, excluding ``predict``.
+- ``serialize``: encoding the response.
+"""
+import bisect
+import threading
+import time
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds, from 50 microseconds to 10 seconds
+LATENCY_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+# Rows per batch, powers of two up to about a million
+SIZE_BUCKETS = tuple(2 ** power for power in range(21))
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labelvalues, value in sorted(values.items()):
+            yield self.name, _format_labels(self.labelnames, labelvalues), value
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # Per label set: a count per bucket (the last one for +Inf), then the sum
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            series = {labelvalues: (list(counts), total) for labelvalues, (counts, total) in self._series.items()}
+        for labelvalues, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, labelvalues, [('le', _format_value(bound))])
+                yield f"{self.name}_bucket", labels, cumulative
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+class StageTimer:
+    """Time the consecutive stages of one request."""
+
+    def __init__(self, histogram, endpoint):
+        self.histogram = histogram
+        self.endpoint = endpoint
+        self.totals = {}
+        self.started = self._last = time.perf_counter()
+        self._nested = 0.0
+
+    def mark(self, stage):
+        """End ``stage``, charging it the time since the previous mark not spent in ``timed`` calls."""
+        now = time.perf_counter()
+        self.add(stage, now - self._last - self._nested)
+        self._last = now
+        self._nested = 0.0
+
+    def add(self, stage, seconds):
+        self.totals[stage] = self.totals.get(stage, 0.0) + seconds
+
+    def timed(self, fn, stage):
+        """Wrap ``fn`` so the time spent in it is charged to ``stage``."""
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                self.add(stage, elapsed)
+                self._nested += elapsed
+        return wrapper
+
+    def observe(self):
+        """Record every stage of the finished request."""
+        for stage, seconds in self.totals.items():
+            self.histogram.observe(seconds, self.endpoint, stage)
+
+
+class NullTimer:
+    """A StageTimer that records nothing, used when metrics are disabled."""
+
+    def mark(self, stage):
+        pass
+
+    def add(self, stage, seconds):
+        pass
+
+    def timed(self, fn, stage):
+        return fn
+
+    def observe(self):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+class ServiceMetrics:
+    def __init__(self):
+        self.stage_seconds = Histogram(
+            'predict_stage_seconds', 'Time spent in each stage of a prediction request.', ('endpoint', 'stage')
+        )
+        self.request_seconds = Histogram(
+            'predict_request_seconds', 'Time to handle a prediction request.', ('endpoint', 'status')
+        )
+        self.batch_rows = Histogram(
+            'predict_batch_rows', 'Rows per batch prediction request.', ('format',), buckets=SIZE_BUCKETS
+        )
+        self.micro_batch_rows = Histogram(
+            'predict_micro_batch_rows', 'Rows per coalesced model call.', buckets=SIZE_BUCKETS
+        )
+        self.queue_wait_seconds = Histogram(
+            'predict_queue_wait_seconds', 'Time a single prediction waited for its micro-batch to run.'
+        )
+        self.errors = Counter('predict_errors_total', 'Prediction requests that failed.', ('endpoint', 'status'))
+        self.metrics = [
+            self.stage_seconds, self.request_seconds, self.batch_rows,
+            self.micro_batch_rows, self.queue_wait_seconds, self.errors,
+        ]
+        self._collectors = []
+
+    def timer(self, endpoint):
+        return StageTimer(self.stage_seconds, endpoint)
+
+    def finish(self, endpoint, timer, status):
+        """Record a finished request and its stages."""
+        timer.observe()
+        self.request_seconds.observe(time.perf_counter() - timer.started, endpoint, str(status))
+        if status >= 400:
+            self.errors.inc(endpoint, str(status))
+
+    def observe_micro_batch(self, rows, waits):
+        """``MicroBatcher`` hook: record a batch's size and how long each row queued."""
+        self.micro_batch_rows.observe(rows)
+        for wait in waits:
+            self.queue_wait_seconds.observe(wait)
+
+    def add_collector(self, collect):
+        """Export ``collect()``'s ``(name, type, documentation, value)`` tuples on every scrape."""
+        self._collectors.append(collect)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in metric.samples())
+        for collect in self._collectors:
+            for name, metric_type, documentation, value in collect():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                lines.append(f"{name} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,212 @@
+"""
+Model artifacts loaded from disk and swapped without a restart.
+
+``MODEL_PATH`` names a ``joblib`` artifact, usually a symlink that
+``publish`` repoints atomically at a new version. The registry stats the
+path at most every ``check_interval`` seconds and loads the new artifact
+when it changes, so every worker picks up a new version on its own while
+requests keep being served by the old one until the swap.
+
+Artifacts are loaded with ``mmap_mode='r'``: NumPy arrays stored in them
+stay backed by the page cache and are shared by every worker mapping the
+same file. scikit-learn trees copy their node arrays into private memory
+when unpickled, so to share a plain sklearn forest between gunicorn
+workers, load it in the master with ``--preload`` and let the workers
+inherit it copy-on-write.
+
+    python -m serving.registry train --output models/
+    python -m serving.registry publish models/model-20240101120000.joblib --link models/current.joblib
+"""
+import argparse
+import logging
+import os
+import resource
+import threading
+import time
+from dataclasses import dataclass, field
+
+import joblib
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_PATH = 'models/current.joblib'
+
+
+@dataclass
+class LoadedModel:
+    version: str
+    model: object
+    path: str
+    load_seconds: float
+    loaded_at: float = field(default_factory=time.time)
+
+
+def artifact_version(path):
+    """Name a version after the file a (possibly symlinked) path resolves to."""
+    return os.path.splitext(os.path.basename(os.path.realpath(path)))[0]
+
+
+class ModelRegistry:
+    def __init__(self, path, check_interval=5.0, mmap_mode='r', prepare=None):
+        self.path = path
+        self.check_interval = check_interval
+        self.mmap_mode = mmap_mode
+        # Applied to every loaded model, e.g. to compile it for another inference engine
+        self.prepare = prepare
+        self._lock = threading.Lock()
+        self._loaded = None
+        self._stamp = None
+        self._checked_at = 0.0
+        self._listeners = []
+        self.reload()
+
+    @classmethod
+    def from_model(cls, model, version, prepare=None):
+        """A registry serving an in-memory model that is never swapped."""
+        registry = cls.__new__(cls)
+        registry.path = None
+        registry.check_interval = float('inf')
+        registry.prepare = prepare
+        model = prepare(model) if prepare else model
+        registry._lock = threading.Lock()
+        registry._listeners = []
+        registry._checked_at = 0.0
+        registry._stamp = None
+        registry._loaded = LoadedModel(version=version, model=model, path=None, load_seconds=0.0)
+        return registry
+
+    def on_swap(self, callback):
+        """Call ``callback(loaded_model)`` after every swap to a new version."""
+        self._listeners.append(callback)
+
+    def current(self):
+        """Return the loaded model, swapping in a new artifact if the path changed."""
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            try:
+                self.reload()
+            except Exception:
+                # Keep serving the loaded version; a broken publish must not take the service down
+                logger.exception('Could not reload model from %s', self.path)
+        return self._loaded
+
+    def reload(self, force=False):
+        """Load the artifact if it changed since the last load; return the loaded model."""
+        with self._lock:
+            self._checked_at = time.monotonic()
+            stat = os.stat(self.path)
+            stamp = (os.path.realpath(self.path), stat.st_ino, stat.st_mtime_ns)
+            if stamp == self._stamp and not force:
+                return self._loaded
+            start = time.perf_counter()
+            model = joblib.load(self.path, mmap_mode=self.mmap_mode)
+            if self.prepare is not None:
+                model = self.prepare(model)
+            loaded = LoadedModel(
+                version=artifact_version(self.path),
+                model=model,
+                path=stamp[0],
+                load_seconds=time.perf_counter() - start
+            )
+            self._loaded, self._stamp = loaded, stamp
+        for callback in self._listeners:
+            callback(loaded)
+        return loaded
+
+    def describe(self):
+        loaded = self._loaded
+        return {
+            'version': loaded.version,
+            'path': loaded.path,
+            'load_seconds': round(loaded.load_seconds, 4),
+            'loaded_at': loaded.loaded_at,
+            'pid': os.getpid(),
+            **memory_usage(),
+        }
+
+
+def open_registry(path, check_interval=5.0, prepare=None, placeholder=None):
+    """
+    Return a registry for the artifact at ``path``.
+
+    When there is no artifact yet (create one with ``python -m serving.registry
+    train``), serve ``placeholder``, or a freshly trained placeholder model.
+    """
+    if os.path.exists(path):
+        return ModelRegistry(path, check_interval=check_interval, prepare=prepare)
+    logger.warning('No model artifact at %s; training the placeholder model', path)
+    model = placeholder if placeholder is not None else train_dummy_model()
+    return ModelRegistry.from_model(model, version='placeholder', prepare=prepare)
+
+
+def memory_usage():
+    """
+    Return this process's memory in bytes.
+
+    ``pss_bytes`` splits pages shared with other processes (such as a
+    memory-mapped or preloaded model) between them, so summing it across
+    workers gives their real footprint.
+    """
+    try:
+        usage = {}
+        with open('/proc/self/smaps_rollup') as smaps:
+            for line in smaps:
+                key, _, value = line.partition(':')
+                usage[key] = int(value.split()[0]) * 1024 if value.strip().endswith('kB') else None
+        return {
+            'rss_bytes': usage['Rss'],
+            'pss_bytes': usage['Pss'],
+            'shared_bytes': usage['Shared_Clean'] + usage['Shared_Dirty'],
+        }
+    except (OSError, KeyError):
+        # No procfs (e.g. macOS): report the peak resident size
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        rss = peak if os.uname().sysname == 'Darwin' else peak * 1024
+        return {'rss_bytes': rss, 'pss_bytes': None, 'shared_bytes': None}
+
+
+def save_model(model, directory, version=None):
+    """Write ``model`` uncompressed (compressed artifacts cannot be memory-mapped)."""
+    os.makedirs(directory, exist_ok=True)
+    version = version or time.strftime('model-%Y%m%d%H%M%S')
+    path = os.path.join(directory, f"{version}.joblib")
+    joblib.dump(model, path)
+    return path
+
+
+def publish(artifact, link):
+    """Atomically point ``link`` at ``artifact``; running registries swap on their next check."""
+    tmp = f"{link}.tmp-{os.getpid()}"
+    os.symlink(os.path.relpath(os.path.abspath(artifact), os.path.dirname(os.path.abspath(link))), tmp)
+    os.replace(tmp, link)
+
+
+def train_dummy_model(n_estimators=100, n_samples=100, random_state=42):
+    """The placeholder model the service used to train on import."""
+    from sklearn.ensemble import RandomForestRegressor
+
+    model = RandomForestRegressor(n_estimators=n_estimators, random_state=random_state)
+    model.fit(np.random.rand(n_samples, 4), np.random.rand(n_samples))
+    return model
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    train = commands.add_parser('train', help='Train the placeholder model and publish it.')
+    train.add_argument('--output', default=os.path.dirname(DEFAULT_MODEL_PATH))
+    train.add_argument('--link', default=DEFAULT_MODEL_PATH)
+
+    publish_parser = commands.add_parser('publish', help='Make an artifact the current model.')
+    publish_parser.add_argument('artifact')
+    publish_parser.add_argument('--link', default=DEFAULT_MODEL_PATH)
+
+    args = parser.parse_args(argv)
+    artifact = args.artifact if args.command == 'publish' else save_model(train_dummy_model(), args.output)
+    publish(artifact, args.link)
+    print(f"{args.link} -> {artifact}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,374 @@
+"""
+Tests for the prediction service.
+
+    python -m unittest serving.tests
+"""
+import asyncio
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import numpy as np
+from sklearn.ensemble import ExtraTreesRegressor, RandomForestRegressor
+
+from serving import codecs
+from serving.asgi import PredictionApp
+from serving.batching import MicroBatcher, Overloaded
+from serving.cache import MemoryBackend, PredictionCache
+from serving.forest import CompiledForest, compile_forest
+from serving.metrics import ServiceMetrics
+from serving.registry import ModelRegistry, publish, save_model
+
+
+def fit_forest(cls=RandomForestRegressor, n_features=4, missing=False, **kwargs):
+    rng = np.random.default_rng(0)
+    X = rng.random((200, n_features))
+    y = X @ np.arange(1, n_features + 1) + rng.random(200)
+    if missing:
+        X[rng.random(X.shape) < 0.1] = np.nan
+    return cls(n_estimators=10, random_state=0, **kwargs).fit(X, y)
+
+
+def sum_rows(X):
+    return np.asarray(X).sum(axis=1)
+
+
+class MicroBatcherTests(unittest.TestCase):
+
+    def make_batcher(self, predict_fn=sum_rows, **kwargs):
+        batcher = MicroBatcher(predict_fn, 3, **kwargs)
+        self.addCleanup(batcher.close)
+        return batcher
+
+    def test_coalesces_rows(self):
+        batches = []
+        batcher = self.make_batcher(max_wait=0.5, max_batch_size=4, on_batch=lambda rows, waits: batches.append(rows))
+        futures = [batcher.submit([i, i, i]) for i in range(4)]
+        self.assertEqual([future.result(5) for future in futures], [0, 3, 6, 9])
+        self.assertEqual(batches, [4])
+
+    def test_refuses_malformed_rows(self):
+        batcher = self.make_batcher()
+        for features in ([1, 2], [[1, 2, 3]], [1, 2, float('nan')], [1, float('inf'), 3]):
+            with self.assertRaises(ValueError):
+                batcher.submit(features)
+
+    def test_failing_row_fails_alone(self):
+        def predict(X):
+            if (X == 13).any():
+                raise ValueError('Unlucky row')
+            return sum_rows(X)
+
+        batches = []
+        batcher = self.make_batcher(
+            predict, max_wait=0.5, max_batch_size=3, on_batch=lambda rows, waits: batches.append(rows)
+        )
+        futures = [batcher.submit(row) for row in ([1, 1, 1], [13, 0, 0], [2, 2, 2])]
+        self.assertEqual(futures[0].result(5), 3)
+        with self.assertRaisesRegex(ValueError, 'Unlucky row'):
+            futures[1].result(5)
+        self.assertEqual(futures[2].result(5), 6)
+        self.assertEqual(batches, [3])
+
+    def test_overloaded(self):
+        started, release = threading.Event(), threading.Event()
+
+        def predict(X):
+            started.set()
+            release.wait(5)
+            return sum_rows(X)
+
+        batcher = self.make_batcher(predict, max_batch_size=1, max_queue=1)
+        running = batcher.submit([1, 1, 1])
+        self.assertTrue(started.wait(5))
+        queued = batcher.submit([2, 2, 2])
+        with self.assertRaises(Overloaded):
+            batcher.submit([3, 3, 3])
+        release.set()
+        self.assertEqual((running.result(5), queued.result(5)), (3, 6))
+
+
+class ModelRegistryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.link = os.path.join(self.directory, 'current.joblib')
+        self.X = np.random.default_rng(1).random((5, 4))
+
+    def test_hot_swap(self):
+        first, second = fit_forest(), fit_forest(ExtraTreesRegressor)
+        publish(save_model(first, self.directory, 'v1'), self.link)
+        registry = ModelRegistry(self.link, check_interval=0, prepare=compile_forest)
+        swapped = []
+        registry.on_swap(swapped.append)
+        self.assertEqual(registry.current().version, 'v1')
+        self.assertIsInstance(registry.current().model, CompiledForest)
+        self.assertEqual(swapped, [])
+
+        publish(save_model(second, self.directory, 'v2'), self.link)
+        loaded = registry.current()
+        self.assertEqual(loaded.version, 'v2')
+        self.assertEqual([model.version for model in swapped], ['v2'])
+        np.testing.assert_allclose(loaded.model.predict(self.X), second.predict(self.X))
+
+        # A broken artifact is logged and the loaded version keeps serving
+        broken = os.path.join(self.directory, 'v3.joblib')
+        with open(broken, 'wb') as artifact:
+            artifact.write(b'not a model')
+        publish(broken, self.link)
+        with self.assertLogs('serving.registry', 'ERROR'):
+            self.assertIs(registry.current(), loaded)
+        self.assertEqual(len(swapped), 1)
+
+    def test_checks_at_most_every_interval(self):
+        publish(save_model(fit_forest(), self.directory, 'v1'), self.link)
+        registry = ModelRegistry(self.link, check_interval=3600)
+        publish(save_model(fit_forest(ExtraTreesRegressor), self.directory, 'v2'), self.link)
+        self.assertEqual(registry.current().version, 'v1')
+        self.assertEqual(registry.reload().version, 'v2')
+
+
+class CompiledForestTests(unittest.TestCase):
+
+    def setUp(self):
+        self.X = np.random.default_rng(2).random((1000, 4))
+
+    def test_matches_sklearn(self):
+        for cls in (RandomForestRegressor, ExtraTreesRegressor):
+            with self.subTest(cls.__name__):
+                model = fit_forest(cls, max_depth=None)
+                compiled = CompiledForest.from_sklearn(model, keep_estimator=False)
+                np.testing.assert_allclose(compiled.predict(self.X), model.predict(self.X), rtol=0, atol=1e-9)
+                np.testing.assert_allclose(compiled.predict(self.X[:1]), model.predict(self.X[:1]), rtol=0, atol=1e-9)
+
+    def test_missing_features(self):
+        model = fit_forest(missing=True)
+        compiled = CompiledForest.from_sklearn(model)
+        X = self.X.copy()
+        X[::7, 2] = np.nan
+        X[::11, 0] = np.nan
+        np.testing.assert_allclose(compiled.traverse(X), model.predict(X), rtol=0, atol=1e-9)
+        X[0, 1] = np.inf
+        with self.assertRaises(ValueError):
+            compiled.traverse(X)
+
+    def test_large_batches_use_sklearn(self):
+        model = fit_forest()
+        compiled = CompiledForest.from_sklearn(model, max_rows=10)
+        with mock.patch.object(compiled, 'traverse') as traverse:
+            compiled.predict(self.X)
+            traverse.assert_not_called()
+        self.assertIs(compile_forest(compiled), compiled)
+
+    def test_refuses_other_models(self):
+        with self.assertRaises(TypeError):
+            CompiledForest.from_sklearn(RandomForestRegressor())
+        with self.assertRaises(ValueError):
+            CompiledForest.from_sklearn(fit_forest()).predict(self.X[:, :3])
+
+
+class CodecTests(unittest.TestCase):
+
+    def test_binary_round_trip(self):
+        X = np.random.default_rng(3).random((10, 4))
+        for dtype in codecs.DTYPES:
+            body = X.astype(dtype).tobytes()
+            rows, cols, parsed = codecs.parse_binary_headers('10,4', dtype, len(body), 4)
+            predictions = codecs.predict_binary(io.BytesIO(body), rows, cols, parsed, 3, sum_rows)
+            np.testing.assert_allclose(predictions, X.astype(dtype).sum(axis=1))
+        self.assertEqual(np.frombuffer(codecs.encode_binary([1, 2]), codecs.RESPONSE_DTYPE).tolist(), [1.0, 2.0])
+
+    def test_binary_errors(self):
+        for shape, dtype, length in (
+            (None, None, None),
+            ('10', None, None),
+            ('10,3', None, None),
+            ('-1,4', None, None),
+            ('10,4', '>f8', None),
+            ('10,4', None, 10),
+        ):
+            with self.subTest(shape=shape, dtype=dtype, length=length), self.assertRaises(codecs.DecodeError):
+                codecs.parse_binary_headers(shape, dtype, length, 4)
+
+        body = np.zeros((2, 4)).tobytes()
+        with self.assertRaisesRegex(codecs.DecodeError, 'after 1 of 2 rows'):
+            codecs.predict_binary(io.BytesIO(body[:-8]), 2, 4, np.dtype('<f8'), 8, sum_rows)
+        with self.assertRaisesRegex(codecs.DecodeError, 'longer than 2 rows'):
+            codecs.predict_binary(io.BytesIO(body + b'\0'), 2, 4, np.dtype('<f8'), 8, sum_rows)
+
+    def test_ndjson_round_trip(self):
+        body = b'[1, 2, 3, 4]\n\n[0.5, 0, 0, 0]\n[1, 1, 1, 1]'
+        for block_size in (4, 1 << 20):
+            with self.subTest(block_size=block_size):
+                chunks = list(codecs.iter_ndjson_chunks(io.BytesIO(body), 4, 2, block_size=block_size))
+                self.assertEqual([len(chunk) for chunk in chunks], [2, 1])
+        predictions = codecs.predict_ndjson(io.BytesIO(body), 4, 2, sum_rows)
+        self.assertEqual(''.join(codecs.iter_ndjson(predictions, 2)), '10.0\n0.5\n4.0\n')
+        self.assertEqual(len(codecs.predict_ndjson(io.BytesIO(b''), 4, 2, sum_rows)), 0)
+
+    def test_ndjson_errors(self):
+        for body, message in (
+            (b'[1, 2, 3, 4]\n[1, 2, 3]\n', 'Line 2: expected a list of 4 numbers'),
+            (b'[1, 2, 3, 4]\n\n[[1, 2, 3, 4]]\n', 'Line 3: expected a list of 4 numbers'),
+            (b'[1, 2, 3, 4]\nnot json\n', 'Line 2: '),
+            (b'["a", 2, 3, 4]\n', 'Line 1: '),
+        ):
+            with self.subTest(body=body), self.assertRaisesRegex(codecs.DecodeError, message):
+                codecs.predict_ndjson(io.BytesIO(body), 4, 2, sum_rows)
+
+
+class PredictionCacheTests(unittest.TestCase):
+
+    def test_key(self):
+        cache = PredictionCache(MemoryBackend(), decimals=3)
+        self.assertEqual(cache.key([1.0001, -0.0], 'v1'), cache.key([1.0, 0.0], 'v1'))
+        self.assertNotEqual(cache.key([1.0, 0.0], 'v1'), cache.key([1.0, 0.0], 'v2'))
+        self.assertNotEqual(cache.key([1.0, 0.0], 'v1'), cache.key([1.01, 0.0], 'v1'))
+
+    def test_key_refuses_malformed_rows(self):
+        cache = PredictionCache(MemoryBackend())
+        for features in ([[1.0, 2.0]], [[1.0], [2.0]], 1.0, [1.0]):
+            with self.subTest(features=features), self.assertRaises(ValueError):
+                cache.key(features, 'v1', n_features=2)
+        with self.assertRaises(ValueError):
+            cache.key([[1.0, 2.0]], 'v1')
+
+    def test_failing_backend_is_a_miss(self):
+        backend = mock.Mock(spec=MemoryBackend)
+        backend.get.side_effect = backend.set.side_effect = ConnectionError('Cache down')
+        cache = PredictionCache(backend)
+        with self.assertLogs('serving.cache', 'WARNING'):
+            self.assertIsNone(cache.get('key'))
+            cache.set('key', 1.0)
+        self.assertEqual((cache.misses, cache.errors), (1, 2))
+
+    def test_memory_backend_evicts(self):
+        backend = MemoryBackend(max_entries=2, ttl=60)
+        for key in 'abc':
+            backend.set(key, 1.0)
+        self.assertEqual((backend.get('a'), backend.get('c'), backend.evictions), (None, 1.0, 1))
+        backend.ttl = -1
+        backend.set('d', 2.0)
+        self.assertIsNone(backend.get('d'))
+
+
+class MetricsTests(unittest.TestCase):
+
+    def test_render(self):
+        metrics = ServiceMetrics()
+        timer = metrics.timer('single')
+        timer.timed(lambda: None, 'predict')()
+        timer.mark('parse')
+        metrics.finish('single', timer, 400)
+        metrics.observe_micro_batch(3, [0.001, 0.002, 0.003])
+        metrics.add_collector(lambda: [('prediction_cache_hits_total', 'counter', 'Hits.', 5)])
+        text = metrics.render()
+        self.assertIn('predict_stage_seconds_count{endpoint="single",stage="predict"} 1', text)
+        self.assertIn('predict_stage_seconds_count{endpoint="single",stage="parse"} 1', text)
+        self.assertIn('predict_errors_total{endpoint="single",status="400"} 1', text)
+        self.assertIn('predict_micro_batch_rows_bucket{le="4"} 1', text)
+        self.assertIn('predict_queue_wait_seconds_count 3', text)
+        self.assertIn('prediction_cache_hits_total 5', text)
+
+
+class FlaskAppTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Imported here: the service loads (or trains) its model on import
+        import app
+        cls.app = app
+        cls.client = app.app.test_client()
+
+    def test_single(self):
+        response = self.client.post('/api/predict/single', json={'features': [0.1, 0.2, 0.3, 0.4]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.post('/api/predict/single', json={'features': [0.1]}).status_code, 400)
+
+    def test_single_cached(self):
+        cache = PredictionCache(MemoryBackend())
+        with mock.patch.object(self.app, 'cache', cache):
+            for _ in range(2):
+                response = self.client.post('/api/predict/single', json={'features': [0.1, 0.2, 0.3, 0.4]})
+                self.assertEqual(response.status_code, 200)
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+            # The nested row flattens to the cached one, but is still refused
+            for features in ([[0.1, 0.2, 0.3, 0.4]], [[0.1, 0.2], [0.3, 0.4]], [0.1, 0.2]):
+                response = self.client.post('/api/predict/single', json={'features': features})
+                self.assertEqual(response.status_code, 400)
+            self.assertEqual(cache.hits, 1)
+
+    def test_batch_formats(self):
+        X = np.random.default_rng(4).random((3, 4))
+        expected = self.app.predict(X)
+        response = self.client.post(
+            '/api/predict/batch', data=X.tobytes(), content_type=codecs.BINARY,
+            headers={codecs.SHAPE_HEADER: '3,4'}
+        )
+        self.assertEqual(response.status_code, 200)
+        np.testing.assert_allclose(np.frombuffer(response.data, codecs.RESPONSE_DTYPE), expected)
+        response = self.client.post(
+            '/api/predict/batch', data='\n'.join(json.dumps(row) for row in X.tolist()), content_type=codecs.NDJSON
+        )
+        self.assertEqual(response.status_code, 200)
+        np.testing.assert_allclose([float(line) for line in response.data.split()], expected)
+
+    def test_batch_errors(self):
+        for data, content_type, headers in (
+            (np.zeros((3, 4)).tobytes(), codecs.BINARY, {}),
+            (np.zeros((3, 4)).tobytes(), codecs.BINARY, {codecs.SHAPE_HEADER: '3,5'}),
+            (np.zeros((3, 4)).tobytes(), codecs.BINARY, {codecs.SHAPE_HEADER: '4,4'}),
+            (np.zeros((3, 4)).tobytes(), codecs.BINARY, {codecs.SHAPE_HEADER: '3,4', codecs.DTYPE_HEADER: 'int'}),
+            (b'[1, 2, 3, 4]\n[1, 2]\n', codecs.NDJSON, {}),
+            (b'{"features": 1}\n', codecs.NDJSON, {}),
+        ):
+            with self.subTest(content_type=content_type, headers=headers, data=data[:20]):
+                response = self.client.post('/api/predict/batch', data=data, content_type=content_type, headers=headers)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.get_json()['status'], 'error')
+
+
+class PredictionAppTests(unittest.TestCase):
+    """Request handling of the ASGI app that runs before anything reaches the process pool."""
+
+    def call(self, app, method, path, chunks, headers=()):
+        messages = [
+            {'type': 'http.request', 'body': chunk, 'more_body': i < len(chunks) - 1} for i, chunk in enumerate(chunks)
+        ]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'http', 'method': method, 'path': path, 'headers': list(headers)}
+        asyncio.run(app(scope, receive, send))
+        return sent[0]['status'], json.loads(sent[1]['body'])
+
+    def test_body_limits(self):
+        app = PredictionApp(max_body_bytes=10, max_buffered_bytes=100)
+        status, _ = self.call(app, 'POST', '/api/predict/batch', [b'x'], headers=[(b'content-length', b'11')])
+        self.assertEqual(status, 413)
+        status, _ = self.call(app, 'POST', '/api/predict/batch', [b'x' * 6, b'x' * 6])
+        self.assertEqual(status, 413)
+        self.assertEqual(app.buffered, 0)
+
+        app.buffered = 95
+        status, body = self.call(app, 'POST', '/api/predict/batch', [b'x' * 6])
+        self.assertEqual((status, body['message']), (503, 'Too many request bytes buffered'))
+        self.assertEqual(app.buffered, 95)
+
+    def test_unknown_route(self):
+        self.assertEqual(self.call(PredictionApp(), 'GET', '/nowhere', [b''])[0], 404)
+
+
+if __name__ == '__main__':
+    unittest.main()